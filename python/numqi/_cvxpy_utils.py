@@ -0,0 +1,91 @@
+import pickle
+import functools
+import concurrent.futures
+import multiprocessing
+import numpy as np
+from tqdm.auto import tqdm
+
+# helpers shared by the cvxpy-based numerical range and entanglement solvers
+
+_CVXPY_PROBLEM_CACHE = []
+
+def _cvxpy_problem_cache(maxsize:int):
+    # functools.lru_cache for the builders of cvxpy problems, registered so that clear_sdp_cache() can free them
+    def hf0(func):
+        ret = functools.lru_cache(maxsize=maxsize)(func)
+        _CVXPY_PROBLEM_CACHE.append(ret)
+        return ret
+    return hf0
+
+
+def clear_sdp_cache():
+    r'''clear the cached (compiled) cvxpy problems
+
+    The SDP based functions, e.g. `numqi.entangle.get_ppt_ree`, `numqi.entangle.get_ABk_symmetric_extension_ree`
+    and `numqi.matrix_space.get_joint_algebraic_numerical_range`, keep the last few compiled problems alive to skip
+    the cvxpy canonicalization in repeated calls. The problems of large dimension can take a lot of memory, call this
+    function to release them.
+    '''
+    for x in _CVXPY_PROBLEM_CACHE:
+        x.cache_clear()
+
+
+def _array_to_key(x:np.ndarray):
+    # hashable key for functools.lru_cache
+    x = np.ascontiguousarray(x)
+    ret = x.tobytes(), x.shape, x.dtype.str
+    return ret
+
+
+def _key_to_array(key):
+    ret = np.frombuffer(key[0], dtype=np.dtype(key[2])).reshape(key[1])
+    return ret
+
+
+def _sdp_direction_sweep_serial(cvxP, direction, return_info, use_tqdm):
+    if isinstance(cvxP, bytes): #in worker process
+        cvxP = pickle.loads(cvxP)
+    prob,cvx_vec,cvx_obj,cvx_op,cvx_constraint = cvxP
+    obj_list = []
+    boundary_list = []
+    norm_vec_list = []
+    for vec_i in (tqdm(direction) if use_tqdm else direction):
+        cvx_vec.value = vec_i
+        prob.solve()
+        obj_list.append(cvx_obj.value)
+        if return_info:
+            boundary_list.append(cvx_op.value.copy())
+            norm_vec_list.append(cvx_constraint.dual_value.copy())
+    return obj_list, boundary_list, norm_vec_list
+
+
+def _sdp_direction_sweep(cvxP, direction, is_single, return_info, use_tqdm, num_worker):
+    # cvxP=(prob,cvx_vec,cvx_obj,cvx_op,cvx_constraint), maximize cvx_obj with cvx_vec set to each direction
+    # the problem is compiled in the first solve, the compiled problem is pickled and sent to the workers
+    num_worker = max(1, min(int(num_worker), direction.shape[0]-1))
+    if num_worker==1:
+        obj_list,boundary_list,norm_vec_list = _sdp_direction_sweep_serial(cvxP, direction, return_info, use_tqdm)
+    else:
+        # the first solve compiles the problem, so the workers receive the compiled problem
+        tmp1 = [_sdp_direction_sweep_serial(cvxP, direction[:1], return_info, False)]
+        tmp0 = pickle.dumps(cvxP)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_worker, mp_context=multiprocessing.get_context('spawn')) as executor:
+            job_list = [executor.submit(_sdp_direction_sweep_serial, tmp0, x, return_info, False)
+                            for x in np.array_split(direction[1:], num_worker)]
+            if use_tqdm:
+                for _ in tqdm(concurrent.futures.as_completed(job_list), total=len(job_list)):
+                    pass
+            tmp1 += [x.result() for x in job_list]
+        obj_list,boundary_list,norm_vec_list = [[z for y in tmp1 for z in y[x]] for x in range(3)]
+    if is_single:
+        if return_info:
+            ret = (obj_list[0], boundary_list[0], norm_vec_list[0])
+        else:
+            ret = obj_list[0]
+    else:
+        obj_list = np.array(obj_list)
+        if return_info:
+            ret = obj_list, np.stack(boundary_list, axis=0), np.stack(norm_vec_list, axis=0)
+        else:
+            ret = obj_list
+    return ret
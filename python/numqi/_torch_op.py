@@ -108,6 +108,51 @@ class PSDMatrixLogm(torch.nn.Module):
         return ret
 
 
+def _log_divided_difference(EVL, eps):
+    # F[i,j] = (log(x_i)-log(x_j))/(x_i-x_j), F[i,i] = 1/x_i, x=max(EVL,eps)
+    # derivative is zero where EVL is clamped at eps
+    x = torch.maximum(EVL, eps)
+    xi = x.unsqueeze(-1)
+    xj = x.unsqueeze(-2)
+    r = xi/xj - 1
+    small = r.abs() < 1e-3
+    tmp0 = torch.where(small, torch.ones_like(r), r)
+    # log1p(r)/r = 1 - r/2 + r^2/3 - ..., truncation error r^6/7 < 1e-18 for near-degenerate pair
+    tmp1 = 1 + r*(-1/2 + r*(1/3 + r*(-1/4 + r*(1/5 - r/6))))
+    ret = torch.where(small, tmp1, torch.log1p(tmp0)/tmp0) / xj
+    mask = EVL > eps
+    ret = ret * (mask.unsqueeze(-1) | mask.unsqueeze(-2))
+    ret = torch.diagonal_scatter(ret, mask/x, dim1=-2, dim2=-1)
+    return ret
+
+
+class PSDMatrixLogmEigen(torch.autograd.Function):
+    # it's user's duty to check the Hermitian, PSD. eigenvalues are clamped at machine epsilon
+    # backward: Daleckii-Krein formula with divided difference of log, one eigh for forward and backward
+    @staticmethod
+    def forward(ctx, matA):
+        shape = matA.shape
+        N0 = shape[-1]
+        matA = matA.reshape(-1, N0, N0)
+        EVL,EVC = torch.linalg.eigh(matA)
+        eps = torch.tensor(torch.finfo(EVL.dtype).eps, dtype=EVL.dtype, device=EVL.device)
+        tmp0 = torch.log(torch.maximum(EVL, eps))
+        ret = ((EVC*tmp0.unsqueeze(1)) @ EVC.transpose(1,2).conj()).reshape(shape)
+        ctx.save_for_backward(EVL, EVC)
+        return ret
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        EVL,EVC = ctx.saved_tensors
+        shape = grad_output.shape
+        N0 = shape[-1]
+        eps = torch.tensor(torch.finfo(EVL.dtype).eps, dtype=EVL.dtype, device=EVL.device)
+        EVCh = EVC.transpose(1,2).conj()
+        tmp0 = (EVCh @ grad_output.reshape(-1, N0, N0) @ EVC) * _log_divided_difference(EVL, eps)
+        ret = (EVC @ tmp0 @ EVCh).reshape(shape)
+        return ret
+
+
 @functools.lru_cache
 def get_PSDMatrixLogm(num_sqrtm:int, pade_order:int, device:str='cpu'):
     ret = PSDMatrixLogm(num_sqrtm, pade_order, device)
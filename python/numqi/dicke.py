@@ -1,8 +1,11 @@
 import itertools
+import functools
 import numpy as np
 import scipy.special
 import torch
 
+import numqi.utils
+
 
 def _dicke_hf0(klist, base, dim, num_qudit):
     ret = np.zeros(dim**num_qudit, dtype=np.float64)
@@ -72,8 +75,41 @@ def get_dicke_klist(num_qudit:int, dim:int):
     '''
     assert dim>=2
     assert num_qudit>=1
-    hf0 = lambda d,n: [(n,)] if (d<=1) else [(x,)+y for x in range(n+1) for y in hf0(d-1,n-x)]
-    ret = hf0(dim, num_qudit)
+    ret = [tuple(x) for x in _get_dicke_klist_np(num_qudit, dim).tolist()]
+    return ret
+
+
+def _get_dicke_klist_np(num_qudit:int, dim:int):
+    # same order as get_dicke_klist (lexicographic), stars and bars: bar positions to occupation number
+    tmp0 = itertools.chain.from_iterable(itertools.combinations(range(num_qudit+dim-1), dim-1))
+    tmp0 = np.fromiter(tmp0, dtype=np.int64).reshape(-1, dim-1)
+    tmp1 = np.full((tmp0.shape[0],1), -1, dtype=np.int64)
+    tmp2 = np.full((tmp0.shape[0],1), num_qudit+dim-1, dtype=np.int64)
+    ret = np.diff(np.concatenate([tmp1,tmp0,tmp2], axis=1), axis=1) - 1
+    return ret
+
+
+@functools.lru_cache
+def _get_binom_table(N:int, K:int):
+    # ret[m,q] = binom(m,q), exact in int64 for moderate size
+    ret = np.zeros((N+1,K+1), dtype=np.int64)
+    ret[:,0] = 1
+    for ind0 in range(1,N+1):
+        ret[ind0,1:] = ret[ind0-1,1:] + ret[ind0-1,:-1]
+    ret.flags.writeable = False
+    return ret
+
+
+def _get_dicke_klist_rank(klist_np:np.ndarray, num_qudit:int):
+    # index of klist in get_dicke_klist (combinatorial number system), klist_np: (N,dim) int
+    dim = klist_np.shape[1]
+    binom = _get_binom_table(num_qudit+dim, dim)
+    remain = num_qudit - np.cumsum(klist_np, axis=1) + klist_np
+    ret = np.zeros(klist_np.shape[0], dtype=np.int64)
+    for ind0 in range(dim-1):
+        # number of klist with the same prefix and smaller value at position ind0 (hockey-stick identity)
+        tmp0 = dim-ind0-1
+        ret += binom[remain[:,ind0]+tmp0, tmp0] - binom[remain[:,ind0]-klist_np[:,ind0]+tmp0, tmp0]
     return ret
 
 
@@ -113,14 +149,25 @@ def get_partial_trace_ABk_to_AB_index(num_qudit:int, dim:int, return_tensor=Fals
     Returns:
         ret (list,np.ndarray): if `return_tensor=False`, list of tuple, each tuple is of length 3,
             and the first two elements are list of int, the third element is np.ndarray of `float64`.
-            if `return_tensor=True`, return $B_{rsab}$, shape (dim, dim, #klist, #klist)
+            if `return_tensor=True`, return $B_{rsab}$, shape (dim, dim, #klist, #klist).
+            The arrays are copies of the cached ones and can be modified freely
     '''
+    ret = _get_partial_trace_ABk_to_AB_index(num_qudit, dim, return_tensor)
+    if return_tensor:
+        ret = ret.copy()
+    else:
+        ret = [tuple(y.copy() for y in x) for x in ret]
+    return ret
+
+
+@functools.lru_cache
+@numqi.utils.disk_cache()
+def _get_partial_trace_ABk_to_AB_index(num_qudit:int, dim:int, return_tensor:bool):
+    # cached, the arrays are read-only, see get_partial_trace_ABk_to_AB_index
     assert (dim>1) and (num_qudit>=1)
-    klist = get_dicke_klist(num_qudit, dim)
+    klist_np = _get_dicke_klist_np(num_qudit, dim)
     len_klist = get_dicke_number(num_qudit, dim)
-    assert len(klist)==len_klist
-    klist_to_index = {y:x for x,y in enumerate(klist)}
-    klist_np = np.array(klist, dtype=np.int64)
+    assert klist_np.shape[0]==len_klist
     Bij = []
     for ind0 in range(dim):
         for ind1 in range(dim):
@@ -130,16 +177,11 @@ def get_partial_trace_ABk_to_AB_index(num_qudit:int, dim:int, return_tensor=Fals
                 tmp2 = klist_np[:,ind0] / num_qudit
                 Bij.append((tmp0,tmp1,tmp2))
             else:
-                tmp0 = []
-                for x,y in enumerate(klist):
-                    tmp1 = list(y)
-                    tmp1[ind0] -= 1
-                    tmp1[ind1] += 1
-                    tmp1 = tuple(tmp1)
-                    if tmp1 in klist_to_index:
-                        tmp0.append((x,klist_to_index[tmp1]))
-                tmp1 = np.array([x[0] for x in tmp0], dtype=np.int64)
-                tmp2 = np.array([x[1] for x in tmp0], dtype=np.int64)
+                tmp1 = np.nonzero(klist_np[:,ind0]>0)[0]
+                tmp0 = klist_np[tmp1]
+                tmp0[:,ind0] -= 1
+                tmp0[:,ind1] += 1
+                tmp2 = _get_dicke_klist_rank(tmp0, num_qudit)
                 tmp3 = np.sqrt(klist_np[tmp1,ind0]*klist_np[tmp2,ind1])/num_qudit
                 Bij.append((tmp1,tmp2,tmp3))
     if return_tensor:
@@ -148,8 +190,12 @@ def get_partial_trace_ABk_to_AB_index(num_qudit:int, dim:int, return_tensor=Fals
             indI,indJ,value = Bij[ind0]
             Brsab[ind0,indI,indJ] = value
         Brsab = Brsab.reshape(dim,dim,len_klist,len_klist)
+        Brsab.flags.writeable = False
         ret = Brsab
     else:
+        for x in Bij:
+            for y in x:
+                y.flags.writeable = False
         ret = Bij
     return ret
 
@@ -160,18 +206,88 @@ def get_dicke_number(num_qudit:int, dim:int):
     return ret
 
 
+def get_partial_trace_ABk_to_AB_kernel(num_qudit:int, dim:int):
+    r'''return precomputed kernel for `numqi.dicke.partial_trace_ABk_to_AB`
+
+    For fixed $r\neq s$, every Dicke index $b$ appears at most once in $B_{rsab}$, so each block is a gather
+    with scaling. Only blocks $r<s$ are stored (blocks $r>s$ follow from hermiticity),
+    and blocks $r=s$ are diagonal in the Dicke basis.
+
+    Parameters:
+        num_qudit (int): number of qudit
+        dim (int): dimension of qudit
+
+    Returns:
+        diag (np.ndarray): shape (dim, #klist), float64, diagonal of $B_{rr}$
+        index (np.ndarray): shape (dim*(dim-1)/2, #klist), int64, gather index of $B_{rs}$ for $r<s$
+        value (np.ndarray): shape (dim*(dim-1)/2, #klist), float64, gather value of $B_{rs}$ for $r<s$, zero if no entry
+    '''
+    Bij = _get_partial_trace_ABk_to_AB_index(num_qudit, dim, False)
+    num_klist = len(Bij[0][0])
+    diag = np.stack([Bij[x*dim+x][2] for x in range(dim)])
+    tmp0 = [(x,y) for x in range(dim) for y in range(x+1,dim)]
+    index = np.zeros((len(tmp0), num_klist), dtype=np.int64)
+    value = np.zeros((len(tmp0), num_klist), dtype=np.float64)
+    for ind0,(x,y) in enumerate(tmp0):
+        tmp1,tmp2,tmp3 = Bij[x*dim+y]
+        index[ind0,tmp2] = tmp1
+        value[ind0,tmp2] = tmp3
+    return diag, index, value
+
+
 # old name: qudit_partial_trace_AC_to_AB
 def partial_trace_ABk_to_AB(state, dicke_Bij):
-    assert state.ndim==2
-    dimA,dimBk = state.shape
-    dimB = int(np.sqrt(len(dicke_Bij)))
-    assert len(dicke_Bij)==dimB*dimB
-    ret = []
+    r'''partial trace of the state in $\mathcal{H}_A\otimes\mathrm{Sym}^k(\mathcal{H}_B)$ to $\mathcal{H}_A\otimes\mathcal{H}_B$
+
+    Parameters:
+        state (np.ndarray,torch.Tensor): shape (dimA,#klist), or (batch,dimA,#klist) for batch
+        dicke_Bij (tuple,list): kernel from `numqi.dicke.get_partial_trace_ABk_to_AB_kernel` (recommended),
+            or index list from `numqi.dicke.get_partial_trace_ABk_to_AB_index`. For `torch.Tensor` state,
+            the elements should be `torch.Tensor` too (complex dtype for the values avoids dtype promotion)
+
+    Returns:
+        ret (np.ndarray,torch.Tensor): shape (dimA*dimB,dimA*dimB), or (batch,dimA*dimB,dimA*dimB) for batch
+    '''
+    assert state.ndim in (2,3)
+    is_torch = isinstance(state, torch.Tensor)
+    shape = state.shape
+    dimA,dimBk = shape[-2:]
+    state = state.reshape(-1, dimA, dimBk)
     state_conj = state.conj()
-    for ind0,ind1,value in dicke_Bij:
-        ret.append((state[:,ind0] * value) @ state_conj[:,ind1].T)
-    if isinstance(state, torch.Tensor):
-        ret = torch.stack(ret, dim=2).reshape(dimA,dimA,dimB,dimB).transpose(1,2).reshape(dimA*dimB,dimA*dimB)
+    if isinstance(dicke_Bij, tuple) and (len(dicke_Bij)==3) and hasattr(dicke_Bij[0], 'ndim'):
+        diag,index,value = dicke_Bij
+        dimB = diag.shape[0]
+        N0 = state.shape[0]
+        tmp0 = (state[:,None]*diag[:,None]).reshape(N0, dimB*dimA, dimBk)
+        ret_diag = (tmp0 @ state_conj.swapaxes(1,2)).reshape(N0, dimB, dimA, dimA)
+        if is_torch:
+            tmp0 = torch.index_select(state, 2, index.reshape(-1))
+        else:
+            tmp0 = np.take(state, index.reshape(-1), axis=2)
+        tmp0 = (tmp0.reshape(N0, dimA, -1, dimBk) * value).reshape(N0, -1, dimBk)
+        ret_offdiag = (tmp0 @ state_conj.swapaxes(1,2)).reshape(N0, dimA, -1, dimA)
+        indR,indS = np.triu_indices(dimB, k=1)
+        indD = np.arange(dimB)
+        if is_torch:
+            ret = state.new_zeros(N0, dimA, dimB, dimA, dimB)
+            indR,indS,indD = [torch.from_numpy(x) for x in (indR,indS,indD)]
+            ret[:,:,indD,:,indD] = ret_diag.permute(1,0,2,3)
+            ret[:,:,indR,:,indS] = ret_offdiag.permute(2,0,1,3)
+            ret[:,:,indS,:,indR] = ret_offdiag.conj().permute(2,0,3,1)
+        else:
+            ret = np.zeros((N0, dimA, dimB, dimA, dimB), dtype=np.result_type(state.dtype, value.dtype))
+            ret[:,:,indD,:,indD] = ret_diag.transpose(1,0,2,3)
+            ret[:,:,indR,:,indS] = ret_offdiag.transpose(2,0,1,3)
+            ret[:,:,indS,:,indR] = ret_offdiag.conj().transpose(2,0,3,1)
     else:
-        ret = np.stack(ret, axis=2).reshape(dimA,dimA,dimB,dimB).transpose(0,2,1,3).reshape(dimA*dimB,dimA*dimB)
+        dimB = int(np.sqrt(len(dicke_Bij)))
+        assert len(dicke_Bij)==dimB*dimB
+        ret = []
+        for ind0,ind1,value in dicke_Bij:
+            ret.append((state[:,:,ind0] * value) @ state_conj[:,:,ind1].swapaxes(1,2))
+        if is_torch:
+            ret = torch.stack(ret, dim=3).reshape(-1,dimA,dimA,dimB,dimB).permute(0,1,3,2,4)
+        else:
+            ret = np.stack(ret, axis=3).reshape(-1,dimA,dimA,dimB,dimB).transpose(0,1,3,2,4)
+    ret = ret.reshape(*shape[:-2], dimA*dimB, dimA*dimB)
     return ret
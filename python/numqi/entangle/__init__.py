@@ -1,9 +1,9 @@
 from ._misc import (hf_interpolate_dm, check_swap_witness, get_dm_numerical_range,
             get_density_matrix_plane, get_density_matrix_boundary, check_reduction_witness,
             get_negativity, get_dm_cross_section_moment,
-            is_dm_cross_section_similar, group_dm_cross_section_moment)
+            is_dm_cross_section_similar, group_dm_cross_section_moment, get_adaptive_boundary)
 from .upb import (load_upb, upb_to_bes, get_upb_product,
-                  LocalUnitaryEquivalentModel, BESNumEigenModel, BESNumEigen3qubitModel)
+                  LocalUnitaryEquivalentModel, BESNumEigenModel, BESNumEigen3qubitModel, search_bes_batch)
 from .ppt import (get_ppt_numerical_range, get_ppt_boundary, is_ppt, get_generalized_ppt_boundary, is_generalized_ppt,
                   cvx_matrix_xlogx, cvx_matrix_mlogx, get_ppt_ree, get_dm_cross_section_boundary, plot_dm_cross_section)
 from .cha import CHABoundaryBagging, AutodiffCHAREE
@@ -15,6 +15,7 @@ from .symext import (SymmetricExtABkIrrepModel, is_ABk_symmetric_ext, is_ABk_sym
 from .eof import (get_concurrence_2qubit, get_concurrence_pure, get_eof_pure, get_eof_2qubit,
                 EntanglementFormationModel, ConcurrenceModel)
 from .measure import DensityMatrixGMEModel, get_gme_2qubit, get_linear_entropy_entanglement_ppt, DensityMatrixLinearEntropyModel
+from numqi._cvxpy_utils import clear_sdp_cache
 
 from . import upb
 from . import ppt
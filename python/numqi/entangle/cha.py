@@ -1,10 +1,10 @@
 import torch
 import numpy as np
-import cvxpy
 from tqdm.auto import tqdm
 import contextlib
 import scipy.linalg
 import math
+import highspy
 
 import numqi.gellmann
 import numqi.random
@@ -13,7 +13,8 @@ import numqi.optimize
 import numqi.manifold
 from numqi.manifold.plot import plot_cha_trivialization_map
 
-from ._misc import get_density_matrix_boundary, hf_interpolate_dm, _ree_bisection_solve
+from ._misc import (get_density_matrix_boundary, hf_interpolate_dm, _ree_bisection_solve,
+                _get_warm_start_theta0, _get_model_numerical_range, _reduce_batch_loss, _get_dm_target_torch)
 
 # TODO docs/api
 
@@ -48,11 +49,73 @@ def _cha_reset_state(ketA, ketB, probability, threshold, norm, np_rng, indexR=No
     return ret
 
 
+def _product_state_to_gellmann(ketA, ketB):
+    # columns of the LP: Gell-Mann vectors (traceless part, non-redundant real coordinates) of the product states
+    tmp0 = np.einsum(ketA, [0,1], ketB, [0,2], [0,1,2], optimize=True).reshape(ketA.shape[0], -1)
+    ret = numqi.gellmann.dm_to_gellmann_basis(tmp0[:,:,np.newaxis]*tmp0[:,np.newaxis].conj())
+    return ret
+
+
+def _highs_add_column(highs, column):
+    # append columns (g,1) of lambda, all with zero cost and lambda>=0
+    num_column,num_row = column.shape
+    tmp0 = np.concatenate([column, np.ones((num_column,1))], axis=1).reshape(-1)
+    tmp1 = np.arange(num_column, dtype=np.int32)*(num_row+1)
+    tmp2 = np.tile(np.arange(num_row+1, dtype=np.int32), num_column)
+    highs.addCols(num_column, np.zeros(num_column), np.zeros(num_column), np.full(num_column, highspy.kHighsInf),
+                tmp0.size, tmp1, tmp2, tmp0)
+
+
+def _highs_cha_lp(target, column):
+    # variable (beta,lambda), maximize beta, s.t. column^T lambda - beta*target = 0, sum(lambda)=1, lambda>=0
+    num_row = target.shape[0]
+    highs = highspy.Highs()
+    highs.setOptionValue('output_flag', False)
+    highs.setOptionValue('presolve', 'off') #presolve costs more than it saves for this small dense LP
+    tmp0 = np.zeros(num_row+1, dtype=np.float64)
+    tmp0[-1] = 1
+    highs.addRows(num_row+1, tmp0, tmp0, 0, np.zeros(num_row+1, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0))
+    highs.addCols(1, np.array([-1.0]), np.array([-highspy.kHighsInf]), np.array([highspy.kHighsInf]),
+                num_row, np.zeros(1, dtype=np.int32), np.arange(num_row, dtype=np.int32), -target)
+    _highs_add_column(highs, column)
+    return highs
+
+
+def _cha_column_generation(witness, dimA, dimB, num_column, np_rng, num_start=None, num_step=10, eps=1e-6):
+    # maximize <ab|W|ab> over product states by alternating eigen-decomposition (seesaw), batched over random starts
+    num_start = (4*num_column) if (num_start is None) else num_start
+    witness = witness.reshape(dimA, dimB, dimA, dimB)
+    ketB = np_rng.normal(size=(num_start,dimB*2)).view(np.complex128)
+    for _ in range(num_step):
+        tmp0 = np.einsum(witness, [1,2,3,4], ketB.conj(), [0,2], ketB, [0,4], [0,1,3], optimize=True)
+        ketA = np.linalg.eigh(tmp0)[1][:,:,-1]
+        tmp0 = np.einsum(witness, [1,2,3,4], ketA.conj(), [0,1], ketA, [0,3], [0,2,4], optimize=True)
+        EVL,EVC = np.linalg.eigh(tmp0)
+        ketB = EVC[:,:,-1]
+    value = EVL[:,-1]
+    # different starts often converge to the same local maximum
+    ind_select = []
+    for ind0 in np.argsort(value)[::-1]:
+        if len(ind_select)==num_column:
+            break
+        if ind_select:
+            tmp0 = np.abs(ketA[ind_select] @ ketA[ind0].conj())**2 * np.abs(ketB[ind_select] @ ketB[ind0].conj())**2
+            if tmp0.max() > 1-eps:
+                continue
+        ind_select.append(ind0)
+    ind_select = np.array(ind_select, dtype=np.int64)
+    ret = ketA[ind_select], ketB[ind_select], value[ind_select]
+    return ret
+
+
 class CHABoundaryBagging:
     r'''Convex Hull Approximation with Bagging
 
     Separability-entanglement classifier via machine learning
     [doi-link](https://doi.org/10.1103/PhysRevA.98.012315)
+
+    The linear programming (LP) is formulated in the Gell-Mann basis and solved by HiGHS. In each iteration, only the
+    columns of the replaced product states are recomputed, and the LP is warm started from the previous basis.
     '''
     def __init__(self, dim:tuple[int], num_state:int|None=None):
         r'''initialize the model
@@ -69,15 +132,14 @@ class CHABoundaryBagging:
         # 3*dimA*dimB*dimA*dimB looks good for 3x3 bipartite system
         self.num_state = num_state
 
-        self.cvx_beta = cvxpy.Variable(name='beta')
-        self.cvx_lambda = cvxpy.Variable(num_state, name='lambda')
-        self.cvx_A_r = cvxpy.Parameter((num_state,dimA*dimB*dimA*dimB))
-        self.cvx_A_i = cvxpy.Parameter((num_state,dimA*dimB*dimA*dimB))
-        self.cvx_obj = cvxpy.Maximize(self.cvx_beta)
-        self.cvx_problem = None
         self.dm_target = None
         self.ketA = None
         self.ketB = None
+        self.lambda_ = None
+        self.dual = None
+        self._target_gellmann = None
+        self._column = None
+        self._highs = None
 
     def _rand_init_state(self, np_rng, max_retry):
         assert max_retry>0
@@ -88,27 +150,55 @@ class CHABoundaryBagging:
         for _ in range(max_retry):
             self.ketA = hf0(self.num_state, self.dimA)
             self.ketB = hf0(self.num_state, self.dimB)
-            beta = self._cvxpy_solve()
+            beta = self._lp_solve()
             if (beta is not None) and (not math.isinf(beta)):
                 break
         else:
             raise RuntimeError('Failed to find a good initial state')
-        ind0 = np.argsort(self.cvx_lambda.value)[::-1]
+        ind0 = np.argsort(self.lambda_)[::-1]
         self.ketA = self.ketA[ind0]
         self.ketB = self.ketB[ind0]
 
-    def _cvxpy_solve(self):
-        N0 = self.dimA*self.dimB
-        tmp0 = np.einsum(self.ketA,[0,1],self.ketA.conj(),[0,3],self.ketB,[0,2],self.ketB.conj(),[0,4],[0,1,2,3,4],optimize=True)
-        tmp0 = (tmp0.reshape(-1,N0,N0) - np.eye(N0)/N0).reshape(-1,N0*N0)
-        self.cvx_A_r.value = tmp0.real
-        self.cvx_A_i.value = tmp0.imag
-        ret = self.cvx_problem.solve(ignore_dpp=True) #ECOS solver
-        # ret and self.cvx_lambda.value could be None if num_state is too small
+    def _lp_solve(self, index:np.ndarray|None=None):
+        # index: the replaced product states since the last call, the LP is rebuilt if None
+        if index is None:
+            self._column = _product_state_to_gellmann(self.ketA, self.ketB)
+            self._highs = _highs_cha_lp(self._target_gellmann, self._column)
+        elif len(index):
+            index = np.unique(index) #HiGHS requires an increasing index set
+            column_new = _product_state_to_gellmann(self.ketA[index], self.ketB[index])
+            # the basis of the kept columns is reused, the new columns are appended at the end
+            self._highs.deleteCols(len(index), (index+1).astype(np.int32))
+            _highs_add_column(self._highs, column_new)
+            ind_keep = np.delete(np.arange(self._column.shape[0]), index)
+            tmp0 = np.concatenate([ind_keep, index])
+            self.ketA = self.ketA[tmp0]
+            self.ketB = self.ketB[tmp0]
+            self._column = np.concatenate([self._column[ind_keep], column_new], axis=0)
+        self._highs.run()
+        is_success = self._highs.getModelStatus()==highspy.HighsModelStatus.kOptimal
+        if is_success:
+            tmp0 = self._highs.getSolution()
+            x = np.array(tmp0.col_value)
+            self.lambda_ = x[1:]
+            self.dual = np.array(tmp0.row_dual)
+            ret = x[0]
+        else:
+            # infeasible if num_state is too small
+            ret = None
+        return ret
+
+    def _get_new_column(self, num_column:int, np_rng):
+        # column generation: product states with negative reduced cost w.r.t. the dual solution of the LP
+        # reduced cost of a column (g,1) is -(dual[:-1]@g + dual[-1]), and dual[:-1]@g = Tr[rho W]/2
+        witness = numqi.gellmann.gellmann_basis_to_matrix(np.append(self.dual[:-1], 0))
+        ketA,ketB,value = _cha_column_generation(witness, self.dimA, self.dimB, num_column, np_rng)
+        mask = (value/2 + self.dual[-1]) > 0
+        ret = ketA[mask], ketB[mask]
         return ret
 
     def solve(self, dm:np.ndarray, maxiter:int=150, norm2_init:float=1, decay_rate:float=0.97, threshold:float=1e-7,
-                num_init_retry:int=10, use_tqdm:bool=False, return_info:bool=False, seed:None|int=None):
+                num_init_retry:int=10, use_tqdm:bool=False, return_info:bool=False, seed:None|int=None, num_column:int=0):
         r'''solve the convex hull approximation
 
         Parameters:
@@ -116,12 +206,14 @@ class CHABoundaryBagging:
             maxiter (int): maximum number of iterations, default to 150
             norm2_init (float): initial norm2 bound, default to 1
             decay_rate (float): decay rate of the norm2 bound, default to 0.97
-            threshold (float): threshold for the probability, default to 1e-7. if `solver=MOSEK`,
-                    then a more precise threshold is required, otherwise the solver will fail sometimes
+            threshold (float): threshold for the probability, default to 1e-7
             num_init_retry (int): number of retries for the initial state, default to 10
             use_tqdm (bool): use tqdm, default to False
             return_info (bool): return the information of the optimization, default to False
             seed (int): random seed, default to None
+            num_column (int): column generation, number of product states (at most) added in each iteration.
+                The new product states maximize the violation of the LP dual (a separable witness), and they replace the
+                low probability states before the random perturbation. Default to 0 (random perturbation only)
 
         Returns:
             beta (float): the optimal beta, boundary length
@@ -132,35 +224,35 @@ class CHABoundaryBagging:
         assert abs(np.trace(dm)-1) < 1e-10
         assert np.abs(dm-dm.T.conj()).max() < 1e-10
         self.dm_target = dm.copy() #maybe not necessary
-        dm_normed = (dm - np.eye(N0)/N0).reshape(-1) / numqi.gellmann.dm_to_gellmann_norm(dm)
-        cvx_constrants = [
-            self.cvx_beta*dm_normed.real==self.cvx_lambda @ self.cvx_A_r,
-            self.cvx_beta*dm_normed.imag==self.cvx_lambda @ self.cvx_A_i,
-            self.cvx_lambda>=0,
-            cvxpy.sum(self.cvx_lambda)==1,
-        ]
-        self.cvx_problem = cvxpy.Problem(self.cvx_obj, cvx_constrants)
+        self._target_gellmann = numqi.gellmann.dm_to_gellmann_basis(dm) / numqi.gellmann.dm_to_gellmann_norm(dm)
 
         np_rng = numqi.random.get_numpy_rng(seed)
         if num_init_retry>0:
             self._rand_init_state(np_rng, num_init_retry)
-        beta_history = [self._cvxpy_solve()]
-        assert beta_history[-1] is not None, 'cvxpy solve failed, num_state might be too small'
+        beta_history = [self._lp_solve()]
+        assert beta_history[-1] is not None, 'LP solve failed, num_state might be too small'
         norm2_bound = norm2_init
         with (tqdm(range(maxiter)) if use_tqdm else contextlib.nullcontext()) as pbar:
             for _ in (pbar if use_tqdm else range(maxiter)):
                 if use_tqdm:
                     pbar.set_postfix_str(f'beta={beta_history[-1]:.5f}, eps={norm2_bound:.4f}')
-                mask,tmp2,tmp3 = _cha_reset_state(self.ketA, self.ketB, self.cvx_lambda.value, threshold, norm2_bound, np_rng)
+                mask,tmp2,tmp3 = _cha_reset_state(self.ketA, self.ketB, self.lambda_, threshold, norm2_bound, np_rng)
                 if mask is not None:
-                    self.ketA[mask] = tmp2
-                    self.ketB[mask] = tmp3
+                    index = np.nonzero(mask)[0]
+                    if num_column>0:
+                        tmp4,tmp5 = self._get_new_column(min(num_column, len(index)), np_rng)
+                        tmp2[:len(tmp4)] = tmp4
+                        tmp3[:len(tmp5)] = tmp5
+                    self.ketA[index] = tmp2
+                    self.ketB[index] = tmp3
+                else:
+                    index = np.zeros(0, dtype=np.int64)
                 norm2_bound *= decay_rate
-                beta_history.append(self._cvxpy_solve())
+                beta_history.append(self._lp_solve(index))
         beta = beta_history[-1]
         if return_info:
-            mask = self.cvx_lambda.value > 0
-            ret = beta, (self.ketA[mask],self.ketB[mask],self.cvx_lambda.value[mask], beta_history)
+            mask = self.lambda_ > 0
+            ret = beta, (self.ketA[mask],self.ketB[mask],self.lambda_[mask], beta_history)
         else:
             ret = beta
         return ret
@@ -169,13 +261,15 @@ class CHABoundaryBagging:
 # TODO rename ConvexHullApproximationModel
 class AutodiffCHAREE(torch.nn.Module):
     '''Gradient descent model for convex hull approximation to separable states'''
-    def __init__(self, dim:tuple[int], num_state:int|None=None, distance_kind:str='ree'):
+    def __init__(self, dim:tuple[int], num_state:int|None=None, distance_kind:str='ree', batch_size:int|None=None):
         r'''initialize the model
 
         Parameters:
             dim (tuple[int]): dimension of the bipartite system, len(dim) must be 2
             num_state (int): number of states in the convex hull, default to 2*dim0*dim1 (seems to work well)
             distance_kind (str): 'gellmann' or 'ree', default to 'ree'
+            batch_size (int|None): if not None, solve a batch of target density matrices at once, the loss is summed
+                over the batch, see `numqi.optimize.minimize_batch`
         '''
         super().__init__()
         assert len(dim)==2
@@ -189,24 +283,25 @@ class AutodiffCHAREE(torch.nn.Module):
         self.num_state = num_state
         self.dim0 = dim0
         self.dim1 = dim1
-        self.manifold = numqi.manifold.SeparableDensityMatrix(dim0, dim1, num_state, dtype=torch.complex128)
+        self.batch_size = batch_size
+        self.manifold = numqi.manifold.SeparableDensityMatrix(dim0, dim1, num_state, batch_size=batch_size, dtype=torch.complex128)
 
+        self.batch_mask = None
+        self.loss_batch = None
         self.dm_torch = None
         self.dm_target = None
         self.tr_rho_log_rho = None
         self.expect_op_T_vec = None
-        self._torch_logm = ('pade',6,8) #set it by user
+        self._torch_logm = 'eigen' #set it by user, 'eigen' or ('pade',6,8)
 
     def set_dm_target(self, rho:np.ndarray):
         r'''set the target density matrix
 
         Parameters:
-            rho (np.ndarray): target density matrix
+            rho (np.ndarray): target density matrix, `shape=(batch_size,N,N)` if `batch_size` is not None
         '''
-        assert (rho.shape[0]==(self.dim0*self.dim1)) and (rho.shape[0]==rho.shape[1])
         self.expect_op_T_vec = None
-        self.dm_target = torch.tensor(rho, dtype=torch.complex128)
-        self.tr_rho_log_rho = -numqi.utils.get_von_neumann_entropy(rho)
+        self.dm_target,self.tr_rho_log_rho = _get_dm_target_torch(rho, self.batch_size, self.dim0*self.dim1)
 
     def set_expectation_op(self, op:np.ndarray):
         r'''set the expectation operator
@@ -219,19 +314,26 @@ class AutodiffCHAREE(torch.nn.Module):
         self.expect_op_T_vec = torch.tensor(op.T.reshape(-1), dtype=torch.complex128)
 
     def forward(self):
-        dm_torch = self.manifold().reshape(self.dim0*self.dim1, -1)
+        N0 = self.dim0*self.dim1
+        dm_torch = self.manifold().reshape(-1, N0, N0)
+        if self.batch_size is None:
+            dm_torch = dm_torch[0]
         self.dm_torch = dm_torch.detach()
         if self.dm_target is not None:
             if self.distance_kind=='gellmann':
                 loss = numqi.gellmann.get_density_matrix_distance2(self.dm_target, dm_torch)
             else:
                 loss = numqi.utils.get_relative_entropy(self.dm_target, dm_torch, self.tr_rho_log_rho, self._torch_logm)
-        else:
+        elif self.batch_size is None:
             loss = torch.dot(dm_torch.reshape(-1), self.expect_op_T_vec).real
+        else:
+            loss = (dm_torch.reshape(self.batch_size, -1) @ self.expect_op_T_vec).real
+        if self.batch_size is not None:
+            loss = _reduce_batch_loss(self, loss)
         return loss
 
     def get_boundary(self, dm0:np.ndarray, xtol:float=1e-4, converge_tol:float=1e-10, threshold:float=1e-7, num_repeat:int=1,
-                    use_tqdm:bool=True, return_info:bool=False, seed:int|None=None):
+                    use_tqdm:bool=True, return_info:bool=False, warm_start:bool=True, seed:int|None=None):
         r'''get the boundary of the convex hull approximation
 
         Parameters:
@@ -242,28 +344,34 @@ class AutodiffCHAREE(torch.nn.Module):
             num_repeat (int): number of repeats for the optimization, default to 1
             use_tqdm (bool): use tqdm, default to True
             return_info (bool): return the information of the optimization, default to False
+            warm_start (bool): start the optimization from the optimum of the nearest solved beta, default to True
             seed (int): random seed, default to None
 
         Returns:
             beta (float): the optimal beta, boundary length
             info (np.ndarray): the information of the optimization
         '''
+        assert self.batch_size is None
         beta_u = get_density_matrix_boundary(dm0)[1]
         dm0_norm = numqi.gellmann.dm_to_gellmann_norm(dm0)
         np_rng = numqi.random.get_numpy_rng(seed)
+        theta_cache = dict()
         def hf0(beta):
             # use alpha to avoid time-consuming gellmann conversion
             tmp0 = hf_interpolate_dm(dm0, alpha=beta/dm0_norm)
             self.set_dm_target(tmp0)
-            theta_optim = numqi.optimize.minimize(self, theta0='uniform',
+            theta0 = _get_warm_start_theta0(theta_cache, beta) if warm_start else 'uniform'
+            theta_optim = numqi.optimize.minimize(self, theta0=theta0,
                         tol=converge_tol, num_repeat=num_repeat, seed=np_rng, print_every_round=0)
+            theta_cache[beta] = theta_optim.x
             return float(theta_optim.fun)
         beta,history_info = _ree_bisection_solve(hf0, 0, beta_u, xtol, threshold, use_tqdm=use_tqdm)
         ret = (beta,history_info) if return_info else beta
         return ret
 
     def get_numerical_range(self, op0:np.ndarray, op1:np.ndarray, num_theta:int=400, converge_tol:float=1e-5,
-                            num_repeat:int=1, use_tqdm:bool=True, seed:int|None=None):
+                            num_repeat:int=1, use_tqdm:bool=True, warm_start:bool=False, num_worker:int=1,
+                            seed:int|None=None):
         r'''get the numerical range of the two Hermitian operators
 
         Parameters:
@@ -273,22 +381,18 @@ class AutodiffCHAREE(torch.nn.Module):
             converge_tol (float): tolerance for the optimization, default to 1e-5
             num_repeat (int): number of repeats for the optimization, default to 1
             use_tqdm (bool): use tqdm, default to True
+            warm_start (bool): start the first round of the optimization from the optimum of the previous theta, default to False.
+                The optimum may jump between branches when theta varies, so `num_repeat>1` is recommended with warm start
+            num_worker (int): number of worker processes, each worker solves a contiguous arc of theta, default to 1.
+                If `num_worker>1`, the model itself is not modified
             seed (int): random seed, default to None
 
         Returns:
             ret (np.ndarray): the numerical range of the two Hermitian operators, `shape=(num_theta,2)`
         '''
-        np_rng = numqi.random.get_numpy_rng(seed)
+        assert self.batch_size is None
         N0 = self.dim0*self.dim1
         assert (op0.shape==(N0,N0)) and (op1.shape==(N0,N0))
-        theta_list = np.linspace(0, 2*np.pi, num_theta)
-        ret = []
-        kwargs = dict(num_repeat=num_repeat, seed=np_rng, print_every_round=0, tol=converge_tol)
-        for theta_i in (tqdm(theta_list) if use_tqdm else theta_list):
-            # see numqi.entangle.ppt.get_ppt_numerical_range, we use the maximization there
-            self.set_expectation_op(-np.cos(theta_i)*op0 - np.sin(theta_i)*op1)
-            numqi.optimize.minimize(self, **kwargs)
-            rho = self.dm_torch.numpy()
-            ret.append([np.trace(x @ rho).real for x in [op0,op1]])
-        ret = np.array(ret)
+        ret = _get_model_numerical_range(self, op0, op1, num_theta, converge_tol, num_repeat,
+                    use_tqdm, warm_start, num_worker, seed)
         return ret
@@ -6,19 +6,12 @@ import torch
 import numqi._torch_op
 import numqi.manifold
 
-def get_concurrence_2qubit(rho:np.ndarray):
-    r'''get the concurrence of a 2-qubit density matrix
-    [wiki-link](https://en.wikipedia.org/wiki/Concurrence_(quantum_computing))
-
-    Parameters:
-        rho (np.ndarray): a 2-qubit density matrix, shape=(4,4)
+from ._misc import _check_batch_density_matrix, _batch_chunk_apply, _reduce_batch_loss
 
-    Returns:
-        ret (float): the concurrence of the 2-qubit density matrix
-    '''
-    assert (rho.shape==(4,4)) and (np.abs(rho-rho.T.conj()).max()<1e-10)
+def _concurrence_2qubit_batch(rho:np.ndarray):
+    # rho (batch,4,4)
     tmp0 = np.array([-1,1,1,-1])
-    z0 = (tmp0[:,np.newaxis]*tmp0) * rho[::-1,::-1].conj()
+    z0 = (tmp0[:,np.newaxis]*tmp0) * rho[:,::-1,::-1].conj()
     # tmp0 = np.kron(numqi.gate.Y, numqi.gate.Y).real
     # z0_ = tmp0 @ rho.conj() @ tmp0
     # assert np.abs(z0_-z0).max() < 1e-10
@@ -28,60 +21,105 @@ def get_concurrence_2qubit(rho:np.ndarray):
     #     # scipy-v1.10 bug https://github.com/scipy/scipy/issues/18250
     #     tmp0 = tmp0.astype(np.complex128)
     EVL,EVC = np.linalg.eigh(rho)
-    sqrt_rho = (EVC * np.sqrt(np.maximum(0,EVL))) @ EVC.T.conj()
+    sqrt_rho = (EVC * np.sqrt(np.maximum(0,EVL))[:,np.newaxis]) @ EVC.conj().transpose(0,2,1)
     EVL = np.sqrt(np.maximum(0, np.linalg.eigvalsh(sqrt_rho @ z0 @ sqrt_rho)))
-    ret = np.maximum(2*EVL[-1]-EVL.sum(), 0)
+    ret = np.maximum(2*EVL[:,-1]-EVL.sum(axis=1), 0)
+    return ret
+
+
+def get_concurrence_2qubit(rho:np.ndarray, chunk_size:int|None=None, num_thread:int=1):
+    r'''get the concurrence of a 2-qubit density matrix
+    [wiki-link](https://en.wikipedia.org/wiki/Concurrence_(quantum_computing))
+
+    Parameters:
+        rho (np.ndarray): a 2-qubit density matrix, shape=(4,4), or (batch,4,4) for batch
+        chunk_size (int|None): number of density matrices per batched `eigh` call, `None` for all at once
+        num_thread (int): number of threads to evaluate the chunks
+
+    Returns:
+        ret (float,np.ndarray): the concurrence of the 2-qubit density matrix, array of shape `(batch,)` for batch input
+    '''
+    rho,is_single_item,_ = _check_batch_density_matrix(rho)
+    assert rho.shape[1]==4
+    ret = _batch_chunk_apply(_concurrence_2qubit_batch, rho, chunk_size, num_thread)
+    if is_single_item:
+        ret = ret[0].item()
     return ret
 
 
-def get_concurrence_pure(psi:np.ndarray):
+def _check_batch_pure_state(psi:np.ndarray):
+    # return psi of shape (batch,dimA,dimB) with dimA<=dimB, is_single_item
+    assert psi.ndim in (2,3)
+    is_single_item = psi.ndim==2
+    psi = psi.reshape(-1, *psi.shape[-2:])
+    if psi.shape[1]>psi.shape[2]:
+        psi = psi.transpose(0,2,1)
+    return psi, is_single_item
+
+
+def get_concurrence_pure(psi:np.ndarray, chunk_size:int|None=None, num_thread:int=1):
     r'''get the concurrence of a bipartite pure state
 
     Parameters:
-        psi (np.ndarray): a pure state, shape=(dimA,dimB)
+        psi (np.ndarray): a pure state, shape=(dimA,dimB), or (batch,dimA,dimB) for batch
+        chunk_size (int|None): number of states per batch, `None` for all at once
+        num_thread (int): number of threads to evaluate the chunks
 
     Returns:
-        ret (float): the concurrence of the bipartite pure state
+        ret (float,np.ndarray): the concurrence of the bipartite pure state, array of shape `(batch,)` for batch input
     '''
-    assert (psi.ndim==2)
-    if (psi.shape[0]==1) or (psi.shape[1]==1):
-        ret = 0
+    psi,is_single_item = _check_batch_pure_state(psi)
+    if psi.shape[1]==1:
+        ret = np.zeros(psi.shape[0], dtype=np.float64)
     else:
-        if psi.shape[0]<psi.shape[1]:
-            tmp0 = psi @ psi.conj().T
-        else:
-            tmp0 = psi.conj().T @ psi
-        tmp1 = tmp0.reshape(-1)
-        tmp2 = np.vdot(tmp1, tmp1).real #Frobenius norm, np.trace(tmp1 @ tmp1)
-        ret = np.sqrt(2*(1-tmp2))
+        def hf0(psi):
+            tmp0 = psi @ psi.conj().transpose(0,2,1)
+            tmp1 = np.einsum(tmp0, [0,1,2], tmp0.conj(), [0,1,2], [0], optimize=True).real #Frobenius norm
+            ret = np.sqrt(2*(1-tmp1))
+            return ret
+        ret = _batch_chunk_apply(hf0, psi, chunk_size, num_thread)
+    if is_single_item:
+        ret = ret[0].item()
     return ret
 
 
-def get_eof_pure(psi:np.ndarray, eps:float=1e-10):
+def get_eof_pure(psi:np.ndarray, eps:float=1e-10, chunk_size:int|None=None, num_thread:int=1):
     r'''get the entanglement of formation (EOF) of a bipartite pure state
 
     Parameters:
-        psi (np.ndarray): a pure state, shape=(dimA,dimB)
+        psi (np.ndarray): a pure state, shape=(dimA,dimB), or (batch,dimA,dimB) for batch
         eps (float): a small number to avoid log(0)
+        chunk_size (int|None): number of states per batched `eigvalsh` call, `None` for all at once
+        num_thread (int): number of threads to evaluate the chunks
 
     Returns:
-        ret (float): the EOF of the bipartite pure state
+        ret (float,np.ndarray): the EOF of the bipartite pure state, array of shape `(batch,)` for batch input
     '''
-    assert (psi.ndim==2)
-    if (psi.shape[0]==1) or (psi.shape[1]==1):
-        ret = 0
+    psi,is_single_item = _check_batch_pure_state(psi)
+    if psi.shape[1]==1:
+        ret = np.zeros(psi.shape[0], dtype=np.float64)
     else:
-        if psi.shape[0]<psi.shape[1]:
-            tmp0 = psi @ psi.conj().T
-        else:
-            tmp0 = psi.conj().T @ psi
-        EVL = np.linalg.eigvalsh(tmp0)
-        EVL = EVL[EVL>eps]
-        ret = -np.dot(EVL, np.log(EVL))
+        def hf0(psi):
+            EVL = np.linalg.eigvalsh(psi @ psi.conj().transpose(0,2,1))
+            tmp0 = EVL>eps
+            ret = -np.sum(np.where(tmp0, EVL*np.log(np.where(tmp0, EVL, 1)), 0), axis=1)
+            return ret
+        ret = _batch_chunk_apply(hf0, psi, chunk_size, num_thread)
+    if is_single_item:
+        ret = ret[0].item()
+    return ret
+
+
+def _concurrence_to_eof_2qubit(concurrence:np.ndarray):
+    tmp1 = (1 + np.sqrt(1-concurrence*concurrence))/2
+    tmp2 = 1 - tmp1
+    # binary entropy, h(0)=0, also covers the concurrence so small that tmp2 underflows to 0
+    tmp3 = np.where(tmp2>0, tmp2, 1)
+    ret = np.where(tmp2>0, -tmp1*np.log(tmp1) - tmp2*np.log(tmp3), 0)
     return ret
 
 
-def get_eof_2qubit(rho:np.ndarray):
+def get_eof_2qubit(rho:np.ndarray, chunk_size:int|None=None, num_thread:int=1):
     r'''get the entanglement of formation (EOF) of a 2-qubit density matrix
     [wiki-link](https://en.wikipedia.org/wiki/Entanglement_of_formation)
 
@@ -89,27 +127,49 @@ def get_eof_2qubit(rho:np.ndarray):
     [doi-link](https://doi.org/10.1103/PhysRevLett.80.2245)
 
     Parameters:
-        rho (np.ndarray): a 2-qubit density matrix, shape=(4,4)
+        rho (np.ndarray): a 2-qubit density matrix, shape=(4,4), or (batch,4,4) for batch
+        chunk_size (int|None): number of density matrices per batched `eigh` call, `None` for all at once
+        num_thread (int): number of threads to evaluate the chunks
 
     Returns:
-        ret (float): the EOF of the 2-qubit density matrix
+        ret (float,np.ndarray): the EOF of the 2-qubit density matrix, array of shape `(batch,)` for batch input
     '''
-    tmp0 = get_concurrence_2qubit(rho)
-    if tmp0==0:
-        ret = 0
-    else:
-        tmp1 = (1 + np.sqrt(1-tmp0*tmp0))/2
-        ret = -tmp1*np.log(tmp1) - (1-tmp1)*np.log(1-tmp1)
+    tmp0 = get_concurrence_2qubit(rho, chunk_size, num_thread)
+    ret = _concurrence_to_eof_2qubit(np.asarray(tmp0))
+    if rho.ndim==2:
+        ret = ret.item()
     return ret
 
 
+def _eof_model_set_density_matrix(model, rho:np.ndarray):
+    # shared by EntanglementFormationModel and ConcurrenceModel: stacked sqrt(rho) baked in the contraction
+    # rdm_not_normed: (num_term,dA,dA), or (batch_size,num_term,dA,dA) with dA=min(dimA,dimB)
+    N0 = model.dimA*model.dimB
+    assert rho.shape == ((N0,N0) if (model.batch_size is None) else (model.batch_size,N0,N0))
+    assert np.abs(rho - rho.swapaxes(-1,-2).conj()).max() < 1e-10
+    assert np.abs(np.trace(rho, axis1=-2, axis2=-1) - 1).max() < 1e-10
+    EVL,EVC = np.linalg.eigh(rho)
+    assert EVL[...,0].min() > -1e-10
+    EVL = np.maximum(0, EVL[...,-model.rank:])
+    assert np.abs(EVL.sum(axis=-1)-1).max() < 1e-10
+    EVC = EVC[...,-model.rank:]
+    tmp0 = (EVC * np.sqrt(EVL)[...,np.newaxis,:]).reshape(*rho.shape[:-2], model.dimA, model.dimB, model.rank)
+    model._sqrt_rho = torch.tensor(tmp0, dtype=model.cdtype)
+    tmp0 = model._sqrt_rho.conj().resolve_conj()
+    ind_batch = [] if (model.batch_size is None) else [6]
+    shape_st = ([] if (model.batch_size is None) else [model.batch_size]) + [model.num_term,model.rank]
+    tmp1 = ([0,3,4],[1,3,5]) if (model.dimA<=model.dimB) else ([3,0,4],[3,1,5])
+    model.contract_expr = opt_einsum.contract_expression(model._sqrt_rho, ind_batch+tmp1[0], tmp0, ind_batch+tmp1[1],
+                    shape_st, ind_batch+[2,4], shape_st, ind_batch+[2,5], ind_batch+[2,0,1], constants=[0,1])
+
+
 class EntanglementFormationModel(torch.nn.Module):
     '''Calculate the entanglement of formation (EOF) of a bipartite pure state via optimization
 
     Variational characterizations of separability and entanglement of formation
     [doi-link](https://doi.org/10.1103/PhysRevA.64.052304)
     '''
-    def __init__(self, dimA:int, dimB:int, num_term:int, rank:int|None=None):
+    def __init__(self, dimA:int, dimB:int, num_term:int, rank:int|None=None, batch_size:int|None=None):
         r'''Initialize the model
 
         Parameters:
@@ -117,6 +177,8 @@ class EntanglementFormationModel(torch.nn.Module):
             dimB (int): the dimension of the second subsystem
             num_term (int): the number of terms in the variational ansatz, `num_term` is bounded by (dimA*dimB)**2
             rank (int,None): the rank of the density matrix
+            batch_size (int|None): If not None, solve a batch of density matrices at once, the loss is summed
+                over the batch, see `numqi.optimize.minimize_batch`
         '''
         super().__init__()
         self.dtype = torch.float64
@@ -127,9 +189,12 @@ class EntanglementFormationModel(torch.nn.Module):
             rank = dimA*dimB
         self.num_term = num_term
         assert num_term>=rank
-        self.manifold = numqi.manifold.Stiefel(num_term, rank, dtype=self.cdtype, method='polar')
+        self.manifold = numqi.manifold.Stiefel(num_term, rank, batch_size=batch_size, dtype=self.cdtype, method='polar')
         self.rank = rank
+        self.batch_size = batch_size
 
+        self.batch_mask = None
+        self.loss_batch = None
         self._sqrt_rho = None
         self._eps = torch.tensor(torch.finfo(self.dtype).smallest_normal, dtype=self.dtype)
         self.contract_expr = None
@@ -138,34 +203,23 @@ class EntanglementFormationModel(torch.nn.Module):
         r'''Set the density matrix
 
         Parameters:
-            rho (np.ndarray): the density matrix, shape=(dimA*dimB,dimA*dimB)
+            rho (np.ndarray): the density matrix, shape=(dimA*dimB,dimA*dimB), or (batch_size,dimA*dimB,dimA*dimB)
+                if `batch_size` is not None
         '''
-        assert rho.shape == (self.dimA*self.dimB, self.dimA*self.dimB)
-        assert np.abs(rho - rho.T.conj()).max() < 1e-10
-        assert abs(np.trace(rho) - 1) < 1e-10
-        assert np.linalg.eigvalsh(rho)[0] > -1e-10
-        EVL,EVC = np.linalg.eigh(rho)
-        EVL = np.maximum(0, EVL[-self.rank:])
-        assert abs(EVL.sum()-1) < 1e-10
-        EVC = EVC[:,-self.rank:]
-        tmp0 = (EVC * np.sqrt(EVL)).reshape(self.dimA, self.dimB, self.rank)
-        self._sqrt_rho = torch.tensor(tmp0, dtype=self.cdtype)
-        tmp0 = self._sqrt_rho.conj().resolve_conj()
-        if self.dimA<=self.dimB:
-            self.contract_expr = opt_einsum.contract_expression(self._sqrt_rho, [0,3,4], tmp0, [1,3,5],
-                                [self.num_term,self.rank], [2,4], [self.num_term,self.rank], [2,5], [2,0,1], constants=[0,1])
-        else:
-            self.contract_expr = opt_einsum.contract_expression(self._sqrt_rho, [3,0,4], tmp0, [3,1,5],
-                                [self.num_term,self.rank], [2,4], [self.num_term,self.rank], [2,5], [2,0,1], constants=[0,1])
+        _eof_model_set_density_matrix(self, rho)
 
     def forward(self):
         mat_st = self.manifold()
         rdm_not_normed = self.contract_expr(mat_st, mat_st.conj(), backend='torch')
         EVL = torch.linalg.eigvalsh(rdm_not_normed)
         tmp0 = torch.log(torch.maximum(EVL, self._eps))
-        prob = torch.einsum(rdm_not_normed, [0,1,1], [0]).real
+        prob = torch.einsum(rdm_not_normed, [...,0,1,1], [...,0]).real
         tmp1 = torch.log(torch.maximum(prob, self._eps))
-        ret = torch.dot(prob,tmp1) - torch.dot(EVL.reshape(-1), tmp0.reshape(-1))
+        if self.batch_size is None:
+            ret = torch.dot(prob,tmp1) - torch.dot(EVL.reshape(-1), tmp0.reshape(-1))
+        else:
+            ret = (prob*tmp1).sum(dim=1) - (EVL*tmp0).sum(dim=(1,2))
+            ret = _reduce_batch_loss(self, ret)
         return ret
 
 
@@ -175,7 +229,7 @@ class ConcurrenceModel(torch.nn.Module):
     What is the motivation for the definition of concurrence in quantum information?
     [stackexchange-link](https://physics.stackexchange.com/a/46509/283720)
     '''
-    def __init__(self, dimA:int, dimB:int, num_term:int, rank:int=None):
+    def __init__(self, dimA:int, dimB:int, num_term:int, rank:int=None, batch_size:int|None=None):
         r'''Initialize the model
 
         Parameters:
@@ -183,7 +237,8 @@ class ConcurrenceModel(torch.nn.Module):
             dimB (int): the dimension of the second subsystem
             num_term (int): the number of terms in the variational ansatz, `num_term` is bounded by (dimA*dimB)**2
             rank (int): the rank of the density matrix
-            zero_eps (float): a small number to avoid sqrt(0)
+            batch_size (int|None): If not None, solve a batch of density matrices at once, the loss is summed
+                over the batch, see `numqi.optimize.minimize_batch`
         '''
         super().__init__()
         self.dtype = torch.float64
@@ -195,44 +250,31 @@ class ConcurrenceModel(torch.nn.Module):
         self.num_term = num_term
         assert num_term>=rank
         self.rank = rank
-        self.manifold = numqi.manifold.Stiefel(num_term, rank, dtype=self.cdtype, method='polar')
+        self.manifold = numqi.manifold.Stiefel(num_term, rank, batch_size=batch_size, dtype=self.cdtype, method='polar')
+        self.batch_size = batch_size
 
+        self.batch_mask = None
+        self.loss_batch = None
         self._sqrt_rho = None
         self._eps = torch.tensor(torch.finfo(self.dtype).smallest_normal, dtype=self.dtype)
         self.contract_expr = None
-        self.contract_expr1 = None
 
     def set_density_matrix(self, rho:np.ndarray):
         r'''Set the density matrix
 
         Parameters:
-            rho (np.ndarray): the density matrix, shape=(dimA*dimB,dimA*dimB)
+            rho (np.ndarray): the density matrix, shape=(dimA*dimB,dimA*dimB), or (batch_size,dimA*dimB,dimA*dimB)
+                if `batch_size` is not None
         '''
-        assert rho.shape == (self.dimA*self.dimB, self.dimA*self.dimB)
-        assert np.abs(rho - rho.T.conj()).max() < 1e-10
-        assert abs(np.trace(rho) - 1) < 1e-10
-        assert np.linalg.eigvalsh(rho)[0] > -1e-10
-        EVL,EVC = np.linalg.eigh(rho)
-        EVL = np.maximum(0, EVL[-self.rank:])
-        assert abs(EVL.sum()-1) < 1e-10
-        EVC = EVC[:,-self.rank:]
-        tmp0 = (EVC * np.sqrt(EVL)).reshape(self.dimA, self.dimB, self.rank)
-        self._sqrt_rho = torch.tensor(tmp0, dtype=self.cdtype)
-        tmp0 = self._sqrt_rho.conj().resolve_conj()
-        if self.dimA<=self.dimB:
-            self.contract_expr = opt_einsum.contract_expression(self._sqrt_rho, [0,3,4], tmp0, [1,3,5],
-                                [self.num_term,self.rank], [2,4], [self.num_term,self.rank], [2,5], [2,0,1], constants=[0,1])
-        else:
-            self.contract_expr = opt_einsum.contract_expression(self._sqrt_rho, [3,0,4], tmp0, [3,1,5],
-                                [self.num_term,self.rank], [2,4], [self.num_term,self.rank], [2,5], [2,0,1], constants=[0,1])
-        tmp0 = min(self.dimA, self.dimB)
-        self.contract_expr1 = opt_einsum.contract_expression([self.num_term,tmp0,tmp0], [0,1,2], [self.num_term,tmp0,tmp0], [0,1,2], [0])
+        _eof_model_set_density_matrix(self, rho)
 
     def forward(self):
         mat_st = self.manifold()
         rdm_not_normed = self.contract_expr(mat_st, mat_st.conj(), backend='torch')
-        prob = torch.einsum(rdm_not_normed, [0,1,1], [0]).real
-        purity = self.contract_expr1(rdm_not_normed, rdm_not_normed.conj()).real
+        prob = torch.einsum(rdm_not_normed, [...,0,1,1], [...,0]).real
+        purity = torch.einsum(rdm_not_normed, [...,0,1,2], rdm_not_normed.conj(), [...,0,1,2], [...,0]).real
         tmp0 = torch.maximum(self._eps, 2*(prob*prob - purity))
-        loss = torch.sqrt(tmp0).sum()
+        loss = torch.sqrt(tmp0).sum(dim=-1)
+        if self.batch_size is not None:
+            loss = _reduce_batch_loss(self, loss)
         return loss
@@ -1,5 +1,6 @@
 import numpy as np
 import torch
+import torch.utils.checkpoint
 import opt_einsum
 import cvxpy
 from tqdm.auto import tqdm
@@ -10,27 +11,51 @@ from .symext import _check_input_rho_SDP
 from .eof import get_concurrence_2qubit
 
 
-def get_gme_2qubit(rho:np.ndarray):
+def get_gme_2qubit(rho:np.ndarray, chunk_size:int|None=None, num_thread:int=1):
     r'''Calculate the geometric measure of entanglement (GME) for 2-qubit density matrix.
 
     Geometric measure of entanglement and applications to bipartite and multipartite quantum states
     [doi-link](https://doi.org/10.1103/PhysRevA.68.042307) (eq-10)
 
     Parameters:
-        rho (np.ndarray): 2-qubit density matrix.
+        rho (np.ndarray): 2-qubit density matrix, shape=(4,4), or (batch,4,4) for batch.
+        chunk_size (int|None): number of density matrices per batched `eigh` call, `None` for all at once.
+        num_thread (int): number of threads to evaluate the chunks.
 
     Returns:
-        ret (float): GME.
+        ret (float,np.ndarray): GME, array of shape `(batch,)` for batch input.
     '''
-    assert rho.shape==(4,4)
-    tmp0 = get_concurrence_2qubit(rho)
+    assert rho.shape[-2:]==(4,4)
+    tmp0 = np.asarray(get_concurrence_2qubit(rho, chunk_size, num_thread))
     ret = (1-np.sqrt(1-tmp0*tmp0)) / 2
+    if rho.ndim==2:
+        ret = ret.item()
+    return ret
+
+
+def _gme_contract_dense(sqrt_rho:torch.Tensor, matX:torch.Tensor, psi_list:list[torch.Tensor]):
+    # sqrt_rho (N0,rank), matX (e,rank), psi_list[k] (e,c,d_k), return (e,c)
+    ret = (matX @ sqrt_rho.T).reshape(matX.shape[0], psi_list[0].shape[2], -1)
+    ret = torch.einsum(ret, [0,1,2], psi_list[0], [0,3,1], [0,3,2])
+    for psi in psi_list[1:]:
+        ret = torch.einsum(ret.reshape(*ret.shape[:2], psi.shape[2], -1), [0,1,2,3], psi, [0,1,2], [0,1,3])
+    ret = ret.reshape(ret.shape[:2])
+    return ret
+
+
+def _gme_contract_mps(sqrt_rho_mps:tuple[torch.Tensor], matX:torch.Tensor, psi_list:list[torch.Tensor]):
+    # sqrt_rho_mps[k] (D_{k-1},d_k,D_k) with D_0=1 and D_n=rank, matX (e,rank), psi_list[k] (e,c,d_k), return (e,c)
+    ret = torch.einsum(psi_list[0], [0,1,2], sqrt_rho_mps[0][0], [2,3], [0,1,3])
+    for mps_i,psi in zip(sqrt_rho_mps[1:], psi_list[1:]):
+        ret = torch.einsum(ret, [0,1,2], mps_i, [2,3,4], psi, [0,1,3], [0,1,4])
+    ret = torch.einsum(ret, [0,1,2], matX, [0,2], [0,1])
     return ret
 
 
 class DensityMatrixGMEModel(torch.nn.Module):
     r'''Solve geometric measure of entanglement (GME) for density matrix using gradient descent.'''
-    def __init__(self, dim_list:tuple[int], num_ensemble:int, rank:int|None=None, CPrank:int=1, dtype:str='float64'):
+    def __init__(self, dim_list:tuple[int], num_ensemble:int, rank:int|None=None, CPrank:int=1, dtype:str='float64',
+                chunk_size:int|None=None):
         r'''Initialize the model.
 
         Parameters:
@@ -39,6 +64,9 @@ class DensityMatrixGMEModel(torch.nn.Module):
             rank (int): rank of the density matrix, if None, then rank is set to the maximum.
             CPrank (int): Canonical Polyadic rank rank of the state.
             dtype (str): data type of the state.
+            chunk_size (int|None): if not None, contract the ensemble party by party in chunks of `chunk_size`, the
+                intermediate tensors of each chunk are recomputed in the backward pass (`torch.utils.checkpoint`)
+                to bound the memory.
         '''
         super().__init__()
         assert dtype in {'float32','float64'}
@@ -55,6 +83,8 @@ class DensityMatrixGMEModel(torch.nn.Module):
         self.rank = int(rank)
         assert CPrank>=1
         self.CPrank = int(CPrank)
+        assert (chunk_size is None) or (chunk_size>=1)
+        self.chunk_size = None if (chunk_size is None) else int(chunk_size)
 
         self.manifold_stiefel = numqi.manifold.Stiefel(num_ensemble, rank, dtype=self.cdtype)
         self.manifold_psi = torch.nn.ModuleList([numqi.manifold.Sphere(x, batch_size=num_ensemble*CPrank, dtype=self.cdtype) for x in dim_list])
@@ -66,6 +96,7 @@ class DensityMatrixGMEModel(torch.nn.Module):
             self.contract_psi_psi = opt_einsum.contract_expression(*[y for x in zip(tmp0,tmp1) for y in x], [N1])
 
         self._sqrt_rho = None
+        self._sqrt_rho_mps = None
         self.contract_expr = None
         self.contract_coeff = None
 
@@ -82,8 +113,40 @@ class DensityMatrixGMEModel(torch.nn.Module):
         EVL = np.maximum(0, EVL[-self.rank:])
         assert abs(EVL.sum()-1) < 1e-10
         EVC = EVC[:,-self.rank:]
-        tmp0 = (EVC * np.sqrt(EVL)).reshape(*self.dim_list, self.rank)
-        self._sqrt_rho = torch.tensor(tmp0, dtype=self.cdtype)
+        self._set_sqrt_rho(EVC * np.sqrt(EVL))
+
+    def set_density_matrix_factor(self, factor:np.ndarray|list[np.ndarray]):
+        r'''Set the density matrix by its low-rank factor $\rho=FF^\dagger$, without forming the density matrix.
+
+        The factor can be given in the MPS form, then the contraction is done party by party without any tensor
+        of size `prod(dim_list)`, e.g. GHZ/W mixtures of many qubits (bond dimension 2 for each).
+
+        Parameters:
+            factor (np.ndarray,list[np.ndarray]): the factor $F$ of shape `(prod(dim_list),rank)`, or the list of MPS
+                tensors of shape `(D_{k-1},dim_list[k],D_k)` with `D_0=1` and `D_n=rank`, i.e.
+                `F[i0,i1,...,r] = (factor[0][:,i0] @ factor[1][:,i1] @ ...)[0,r]`
+        '''
+        if isinstance(factor, np.ndarray):
+            assert factor.shape == (np.prod(np.array(self.dim_list)), self.rank)
+            assert abs(np.vdot(factor, factor).real-1) < 1e-10
+            self._set_sqrt_rho(factor)
+        else:
+            assert len(factor)==len(self.dim_list)
+            assert all((x.ndim==3) and (x.shape[1]==y) for x,y in zip(factor,self.dim_list))
+            assert (factor[0].shape[0]==1) and (factor[-1].shape[2]==self.rank)
+            assert all(x.shape[2]==y.shape[0] for x,y in zip(factor[:-1],factor[1:]))
+            tmp0 = np.ones((1,1))
+            for x in factor: #transfer matrix, tr(rho)=<F,F>
+                tmp0 = np.einsum(tmp0, [0,1], x.conj(), [0,2,3], x, [1,2,4], [3,4], optimize=True)
+            assert abs(np.trace(tmp0).real-1) < 1e-10
+            self._sqrt_rho = None
+            self.contract_expr = None
+            self._sqrt_rho_mps = tuple(torch.tensor(x, dtype=self.cdtype) for x in factor)
+
+    def _set_sqrt_rho(self, sqrt_rho:np.ndarray):
+        # sqrt_rho (N0,rank)
+        self._sqrt_rho_mps = None
+        self._sqrt_rho = torch.tensor(sqrt_rho.reshape(*self.dim_list, self.rank), dtype=self.cdtype)
         N1 = len(self.dim_list)
         if self.CPrank==1:
             tmp0 = [(N1+1,x) for x in range(N1)]
@@ -113,13 +176,40 @@ class DensityMatrixGMEModel(torch.nn.Module):
                 ret = matX,psi_list
         return ret
 
+    def _contract_party_by_party(self, matX, psi_list, coeff):
+        # ensemble in chunks, psi_list[k] (e,c,d_k), coeff (e,c) or None, return (e,)
+        if self._sqrt_rho_mps is not None:
+            hf0 = lambda *x: _gme_contract_mps(self._sqrt_rho_mps, x[0], x[1:])
+        else:
+            sqrt_rho = self._sqrt_rho.reshape(-1, self.rank)
+            hf0 = lambda *x: _gme_contract_dense(sqrt_rho, x[0], x[1:])
+        chunk_size = self.num_ensemble if (self.chunk_size is None) else self.chunk_size
+        ret = []
+        for ind0 in range(0, self.num_ensemble, chunk_size):
+            tmp0 = [x[ind0:(ind0+chunk_size)] for x in [matX]+psi_list]
+            if (self.chunk_size is not None) and torch.is_grad_enabled():
+                ret.append(torch.utils.checkpoint.checkpoint(hf0, *tmp0, use_reentrant=False))
+            else:
+                ret.append(hf0(*tmp0))
+        ret = torch.concat(ret, dim=0)
+        ret = ret[:,0] if (coeff is None) else (ret*coeff).sum(dim=1)
+        return ret
+
     def forward(self):
         if self.CPrank>1:
             matX,psi_list,coeff = self.get_state(tag_grad=True)
-            tmp2 = self.contract_expr(matX, coeff, *psi_list, backend='torch')
         else:
             matX,psi_list = self.get_state(tag_grad=True)
-            tmp2 = self.contract_expr(matX, *psi_list, backend='torch')
+            coeff = None
+        if (self.contract_expr is not None) and (self.chunk_size is None):
+            if coeff is None:
+                tmp2 = self.contract_expr(matX, *psi_list, backend='torch')
+            else:
+                tmp2 = self.contract_expr(matX, coeff, *psi_list, backend='torch')
+        else:
+            if coeff is None:
+                psi_list = [x.reshape(self.num_ensemble,1,-1) for x in psi_list]
+            tmp2 = self._contract_party_by_party(matX, psi_list, coeff)
         loss = 1-torch.vdot(tmp2,tmp2).real
         return loss
 
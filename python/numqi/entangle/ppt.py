@@ -9,12 +9,35 @@ import matplotlib.pyplot as plt
 
 import numqi.gellmann
 import numqi.utils
+from numqi._cvxpy_utils import _array_to_key, _key_to_array, _sdp_direction_sweep, _cvxpy_problem_cache
 
-from ._misc import get_density_matrix_boundary, _sdp_ree_solve, _check_input_rho_SDP, hf_interpolate_dm
+from ._misc import (get_density_matrix_boundary, _sdp_ree_solve, _check_input_rho_SDP, hf_interpolate_dm, get_adaptive_boundary,
+                    _check_batch_density_matrix, _batch_partial_transpose, _batch_chunk_apply, _batch_eigvalsh)
 
 cp_tableau = ['#4c72b0', '#dd8452', '#55a868', '#c44e52', '#8172b3', '#937860', '#da8bc3', '#8c8c8c', '#ccb974', '#64b5cd']
 
-def get_ppt_numerical_range(op_list, direction, dim, return_info=False, use_tqdm=True):
+@_cvxpy_problem_cache(maxsize=8)
+def _get_ppt_numerical_range_cvxP(op_list_key, dimA, dimB):
+    op_list = _key_to_array(op_list_key)
+    num_op = op_list.shape[0]
+    N0 = dimA*dimB
+    cvx_rho = cvxpy.Variable((N0,N0), hermitian=True)
+    cvx_vec = cvxpy.Parameter(num_op)
+    cvx_beta = cvxpy.Variable()
+    cvx_op = cvxpy.real(op_list.transpose(0,2,1).reshape(-1, N0*N0, order='C') @ cvxpy.reshape(cvx_rho, N0*N0, order='F'))
+    constraints = [
+        cvx_rho>>0,
+        cvxpy.real(cvxpy.trace(cvx_rho))==1,
+        cvxpy.partial_transpose(cvx_rho, [dimA,dimB], 0)>>0,
+        cvx_beta*cvx_vec==cvx_op,
+    ]
+    cvx_obj = cvxpy.Maximize(cvx_beta)
+    prob = cvxpy.Problem(cvx_obj, constraints)
+    ret = prob,cvx_vec,cvx_obj,cvx_op,constraints[-1]
+    return ret
+
+
+def get_ppt_numerical_range(op_list, direction, dim, return_info=False, use_tqdm=True, num_worker=1):
     r'''get the PPT (positive partial transpose) numerical range of a list of operators
 
     TODO bug, this is cross-section, not numerical range
@@ -23,12 +46,15 @@ def get_ppt_numerical_range(op_list, direction, dim, return_info=False, use_tqdm
 
     $$ s.t.\;\begin{cases} \rho\succeq 0\\ \mathrm{Tr}[\rho]=1\\ \rho^{\Gamma}\succeq 0\\ \mathrm{Tr}[\rho A_{i}]=\beta\hat{n}_{i} & i=1,\cdots,m \end{cases} $$
 
+    The compiled SDP is cached for the same `(op_list,dim)`, so repeated calls skip the cvxpy canonicalization.
+
     Parameters:
         op_list (list): a list of operators, each operator is a 2d numpy array
         direction (np.ndarrray): the boundary along the direction will be calculated, if 2d, then each row is a direction
         dim (tuple[int]): the dimension of the density matrix, e.g. (2,2) for 2 qubits, must be of length 2
         return_info (bool): if `True`, then return the boundary and the boundary's normal vector
         use_tqdm (bool): if `True`, then use tqdm to show the progress
+        num_worker (int): number of worker processes, the directions are split among the workers
 
     Returns:
         beta (np.ndarray): the distance from the origin to the boundary along the direction.
@@ -49,40 +75,8 @@ def get_ppt_numerical_range(op_list, direction, dim, return_info=False, use_tqdm
     dimA,dimB = dim
     N0 = dimA*dimB
     assert op_list.shape[1]==dimA*dimB
-    cvx_rho = cvxpy.Variable((N0,N0), hermitian=True)
-    cvx_vec = cvxpy.Parameter(num_op)
-    cvx_beta = cvxpy.Variable()
-    cvx_op = cvxpy.real(op_list.transpose(0,2,1).reshape(-1, N0*N0, order='C') @ cvxpy.reshape(cvx_rho, N0*N0, order='F'))
-    constraints = [
-        cvx_rho>>0,
-        cvxpy.real(cvxpy.trace(cvx_rho))==1,
-        cvxpy.partial_transpose(cvx_rho, [dimA,dimB], 0)>>0,
-        cvx_beta*cvx_vec==cvx_op,
-    ]
-    cvx_obj = cvxpy.Maximize(cvx_beta)
-    prob = cvxpy.Problem(cvx_obj, constraints)
-    obj_list = []
-    boundary_list = []
-    norm_vec_list = []
-    ret = []
-    for vec_i in (tqdm(direction) if use_tqdm else direction):
-        cvx_vec.value = vec_i
-        prob.solve()
-        obj_list.append(cvx_obj.value)
-        if return_info:
-            boundary_list.append(cvx_op.value.copy())
-            norm_vec_list.append(constraints[-1].dual_value.copy())
-    if is_single:
-        if return_info:
-            ret = (obj_list[0], boundary_list[0], norm_vec_list[0])
-        else:
-            ret = obj_list[0]
-    else:
-        obj_list = np.array(obj_list)
-        if return_info:
-            ret = obj_list, np.stack(boundary_list, axis=0), np.stack(norm_vec_list, axis=0)
-        else:
-            ret = obj_list
+    cvxP = _get_ppt_numerical_range_cvxP(_array_to_key(op_list), dimA, dimB)
+    ret = _sdp_direction_sweep(cvxP, direction, is_single, return_info, use_tqdm, num_worker)
     return ret
 
 
@@ -128,7 +122,7 @@ def get_ppt_boundary(dm, dim, dm_norm=None, within_dm=True):
     return beta_pt_l,beta_pt_u
 
 
-def is_ppt(rho:np.ndarray, dim:tuple[int], eps:float=-1e-7):
+def is_ppt(rho:np.ndarray, dim:tuple[int], eps:float=-1e-7, chunk_size:int|None=None):
     '''Positive Partial Transpose (PPT)
 
     [wiki/entanglement-witness](https://en.wikipedia.org/wiki/Entanglement_witness)
@@ -136,24 +130,25 @@ def is_ppt(rho:np.ndarray, dim:tuple[int], eps:float=-1e-7):
     [wiki/Peres-Horodecki-criterion](https://en.wikipedia.org/wiki/Peres%E2%80%93Horodecki_criterion)
 
     Parameters:
-        rho (np.ndarray): density matrix
+        rho (np.ndarray,torch.Tensor): density matrix, `ndim=2`, or `ndim=3` for batch
         dim (tuple[int]): tuple of integers
         eps (float): threshold for the eigenvalues, if min(eig(X))>=eps, then X is positive semi-definite
+        chunk_size (int|None): number of density matrices per batched `eigvalsh` call, `None` for all at once
 
     Returns:
-        tag (bool): whether rho is PPT
+        tag (bool,np.ndarray,torch.Tensor): whether rho is PPT, boolean array of shape `(batch,)` for batch input
     '''
-    N0 = rho.shape[0]
-    assert (rho.ndim==2) and (rho.shape[0]==rho.shape[1]) and (np.abs(rho-rho.T.conj()).max()<=1e-10)
-    dim = numqi.utils.hf_tuple_of_int(dim)
-    assert (len(dim)>1) and (np.prod(dim)==rho.shape[0]) and all(x>1 for x in dim)
-    def hf0(i):
-        tmp0 = np.prod(dim[:i]) if i>0 else 1
-        tmp1 = np.prod(dim[(i+1):]) if (i+1)<len(dim) else 1
-        rhoT = rho.reshape(tmp0,dim[i],tmp1,tmp0,dim[i],tmp1).transpose(0,4,2,3,1,5).reshape(N0,N0)
-        ret = numqi.utils.is_positive_semi_definite(rhoT, shift=-eps)
+    rho,is_single_item,dim = _check_batch_density_matrix(rho, dim)
+    # bipartite: partial transpose on A and on B have the same spectrum
+    index_list = [0] if (len(dim)==2) else list(range(len(dim)))
+    def hf0(rho):
+        ret = True
+        for i in index_list:
+            ret = ret & (_batch_eigvalsh(_batch_partial_transpose(rho, dim, i))[:,0] >= eps)
         return ret
-    ret = all(hf0(i) for i in range(len(dim)))
+    ret = _batch_chunk_apply(hf0, rho, chunk_size)
+    if is_single_item:
+        ret = bool(ret[0])
     return ret
 
 
@@ -166,43 +161,67 @@ def _is_generalized_ppt_dim_list(num_partite):
     return ret
 
 
-def is_generalized_ppt(rho, dim, return_info=False):
+@functools.lru_cache
+def _is_generalized_ppt_group(dim:tuple[int]):
+    # group the reshuffles of _is_generalized_ppt_dim_list by the matrix shape, in the order of first appearance
+    # ret: tuple of (matrix shape, index in dim_list, axes to transpose rho.reshape(dim+dim))
+    shape = dim + dim
+    ret = dict()
+    for ind0,(dim0,dim1) in enumerate(_is_generalized_ppt_dim_list(len(dim))):
+        tmp0 = int(np.prod([shape[x] for x in dim0], dtype=np.int64))
+        tmp1 = tmp0, int(np.prod(shape, dtype=np.int64))//tmp0
+        ret.setdefault(tmp1, []).append((ind0, dim0+dim1))
+    ret = tuple((k, tuple(x[0] for x in v), tuple(x[1] for x in v)) for k,v in ret.items())
+    return ret
+
+
+def _generalized_ppt_reshuffle(rho:np.ndarray, dim:tuple[int], mat_shape:tuple[int], axes_list:tuple[tuple[int]]):
+    # rho (batch,N,N) -> (batch,len(axes_list),mat_shape[0],mat_shape[1])
+    tmp0 = rho.reshape(-1, *dim, *dim)
+    ret = np.stack([tmp0.transpose(0, *[x+1 for x in y]).reshape(-1, *mat_shape) for y in axes_list], axis=1)
+    return ret
+
+
+def is_generalized_ppt(rho:np.ndarray, dim:tuple[int], return_info:bool=False):
     '''Generalized Positive Partial Transpose (PPT)
 
     The generalized partial transposition criterion for separability of multipartite quantum states
     [doi-link](https://doi.org/10.1016/S0375-9601%2802%2901538-4)
 
     Parameters:
-        rho (np.ndarray): density matrix
+        rho (np.ndarray): density matrix, `ndim=2`, or `ndim=3` for batch
         dim (tuple[int]): tuple of integers
         return_info (bool): whether to return the list of nuclear norms
 
     Returns:
-        tag (bool): whether rho is generalized PPT (superset of SEP)
-        info (list[float]): list of nuclear norms
+        tag (bool,np.ndarray): whether rho is generalized PPT (superset of SEP), boolean array of shape `(batch,)` for batch input
+        info (list[tuple]): list of `(dim0,dim1,nuclear_norm)`, `nuclear_norm` is `float`, or `np.ndarray` of shape `(batch,)`
+            for batch input
     '''
-    assert (rho.ndim==2) and rho.shape[0]==rho.shape[1]
-    N0 = rho.shape[0]
-    dim = tuple(int(x) for x in dim)
-    assert (len(dim)>1) and (np.prod(dim)==N0) and all(x>1 for x in dim)
-
+    rho,is_single_item,dim = _check_batch_density_matrix(rho, dim)
     dim_list = _is_generalized_ppt_dim_list(len(dim))
-    shape = dim + dim
-    rho = rho.reshape(shape)
-    ret = []
-    for dim0,dim1 in dim_list:
-        tmp0 = 1 if len(dim0)==0 else np.prod([1]+[shape[x] for x in dim0])
-        tmp1 = rho.transpose(*dim0, *dim1).reshape(tmp0, -1)
-        # nuclear norm: sum of singular values
-        ret.append((dim0, dim1, np.linalg.norm(tmp1, ord='nuc')))
-        if (not return_info) and (ret[-1][2]>1):
+    nuc_norm = np.zeros((rho.shape[0], len(dim_list)), dtype=np.float64)
+    tag = np.ones(rho.shape[0], dtype=np.bool_)
+    for mat_shape,index,axes_list in _is_generalized_ppt_group(dim):
+        # early exit: only the items still satisfying the criterion are evaluated
+        ind0 = np.arange(rho.shape[0]) if return_info else np.nonzero(tag)[0]
+        if (not return_info) and (len(ind0)==0):
             break
-    tag = all(x[2]<=1 for x in ret)
-    ret = (tag,ret) if return_info else tag
+        tmp0 = _generalized_ppt_reshuffle(rho[ind0], dim, mat_shape, axes_list)
+        # nuclear norm: sum of singular values
+        tmp1 = np.linalg.svd(tmp0, compute_uv=False).sum(axis=2)
+        nuc_norm[ind0[:,np.newaxis], np.array(index)] = tmp1
+        tag[ind0] = tag[ind0] & np.all(tmp1<=1, axis=1)
+    if is_single_item:
+        tag = bool(tag[0])
+        info = [(x[0], x[1], y.item()) for x,y in zip(dim_list, nuc_norm[0])]
+    else:
+        info = [(x[0], x[1], y) for x,y in zip(dim_list, nuc_norm.T)]
+    ret = (tag,info) if return_info else tag
     return ret
 
 
-def get_generalized_ppt_boundary(dm, dim, threshold=1e-10, xtol=1e-5):
+def get_generalized_ppt_boundary(dm:np.ndarray, dim:tuple[int], threshold:float=1e-10, xtol:float=1e-5):
     '''get boundary according to Generalized Positive Partial Transpose (PPT) criterion
 
     Parameters:
@@ -214,14 +233,17 @@ def get_generalized_ppt_boundary(dm, dim, threshold=1e-10, xtol=1e-5):
     Returns:
         beta (float): boundary in Gell-Mann space
     '''
-    def hf0(x):
-        tmp0 = rho0 + x*dm_unit_vec
-        tmp1 = is_generalized_ppt(tmp0, dim, return_info=True)[1]
-        ret = max([x[2] for x in tmp1]) - (1 + threshold)
-        return ret
+    dim = numqi.utils.hf_tuple_of_int(dim)
     dm_norm = numqi.gellmann.dm_to_gellmann_norm(dm)
     rho0 = np.eye(dm.shape[0])/dm.shape[0]
     dm_unit_vec = (dm - rho0) / dm_norm
+    # reshuffle is linear, so the reshuffled matrices along the line rho0+x*dm_unit_vec are computed only once
+    tmp0 = np.stack([rho0, dm_unit_vec])
+    reshuffle_list = [_generalized_ppt_reshuffle(tmp0, dim, x, z) for x,_,z in _is_generalized_ppt_group(dim)]
+    def hf0(x):
+        tmp0 = max(np.linalg.svd(y[0]+x*y[1], compute_uv=False).sum(axis=1).max() for y in reshuffle_list)
+        ret = tmp0 - (1 + threshold)
+        return ret
     beta_dm = get_density_matrix_boundary(dm, dm_norm=dm_norm)[1]
     if hf0(beta_dm)<0:
         ret = beta_dm
@@ -299,8 +321,8 @@ def cvx_matrix_mlogx(cvxX, sqrt_order=3, pade_order=3):
     return cvxP, constraint
 
 
-def get_ppt_ree(rho, dimA, dimB, return_info=False, sqrt_order=3, pade_order=3, use_tqdm=True):
-    rho,is_single_item,dimA,dimB,use_tqdm = _check_input_rho_SDP(rho, (dimA,dimB), use_tqdm)
+@_cvxpy_problem_cache(maxsize=8)
+def _get_ppt_ree_cvxP(dimA, dimB, sqrt_order, pade_order):
     dim = dimA * dimB
     cvxX = cvxpy.Variable((dim,dim), hermitian=True)
     cvxP, constraint = cvx_matrix_mlogx(cvxX, sqrt_order=sqrt_order, pade_order=pade_order)
@@ -313,22 +335,51 @@ def get_ppt_ree(rho, dimA, dimB, return_info=False, sqrt_order=3, pade_order=3,
     cvx_rho = cvxpy.Parameter((dimA*dimB,dimA*dimB), hermitian=True)
     obj = cvxpy.Minimize(cvxpy.real(cvxpy.trace(cvx_rho @ cvxP['mlogX'])))
     prob = cvxpy.Problem(obj, constraint)
-    ret = _sdp_ree_solve(rho, use_tqdm, cvx_rho, cvxP, prob, obj, return_info, is_single_item)
+    ret = prob, cvx_rho, cvxP, obj
+    return ret
+
+
+def get_ppt_ree(rho, dimA, dimB, return_info=False, sqrt_order=3, pade_order=3, use_tqdm=True, num_worker=1):
+    r'''get the relative entropy of entanglement with respect to the PPT states
+
+    The compiled SDP is cached for the same `(dimA,dimB,sqrt_order,pade_order)`, so repeated calls skip the
+    cvxpy canonicalization.
+
+    Parameters:
+        rho (np.ndarray,list): density matrix, or list of density matrices (3d array)
+        dimA (int): dimension of A-party
+        dimB (int): dimension of B-party
+        return_info (bool): if True, return information of the SDP solver
+        sqrt_order (int): the order of sqrtm approximation
+        pade_order (int): the order of Pade approximation
+        use_tqdm (bool): if True, use tqdm to show progress bar
+        num_worker (int): number of worker processes, the density matrices are split among the workers
+
+    Returns:
+        ret0 (float,np.array): relative entropy of entanglement. If `rho` is list of density matrices, `ret` is a 1d `np.array` of float
+        ret1 (list[dict]): if `return_info` is `True`, then `ret1` is a list of information of the SDP solver.
+    '''
+    rho,is_single_item,dimA,dimB,use_tqdm = _check_input_rho_SDP(rho, (dimA,dimB), use_tqdm)
+    prob,cvx_rho,cvxP,obj = _get_ppt_ree_cvxP(dimA, dimB, int(sqrt_order), int(pade_order))
+    ret = _sdp_ree_solve(rho, use_tqdm, cvx_rho, cvxP, prob, obj, return_info, is_single_item, num_worker)
     return ret
 
 
 def get_dm_cross_section_boundary(op0:np.ndarray, op1:np.ndarray, num_point:int=101, dim:None|tuple[int]=None,
-                tag_eig:bool=False, tag_ppt:bool=True, tag_gppt:bool=False):
+                tag_eig:bool=False, tag_ppt:bool=True, tag_gppt:bool=False, num_point_max:int|None=None, tol:float=0.01):
     r'''Get the boundary of the cross section spanned by two Hermitian operators.
 
     Parameters:
         op0 (np.ndarray): Hermitian operator, `ndim=2`
         op1 (np.ndarray): Hermitian operator, `ndim=2`
-        num_point (int): number of points to sample the boundary
+        num_point (int): number of points to sample the boundary, the initial number of points if `num_point_max` is provided
         dim (None|tuple[int]): the dimension of bipartite system, Required if `tag_ppt` or `tag_gppt` is `True`
         tag_eig (bool): whether to calculate the eigenvalues of the interpolated density matrix
         tag_ppt (bool): whether to calculate the PPT boundary
         tag_gppt (bool): whether to calculate the generalized PPT boundary
+        num_point_max (int|None): if provided, the angles are refined adaptively (up to `num_point_max` points) where the
+            boundary bends, see `numqi.entangle.get_adaptive_boundary`, then `theta_list` is not uniform
+        tol (float): tolerance of the adaptive refinement, only used if `num_point_max` is provided
 
     Returns:
         ret (dict): a dictionary containing the following keys:
@@ -352,23 +403,27 @@ def get_dm_cross_section_boundary(op0:np.ndarray, op1:np.ndarray, num_point:int=
         dimB = int(dim[1])
         assert op0.shape[0]==(dimA*dimB)
 
-    theta_list = np.linspace(0, 2*np.pi, num_point)
-    beta_dm = np.zeros_like(theta_list)
-    eig_dm = np.zeros((op0.shape[0], len(theta_list)), dtype=np.float64)
-    beta_ppt = np.zeros_like(theta_list)
-    beta_gppt = np.zeros_like(theta_list)
-    for ind0,x in enumerate(theta_list):
-        dm_target = hf_plane(x)
-        beta_dm[ind0] = get_density_matrix_boundary(dm_target)[1]
-        if tag_eig:
-            eig_dm[:,ind0] = np.linalg.eigvalsh(hf_interpolate_dm(dm_target, beta=beta_dm[ind0]))
-        if tag_ppt:
-            beta_ppt[ind0] = get_ppt_boundary(dm_target, (dimA, dimB))[1]
-        if tag_gppt:
-            beta_gppt[ind0] = get_generalized_ppt_boundary(dm_target, (dimA,dimB))
+    def hf0(theta_list):
+        ret = np.zeros((len(theta_list), 3), dtype=np.float64)
+        for ind0,x in enumerate(theta_list):
+            dm_target = hf_plane(x)
+            ret[ind0,0] = get_density_matrix_boundary(dm_target)[1]
+            if tag_ppt:
+                ret[ind0,1] = get_ppt_boundary(dm_target, (dimA, dimB))[1]
+            if tag_gppt:
+                ret[ind0,2] = get_generalized_ppt_boundary(dm_target, (dimA,dimB))
+        return ret
+    if num_point_max is None:
+        theta_list = np.linspace(0, 2*np.pi, num_point)
+        beta_all = hf0(theta_list)
+    else:
+        # theta=2*pi is not included, the curve is closed
+        theta_list,beta_all = get_adaptive_boundary(hf0, num_point_init=num_point, num_point_max=num_point_max, tol=tol)
+    beta_dm,beta_ppt,beta_gppt = beta_all.T
     ret = dict(theta_list=theta_list, beta_dm=beta_dm, theta_op=theta_op)
     if tag_eig:
-        ret['eig_dm'] = eig_dm
+        tmp0 = [np.linalg.eigvalsh(hf_interpolate_dm(hf_plane(x), beta=y)) for x,y in zip(theta_list,beta_dm)]
+        ret['eig_dm'] = np.stack(tmp0, axis=1)
     if tag_ppt:
         ret['beta_ppt'] = beta_ppt
     if tag_gppt:
@@ -377,7 +432,7 @@ def get_dm_cross_section_boundary(op0:np.ndarray, op1:np.ndarray, num_point:int=
 
 
 def plot_dm_cross_section(beta_dm:np.ndarray, theta_op:float|None=None, label:tuple[str]|None=None, dim:int|None=None,
-            ax=None, tag_show_legend:bool=True, **kwargs:dict):
+            ax=None, tag_show_legend:bool=True, theta_list:np.ndarray|None=None, **kwargs:dict):
     r'''Plot the boundary of the cross section spanned by two Hermitian operators.
 
     see `numqi.entangle.get_dm_cross_section_boundary`
@@ -389,6 +444,9 @@ def plot_dm_cross_section(beta_dm:np.ndarray, theta_op:float|None=None, label:tu
         dim (int|None): the dimension of the bipartite system, if provided, then the inscribed circle and the circumscribed circle will be plotted
         ax (None|matplotlib.axes._subplots.AxesSubplot): the axes to plot, if `None`, then create a new figure
         tag_show_legend (bool): whether to show the legend
+        theta_list (np.ndarray|None): the angles of `beta_dm` (and the boundary points in `kwargs` of the same length),
+            e.g. the non-uniform `theta_list` from the adaptive `get_dm_cross_section_boundary`, the curve is then closed.
+            if `None`, then `np.linspace(0, 2*np.pi, len(beta_dm))` is used
         kwargs (dict): additional boundary points to plot, the key will be used as label, value can be a 1d array or a dictionary of 1d arrays
 
     Returns:
@@ -403,6 +461,16 @@ def plot_dm_cross_section(beta_dm:np.ndarray, theta_op:float|None=None, label:tu
     else:
         fig,ax = plt.subplots()
     hf0 = lambda theta,r: (r*np.cos(theta), r*np.sin(theta))
+    if theta_list is not None:
+        theta_list = np.asarray(theta_list)
+        assert theta_list.shape==(len(beta_dm),)
+        theta_list = np.append(theta_list, theta_list[0]+2*np.pi)
+    def hf_theta(beta):
+        if (theta_list is not None) and (len(beta)==(len(theta_list)-1)):
+            ret = theta_list, np.append(beta, beta[0])
+        else:
+            ret = np.linspace(0, 2*np.pi, len(beta)), beta
+        return ret
     if dim is not None:
         assert isinstance(dim, int) and (dim>=2)
         r_inner = np.sqrt(1/(2*dim*dim-2*dim))
@@ -410,7 +478,7 @@ def plot_dm_cross_section(beta_dm:np.ndarray, theta_op:float|None=None, label:tu
         tmp0 = np.linspace(0, 2*np.pi, len(beta_dm))
         ax.plot(*hf0(tmp0, r_inner), color=cp_tableau[1], linestyle='dashed')
         ax.plot(*hf0(tmp0, r_outter), color=cp_tableau[1], linestyle='dashed')
-    ax.plot(*hf0(np.linspace(0, 2*np.pi, len(beta_dm)), beta_dm), label='DM', color=cp_tableau[0])
+    ax.plot(*hf0(*hf_theta(beta_dm)), label='DM', color=cp_tableau[0])
     if theta_op is not None:
         radius = 0.3
         ax.plot([0, radius], [0, 0], linestyle=':', color=cp_tableau[2], label=(None if (label is None) else label[0]))
@@ -422,11 +490,11 @@ def plot_dm_cross_section(beta_dm:np.ndarray, theta_op:float|None=None, label:tu
             for k1,v1 in value.items():
                 v1 = np.asarray(v1)
                 assert v1.ndim==1
-                ax.plot(*hf0(np.linspace(0, 2*np.pi, len(v1)), v1), label=f'{key}({k1})', color=next(color_iter))
+                ax.plot(*hf0(*hf_theta(v1)), label=f'{key}({k1})', color=next(color_iter))
         else:
             value = np.asarray(value)
             assert value.ndim==1
-            ax.plot(*hf0(np.linspace(0, 2*np.pi, len(value)), value), label=key, color=next(color_iter))
+            ax.plot(*hf0(*hf_theta(value)), label=key, color=next(color_iter))
     if tag_show_legend:
         ax.legend()
     return fig,ax
@@ -1,6 +1,5 @@
 import torch
 import numpy as np
-from tqdm.auto import tqdm
 
 import numqi.utils
 import numqi.dicke
@@ -9,12 +8,13 @@ import numqi.optimize
 import numqi.gellmann
 import numqi.manifold
 
-from ._misc import get_density_matrix_boundary, hf_interpolate_dm, _ree_bisection_solve
+from ._misc import (get_density_matrix_boundary, hf_interpolate_dm, _ree_bisection_solve,
+                _get_warm_start_theta0, _get_model_numerical_range, _reduce_batch_loss, _get_dm_target_torch)
 
 
 class PureBosonicExt(torch.nn.Module):
     r'''Approximate the relative entropy of entanglement via Pure Bosonic Extension'''
-    def __init__(self, dimA:int, dimB:int, kext:int, distance_kind:str='ree'):
+    def __init__(self, dimA:int, dimB:int, kext:int, distance_kind:str='ree', batch_size:int|None=None):
         r'''Initialize the module
 
         Parameters:
@@ -22,35 +22,39 @@ class PureBosonicExt(torch.nn.Module):
             dimB (int): The dimension of the system B
             kext (int): extension value for system B
             distance_kind (str): The kind of distance, either 'ree' or 'gellmann'
+            batch_size (int|None): If not None, solve a batch of target density matrices at once, the loss is summed
+                over the batch, see `numqi.optimize.minimize_batch`
         '''
         super().__init__()
         distance_kind = distance_kind.lower()
         assert distance_kind in {'ree','gellmann'}
         self.distance_kind = distance_kind
-        Bij = numqi.dicke.get_partial_trace_ABk_to_AB_index(kext, dimB)
+        Bij = numqi.dicke.get_partial_trace_ABk_to_AB_kernel(kext, dimB)
         num_dicke = numqi.dicke.get_dicke_number(kext, dimB)
-        tmp0 = [torch.int64,torch.int64,torch.complex128]
-        self.Bij = [[torch.tensor(y0,dtype=y1) for y0,y1 in zip(x,tmp0)] for x in Bij]
-        self.manifold = numqi.manifold.Sphere(dimA*num_dicke, dtype=torch.complex128, method='quotient')
+        tmp0 = [torch.complex128,torch.int64,torch.complex128]
+        self.Bij = tuple(torch.tensor(x,dtype=y) for x,y in zip(Bij,tmp0))
+        self.manifold = numqi.manifold.Sphere(dimA*num_dicke, batch_size=batch_size, dtype=torch.complex128, method='quotient')
         self.dimA = dimA
         self.dimB = dimB
+        self.batch_size = batch_size
 
+        self.batch_mask = None
+        self.loss_batch = None
         self.dm_torch = None
         self.dm_target = None
         self.tr_rho_log_rho = None
         self.expect_op_T_vec = None
-        self._torch_logm = ('pade',6,8) #set it by user
+        self._torch_logm = 'eigen' #set it by user, 'eigen' or ('pade',6,8)
 
     def set_dm_target(self, rho:np.ndarray):
         r'''Set the target density matrix
 
         Parameters:
-            rho (np.ndarray): The target density matrix
+            rho (np.ndarray): The target density matrix, `shape=(batch_size,N,N)` if `batch_size` is not None
         '''
-        assert (rho.ndim==2) and (rho.shape[0]==rho.shape[1]) #drop support for pure state
+        #drop support for pure state
         # rho = rho[:,np.newaxis] * rho.conj() #pure
-        self.dm_target = torch.tensor(rho, dtype=torch.complex128)
-        self.tr_rho_log_rho = -numqi.utils.get_von_neumann_entropy(rho)
+        self.dm_target,self.tr_rho_log_rho = _get_dm_target_torch(rho, self.batch_size, self.dimA*self.dimB)
 
     def set_expectation_op(self, op:np.ndarray):
         r'''Set the expectation operator
@@ -63,7 +67,8 @@ class PureBosonicExt(torch.nn.Module):
         self.expect_op_T_vec = torch.tensor(op.T.reshape(-1), dtype=torch.complex128)
 
     def forward(self):
-        tmp1 = self.manifold().reshape(self.dimA,-1)
+        tmp0 = (self.dimA,-1) if (self.batch_size is None) else (self.batch_size,self.dimA,-1)
+        tmp1 = self.manifold().reshape(*tmp0)
         dm_torch = numqi.dicke.partial_trace_ABk_to_AB(tmp1, self.Bij)
         self.dm_torch = dm_torch.detach()
         if self.dm_target is not None:
@@ -71,12 +76,16 @@ class PureBosonicExt(torch.nn.Module):
                 loss = numqi.gellmann.get_density_matrix_distance2(self.dm_target, dm_torch)
             else:
                 loss = numqi.utils.get_relative_entropy(self.dm_target, dm_torch, self.tr_rho_log_rho, self._torch_logm)
-        else:
+        elif self.batch_size is None:
             loss = torch.dot(dm_torch.view(-1), self.expect_op_T_vec).real
+        else:
+            loss = (dm_torch.reshape(self.batch_size, -1) @ self.expect_op_T_vec).real
+        if self.batch_size is not None:
+            loss = _reduce_batch_loss(self, loss)
         return loss
 
     def get_boundary(self, dm0:np.ndarray, xtol:float=1e-4, converge_tol:float=1e-10, threshold:float=1e-7,
-                    num_repeat:int=1, use_tqdm:bool=True, return_info:bool=False, seed:int|None=None):
+                    num_repeat:int=1, use_tqdm:bool=True, return_info:bool=False, warm_start:bool=True, seed:int|None=None):
         r'''Get the boundary of Pure Bosonic Extension
 
         Parameters:
@@ -87,28 +96,34 @@ class PureBosonicExt(torch.nn.Module):
             num_repeat (int): The number of repeat for optimization
             use_tqdm (bool): Whether to use tqdm
             return_info (bool): Whether to return the history information
+            warm_start (bool): Whether to start the optimization from the optimum of the nearest solved beta
             seed (int|None): The random seed
 
         Returns:
             beta (float): length of the boundary
             history_info (list): The history information, only if return_info is True
         '''
+        assert self.batch_size is None
         beta_u = get_density_matrix_boundary(dm0)[1]
         dm0_norm = numqi.gellmann.dm_to_gellmann_norm(dm0)
         np_rng = numqi.random.get_numpy_rng(seed)
+        theta_cache = dict()
         def hf0(beta):
             # use alpha to avoid time-consuming gellmann conversion
             tmp0 = hf_interpolate_dm(dm0, alpha=beta/dm0_norm)
             self.set_dm_target(tmp0)
-            theta_optim = numqi.optimize.minimize(self, theta0='uniform',
+            theta0 = _get_warm_start_theta0(theta_cache, beta) if warm_start else 'uniform'
+            theta_optim = numqi.optimize.minimize(self, theta0=theta0,
                         tol=converge_tol, num_repeat=num_repeat, seed=np_rng, print_every_round=0)
+            theta_cache[beta] = theta_optim.x
             return float(theta_optim.fun)
         beta,history_info = _ree_bisection_solve(hf0, 0, beta_u, xtol, threshold, use_tqdm=use_tqdm)
         ret = (beta,history_info) if return_info else beta
         return ret
 
     def get_numerical_range(self, op0:np.ndarray, op1:np.ndarray, num_theta:int=400, converge_tol:float=1e-5,
-                            num_repeat:int=1, use_tqdm:bool=True, seed:int|None=None):
+                            num_repeat:int=1, use_tqdm:bool=True, warm_start:bool=False, num_worker:int=1,
+                            seed:int|None=None):
         r'''Get the numerical range of Pure Bosonic Extension
 
         Parameters:
@@ -118,24 +133,20 @@ class PureBosonicExt(torch.nn.Module):
             converge_tol (float): The convergence tolerance for optimization
             num_repeat (int): The number of repeat for optimization
             use_tqdm (bool): Whether to use tqdm
+            warm_start (bool): Whether to start the first round of the optimization from the optimum of the previous theta.
+                The optimum may jump between branches when theta varies, so `num_repeat>1` is recommended with warm start
+            num_worker (int): The number of worker processes, each worker solves a contiguous arc of theta.
+                If `num_worker>1`, the model itself is not modified
             seed (int|None): The random seed
 
         Returns:
             ret (np.ndarray): The numerical range, `shape=(num_theta,2)`
         '''
-        np_rng = numqi.random.get_numpy_rng(seed)
+        assert self.batch_size is None
         N0 = self.dimA*self.dimB
         assert (op0.shape==(N0,N0)) and (op1.shape==(N0,N0))
-        theta_list = np.linspace(0, 2*np.pi, num_theta)
-        ret = []
-        kwargs = dict(num_repeat=num_repeat, seed=np_rng, print_every_round=0, tol=converge_tol)
-        for theta_i in (tqdm(theta_list) if use_tqdm else theta_list):
-            # see numqi.entangle.get_ppt_numerical_range, we use the maximization there
-            self.set_expectation_op(-np.cos(theta_i)*op0 - np.sin(theta_i)*op1)
-            numqi.optimize.minimize(self, **kwargs)
-            rho = self.dm_torch.detach().numpy()
-            ret.append([np.trace(x @ rho).real for x in [op0,op1]])
-        ret = np.array(ret)
+        ret = _get_model_numerical_range(self, op0, op1, num_theta, converge_tol, num_repeat,
+                    use_tqdm, warm_start, num_worker, seed)
         return ret
 
 # TODO
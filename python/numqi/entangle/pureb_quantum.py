@@ -6,6 +6,8 @@ import scipy.special
 import numqi.dicke
 import numqi.utils
 
+from ._misc import _get_dm_target_torch, _reduce_batch_loss
+
 def get_qudit_H(dimD):
     tmp0 = np.exp(2j*np.pi*np.arange(dimD)/dimD)
     ret = np.vander(tmp0, dimD, increasing=True) / np.sqrt(dimD)
@@ -13,21 +15,21 @@ def get_qudit_H(dimD):
 
 
 def get_qudit_XZ(theta, dim, H=None):
-    #period(theta)=1
+    #period(theta)=1, theta: (...,num_XZ,2), return (...,dim,dim)
     is_torch = isinstance(theta, torch.Tensor)
     if H is None:
         H = get_qudit_H(dim)
         if is_torch:
             H = torch.tensor(H, device=theta.device)
-    theta = theta.T.reshape(2,-1,1)
     if is_torch:
-        Xtheta,Ztheta = torch.exp(2j*np.pi*torch.arange(dim)*theta)
+        XZtheta = torch.exp(2j*np.pi*theta[...,None]*torch.arange(dim, device=theta.device))
     else:
-        Xtheta,Ztheta = np.exp(2j*np.pi*np.arange(dim)*theta)
+        XZtheta = np.exp(2j*np.pi*theta[...,None]*np.arange(dim))
     Hconj = H.T.conj()
-    ret = (H * Xtheta[0]) @ (Hconj*Ztheta[0])
-    for ind0 in range(1,Xtheta.shape[0]):
-        ret = (H * Xtheta[ind0]) @ (Hconj*Ztheta[ind0]) @ ret
+    hf0 = lambda x: (H * XZtheta[...,x,0,None,:]) @ (Hconj * XZtheta[...,x,1,None,:])
+    ret = hf0(0)
+    for ind0 in range(1,theta.shape[-2]):
+        ret = hf0(ind0) @ ret
     return ret
 
 
@@ -46,7 +48,7 @@ def get_mps_dicke_transform_matrix(dim, num_qudit, num_more_space=1.05, seed=Non
 
     klist = np.array(get_dicke_klist(dim, num_qudit))
     binom_term = np.sqrt(get_klist_binom_term(klist))
-    matA = np.prod(mps_alpha.reshape(num_mps, 1, dim)**(klist.reshape(1,num_dicke,dim)), axis=2) * binom_term
+    matA = _mps_alpha_monomial(mps_alpha, get_mps_dicke_monomial_index(klist), num_qudit) * binom_term
     U,S,V = np.linalg.svd(matA, full_matrices=False)
     # matA = (U*S) @ V
     assert S[-1]>1e-7, 'not full rank, generate mps again'
@@ -67,21 +69,42 @@ def get_klist_binom_term(klist):
     return ret
 
 
-def mps_to_dicke(mps_p, mps_alpha, klist, binom_term=None):
+def get_mps_dicke_monomial_index(klist):
+    # index of alpha_j**k_j in the flattened power table (dim,num_qudit+1), shape (num_dicke,dim)
+    klist = np.asarray(klist)
+    num_qudit = int(klist[0].sum())
+    ret = np.arange(klist.shape[1])*(num_qudit+1) + klist
+    return ret
+
+
+def _mps_alpha_monomial(mps_alpha, monomial_index, num_qudit):
+    # prod_j alpha_j**k_j for each (mps,dicke), shape (...,num_mps,num_dicke)
+    # the power table [1,alpha,...,alpha**num_qudit] is built by cumprod, no 0**0 (nan) issue
+    num_mps,dim = mps_alpha.shape[-2:]
+    tmp0 = mps_alpha[...,None]
+    if isinstance(mps_alpha, torch.Tensor):
+        tmp1 = torch.cat([torch.ones_like(tmp0), tmp0.expand(*tmp0.shape[:-1], num_qudit)], dim=-1)
+        table = torch.cumprod(tmp1, dim=-1).reshape(*mps_alpha.shape[:-2], num_mps, dim*(num_qudit+1))
+        ret = torch.prod(table[...,monomial_index], dim=-1)
+    else:
+        tmp1 = np.concatenate([np.ones_like(tmp0), np.broadcast_to(tmp0, (*tmp0.shape[:-1], num_qudit))], axis=-1)
+        table = np.cumprod(tmp1, axis=-1).reshape(*mps_alpha.shape[:-2], num_mps, dim*(num_qudit+1))
+        ret = np.prod(table[...,monomial_index], axis=-1)
+    return ret
+
+
+def mps_to_dicke(mps_p, mps_alpha, klist, binom_term=None, monomial_index=None):
+    # mps_p (...,dimA,num_mps), mps_alpha (...,num_mps,dim), return dicke_p (...,dimA,num_dicke)
     is_torch = isinstance(mps_p, torch.Tensor)
-    dimA,num_mps = mps_p.shape
-    num_dicke,dim = klist.shape
-    num_qudit = klist[0].sum()
+    tmp0 = klist.detach().numpy() if isinstance(klist, torch.Tensor) else np.asarray(klist)
+    num_qudit = int(tmp0[0].sum())
     if binom_term is None:
-        tmp0 = klist.detach().numpy if is_torch else klist
         binom_term = np.sqrt(get_klist_binom_term(tmp0))
-    tmp0 = mps_alpha.reshape(num_mps,1,dim)**(klist.reshape(1,num_dicke,dim))
-    if is_torch:
-        tmp0 = torch.nan_to_num(tmp0.real, nan=1) + 1j*torch.nan_to_num(tmp0.imag, nan=0)
-        tmp1 = torch.prod(tmp0, dim=2) #(0+0j)**0 is nan (not a number)
-    else:
-        tmp1 = np.prod(np.nan_to_num(tmp0, nan=1), axis=2)
-        tmp1 = np.prod(mps_alpha.reshape(num_mps,1,dim)**(klist.reshape(1,num_dicke,dim)), axis=2)
+    if monomial_index is None:
+        monomial_index = get_mps_dicke_monomial_index(tmp0)
+        if is_torch:
+            monomial_index = torch.tensor(monomial_index, dtype=torch.int64)
+    tmp1 = _mps_alpha_monomial(mps_alpha, monomial_index, num_qudit)
     dicke_p = (mps_p @ tmp1)*binom_term
     return dicke_p
 
@@ -91,17 +114,22 @@ def dicke_to_mps(dicke_p, matB, mps_basis_alpha):
 
 
 def mps_dicke_single_gate(mps_p, mps_alpha, UA, UB):
-    ret = UA @ mps_p, mps_alpha @ UB.T
+    ret = UA @ mps_p, mps_alpha @ UB.swapaxes(-1,-2)
     return ret
 
 
 def mps_dicke_cnot(dicke_p, klist_permutation_index):
+    # klist_permutation_index: flattened index from get_mps_dicke_cnot_index (recommended), or list from get_klist_permutation_index
     is_torch = isinstance(dicke_p, torch.Tensor)
-    tmp0 = [x[y] for x,y in zip(dicke_p, klist_permutation_index)]
-    if is_torch:
-        ret = torch.stack(tmp0)
+    if hasattr(klist_permutation_index, 'ndim'):
+        shape = dicke_p.shape
+        ret = dicke_p.reshape(*shape[:-2], -1)[...,klist_permutation_index].reshape(shape)
     else:
-        ret = np.stack(tmp0)
+        tmp0 = [x[y] for x,y in zip(dicke_p, klist_permutation_index)]
+        if is_torch:
+            ret = torch.stack(tmp0)
+        else:
+            ret = np.stack(tmp0)
     return ret
 
 
@@ -115,40 +143,55 @@ def get_klist_permutation_index(klist):
     return klist_permutation_index
 
 
+def get_mps_dicke_cnot_index(klist, dimA):
+    # controlled-X**a on the B-qudits, as one gather on the flattened (dimA,num_dicke) dicke_p
+    klist = [tuple(x) for x in np.asarray(klist).tolist()]
+    num_dicke = len(klist)
+    tmp0 = get_klist_permutation_index(klist)
+    tmp0 = [np.arange(num_dicke)] + tmp0[1:]
+    ret = np.concatenate([x*num_dicke + tmp0[x%len(tmp0)] for x in range(dimA)])
+    return ret
+
+
 class QuantumPureBosonicExt(torch.nn.Module):
-    def __init__(self, dimA, dimB, num_kext, num_layer, num_XZ=None):
+    def __init__(self, dimA, dimB, num_kext, num_layer, num_XZ=None, batch_size=None):
         super().__init__()
         num_XZ = max(math.ceil((dimB*dimB-1)/2), 3) if num_XZ is None else num_XZ
         mps_basis_alpha,klist_np,matA,matB = get_mps_dicke_transform_matrix(dimB, num_kext)
         self.klist = [tuple(x) for x in klist_np.tolist()]
         self.klist_np = klist_np
         self.klist_torch = torch.tensor(klist_np, dtype=torch.int64)
+        self.monomial_index = torch.tensor(get_mps_dicke_monomial_index(klist_np), dtype=torch.int64)
         self.mps_basis_alpha = torch.tensor(mps_basis_alpha, dtype=torch.complex128)
         self.matA = torch.tensor(matA, dtype=torch.complex128)
         self.matB = torch.tensor(matB, dtype=torch.complex128)
-        tmp0 = get_klist_permutation_index(self.klist)
-        self.klist_permutation_index = [tmp0[0]] + [torch.tensor(x, dtype=torch.int64) for x in tmp0[1:]]
-        tmp0 = np.random.rand(num_layer, 2, num_XZ, 2)
+        self.cnot_index = torch.tensor(get_mps_dicke_cnot_index(klist_np, dimA), dtype=torch.int64)
+        tmp0 = np.random.rand(*(() if (batch_size is None) else (batch_size,)), num_layer, 2, num_XZ, 2)
         self.theta = torch.nn.Parameter(torch.tensor(tmp0, dtype=torch.float64))
+        self.dimA = dimA
+        self.dimB = dimB
+        self.batch_size = batch_size
 
         self.mps_p0 = torch.tensor([1]+[0]*(dimA-1), dtype=torch.complex128).view(dimA,1)
         self.mps_alpha0 = torch.tensor([1]+[0]*(dimB-1), dtype=torch.complex128).view(1,dimB)
-        self.weylH = torch.tensor(get_qudit_H(dimB), dtype=torch.complex128)
+        self.weylH_A = torch.tensor(get_qudit_H(dimA), dtype=torch.complex128)
+        self.weylH_B = torch.tensor(get_qudit_H(dimB), dtype=torch.complex128)
 
         self.binom_term = torch.tensor(np.sqrt(get_klist_binom_term(klist_np)), dtype=torch.float64)
-        Bij = numqi.dicke.get_partial_trace_ABk_to_AB_index(num_kext, dimB)
-        tmp0 = [torch.int64,torch.int64,torch.complex128]
-        self.Bij = [[torch.tensor(y0,dtype=y1) for y0,y1 in zip(x,tmp0)] for x in Bij]
+        Bij = numqi.dicke.get_partial_trace_ABk_to_AB_kernel(num_kext, dimB)
+        tmp0 = [torch.complex128,torch.int64,torch.complex128]
+        self.Bij = tuple(torch.tensor(x,dtype=y) for x,y in zip(Bij,tmp0))
+        self.batch_mask = None
+        self.loss_batch = None
         self.dm_torch = None
         self.dm_target = None
         self.tr_rho_log_rho = None
         self.expect_op_T_vec = None
-        self._torch_logm = ('pade',6,8) #set it by user
+        self._torch_logm = 'eigen' #set it by user, 'eigen' or ('pade',6,8)
 
     def set_dm_target(self, rho):
-        assert (rho.ndim==2) and (rho.shape[0]==rho.shape[1])
-        self.dm_target = torch.tensor(rho, dtype=torch.complex128)
-        self.tr_rho_log_rho = -numqi.utils.get_von_neumann_entropy(rho)
+        # rho: (N,N), or (batch_size,N,N) if batch_size is not None
+        self.dm_target,self.tr_rho_log_rho = _get_dm_target_torch(rho, self.batch_size, self.dimA*self.dimB)
 
     def set_expectation_op(self, op):
         self.dm_target = None
@@ -156,24 +199,27 @@ class QuantumPureBosonicExt(torch.nn.Module):
         self.expect_op_T_vec = torch.tensor(op.T.reshape(-1), dtype=torch.complex128)
 
     def forward(self):
-        num_layer = self.theta.shape[0]
+        num_layer = self.theta.shape[-4]
         mps_p = self.mps_p0
         mps_alpha = self.mps_alpha0
-        dimA = mps_p.shape[0]
-        dimB = mps_alpha.shape[1]
         for ind0 in range(num_layer):
-            UA = get_qudit_XZ(self.theta[ind0,0], dimA, H=self.weylH)
-            UB = get_qudit_XZ(self.theta[ind0,1], dimB, H=self.weylH)
+            UA = get_qudit_XZ(self.theta[...,ind0,0,:,:], self.dimA, H=self.weylH_A)
+            UB = get_qudit_XZ(self.theta[...,ind0,1,:,:], self.dimB, H=self.weylH_B)
             mps_p, mps_alpha = mps_dicke_single_gate(mps_p, mps_alpha, UA, UB)
-            dicke_p = mps_to_dicke(mps_p, mps_alpha, self.klist_torch, self.binom_term)
-            dicke_p = mps_dicke_cnot(dicke_p, self.klist_permutation_index)
-            mps_p,mps_alpha = dicke_to_mps(dicke_p, self.matB, self.mps_basis_alpha)
+            dicke_p = mps_to_dicke(mps_p, mps_alpha, self.klist_torch, self.binom_term, self.monomial_index)
+            dicke_p = mps_dicke_cnot(dicke_p, self.cnot_index)
+            if ind0<(num_layer-1):
+                mps_p,mps_alpha = dicke_to_mps(dicke_p, self.matB, self.mps_basis_alpha)
         dm_torch = numqi.dicke.partial_trace_ABk_to_AB(dicke_p, self.Bij)
         self.dm_torch = dm_torch.detach()
         if self.dm_target is not None:
             loss = numqi.utils.get_relative_entropy(self.dm_target, dm_torch, self.tr_rho_log_rho, self._torch_logm)
+        elif self.batch_size is None:
+            loss = torch.dot(dm_torch.view(-1), self.expect_op_T_vec).real
         else:
-            loss = torch.dot(self.dm_torch.view(-1), self.expect_op_T_vec).real
+            loss = (dm_torch.reshape(self.batch_size, -1) @ self.expect_op_T_vec).real
+        if self.batch_size is not None:
+            loss = _reduce_batch_loss(self, loss)
         return loss
 
 # mps_p (complex128,(NA,N0))
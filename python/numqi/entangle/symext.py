@@ -1,3 +1,4 @@
+import warnings
 import functools
 import numpy as np
 import cvxpy
@@ -8,8 +9,9 @@ import numqi.dicke
 import numqi.group
 import numqi.gellmann
 
+from numqi._cvxpy_utils import _array_to_key, _key_to_array, _sdp_direction_sweep, _cvxpy_problem_cache
 from .ppt import cvx_matrix_mlogx
-from ._misc import _sdp_ree_solve, _check_input_rho_SDP
+from ._misc import _sdp_ree_solve, _check_input_rho_SDP, _reduce_batch_loss
 
 
 @functools.lru_cache
@@ -30,35 +32,56 @@ def get_symmetric_extension_index_list(dimA, dimB, kext, kind='2d'):
     return ret
 
 
-# dimA=2 dimB=3 kext=3 MOSEK: 8GB 10second
-# dimA=3 dimB=3 kext=3 MOSEK: 12GB 50s
-def is_ABk_symmetric_ext_naive(rho, dim, kext, index_kind='2d'):
+def _get_symmetric_extension_irrep_basis(dimB:int, kext:int):
+    # basis consistent with get_symmetric_extension_irrep_coeff, list of (multiplicity, dim_irrep, dimB**kext)
+    if dimB==2:
+        ret = [numqi.dicke.get_dicke_basis(kext, 2)[np.newaxis]]
+    else:
+        ret = [np.stack(x) for x in numqi.group.symext.get_sud_symmetric_irrep_basis(dimB, kext)]
+    return ret
+
+
+# the SDP is solved in the irrep basis, the full extension is assembled afterwards
+# dimA=3 dimB=3 kext=4 CLARABEL: 0.3s 33MB (full dimA*dimB**kext variable: 5.8s 419MB)
+def is_ABk_symmetric_ext_naive(rho, dim, kext, index_kind=None, *, use_ppt=False):
+    '''check if rho has symmetric extension of kext copies on B-party, and return the extension in the full Hilbert space
+
+    Parameters:
+        rho (np.ndarray): density matrix
+        dim (tuple(int)): tuple of length 2, dimension of A-party and B-party
+        kext (int): number of copies of symmetric extension
+        index_kind (str,None): deprecated and ignored, `'1d'` or `'2d'` selected the indexing of the permutation
+            constraints, the SDP is now solved in the irrep block basis without them
+        use_ppt (bool): if True, use PPT (positive partial transpose) constraint
+
+    Returns:
+        has_kext (bool): whether rho has symmetric extension
+        rho_ext (np.ndarray,None): the symmetric extension of shape `(dimA*dimB**kext,dimA*dimB**kext)`, `None` if `has_kext=False`
+    '''
     assert len(dim)==2
-    assert index_kind in {'1d', '2d'} #2d is a little bit more faster
+    if index_kind is not None:
+        assert index_kind in {'1d', '2d'}
+        warnings.warn('"index_kind" of is_ABk_symmetric_ext_naive is deprecated and ignored', DeprecationWarning, stacklevel=2)
     dimA = int(dim[0])
     dimB = int(dim[1])
     assert (rho.ndim==2) and (rho.shape[0]==rho.shape[1]) and (rho.shape[0]==dimA*dimB)
     assert kext>=2
-    indP_list = get_symmetric_extension_index_list(dimA, dimB, kext, kind=index_kind)
-    cvxX = cvxpy.Variable((dimA*dimB**(kext),dimA*dimB**(kext)), hermitian=True)
-    constraints = [
-        cvxX>>0,
-        cvxpy.trace(cvxX)==1,
-        cvxpy.partial_trace(cvxX, (dimA*dimB,dimB**(kext-1)), 1)==np.asfortranarray(rho),
-    ]
-    if index_kind=='1d':
-        tmp0 = cvxpy.reshape(cvxX, (dimA*dimA*dimB**(2*kext)), order='F')
-        constraints += [cvxpy.reshape(tmp0[x],shape=cvxX.shape,order='F')==cvxX for x in indP_list]
+    tmp0 = rho.reshape(dimA,dimB,dimA,dimB).transpose(0,2,1,3).reshape(dimA*dimA,dimB*dimB)
+    cvxP_list, constraints = _ABk_symmetric_extension_setup(dimA, dimB, kext, False, use_ppt, tmp0)
+    prob = cvxpy.Problem(cvxpy.Minimize(1), constraints)
+    try:
+        prob.solve()
+        has_kext = not np.isinf(prob.value)
+    except cvxpy.error.SolverError: #sometimes error when fail to solve
+        has_kext = False
+    if has_kext:
+        rho_ext = 0
+        for cvxP,basis in zip(cvxP_list, _get_symmetric_extension_irrep_basis(dimB, kext)):
+            tmp0 = cvxP.value.reshape(dimA, basis.shape[1], dimA, basis.shape[1])
+            rho_ext = rho_ext + np.einsum(tmp0, [0,1,2,3], basis, [4,1,5], basis.conj(), [4,3,6], [0,5,2,6], optimize=True)
+        ret = True, rho_ext.reshape(dimA*dimB**kext, -1)
     else:
-        constraints += [(cvxX[indP[:,np.newaxis],indP]==cvxX) for indP in indP_list]
-    obj = cvxpy.Minimize(1)
-    prob = cvxpy.Problem(obj, constraints)
-    prob.solve()
-
-    if np.isinf(prob.value):
         ret = False, None
-    else:
-        ret = True, np.ascontiguousarray(cvxX.value)
     return ret
 
 
@@ -73,9 +96,40 @@ def get_cvxpy_transpose0213_indexing(N0, N1, N2=None, N3=None):
     return ret
 
 
-def get_ABk_symmetric_extension_ree(rho, dim, kext, use_ppt=False, use_boson=False, return_info=False, sqrt_order=3, pade_order=3, use_tqdm=False):
+@functools.lru_cache
+def get_cvxpy_partial_transpose_indexing(N0, N1):
+    # partial transpose on the second party of (N0*N1,N0*N1) matrix, as indexing of the F-order flattened matrix
+    # much faster to compile than cvxpy.partial_transpose
+    N = N0*N1
+    tmp0 = np.arange(N*N).reshape(N, N, order='F').reshape(N0,N1,N0,N1).transpose(0,3,2,1)
+    ret = tmp0.reshape(N, N).reshape(-1, order='F')
+    ret.flags.writeable = False
+    return ret
+
+
+@_cvxpy_problem_cache(maxsize=2)
+def _get_ABk_symmetric_extension_ree_cvxP(dimA, dimB, kext, use_ppt, use_boson, sqrt_order, pade_order):
+    cvxP_list,constraints,tmp0 = _ABk_symmetric_extension_setup(dimA, dimB, kext, use_boson, use_ppt)
+    #tmp0 is of shape (dimA*dimA,dimB*dimB)
+    index0213_ab = get_cvxpy_transpose0213_indexing(dimA,dimB)
+    cvx_rdm = cvxpy.reshape(cvxpy.reshape(tmp0, tmp0.size, order='F')[index0213_ab], (dimA*dimB,dimA*dimB), order='F')
+    cvxP, tmp0 = cvx_matrix_mlogx(cvx_rdm, sqrt_order=sqrt_order, pade_order=pade_order)
+    constraints += tmp0
+    # cvxP['X'] is cvxX
+    cvx_rho = cvxpy.Parameter((dimA*dimB,dimA*dimB), hermitian=True)
+    obj = cvxpy.Minimize(cvxpy.real(cvxpy.trace(cvx_rho @ cvxP['mlogX'])))
+    prob = cvxpy.Problem(obj, constraints)
+    ret = prob, cvx_rho, cvxP, obj
+    return ret
+
+
+def get_ABk_symmetric_extension_ree(rho, dim, kext, use_ppt=False, use_boson=False, return_info=False, sqrt_order=3,
+            pade_order=3, use_tqdm=False, num_worker=1):
     r'''get the relative entropy of entanglement of k-symmetric extension on B-party
 
+    The compiled SDP is cached for the same `(dim,kext,use_ppt,use_boson,sqrt_order,pade_order)`, so repeated calls skip the
+    cvxpy canonicalization. Only the last 2 problems are kept, call `numqi.entangle.clear_sdp_cache()` to release them.
+
     Parameters:
         rho (np.ndarray,list): density matrix, or list of density matrices (3d array)
         dim (tuple(int)): tuple of length 2, dimension of A-party and B-party
@@ -86,6 +140,7 @@ def get_ABk_symmetric_extension_ree(rho, dim, kext, use_ppt=False, use_boson=Fal
         sqrt_order (int): the order of sqrtm approximation
         pade_order (int): the order of Pade approximation
         use_tqdm (bool): if True, use tqdm to show progress bar
+        num_worker (int): number of worker processes, the density matrices are split among the workers
 
     Returns:
         ret0 (float,np.array):  `ret` is a float indicates relative entropy of entanglement.
@@ -96,39 +151,9 @@ def get_ABk_symmetric_extension_ree(rho, dim, kext, use_ppt=False, use_boson=Fal
     if kext==1:
         assert use_ppt, 'kext=1 with use_ppt=False is meaningless'
     rho,is_single_item,dimA,dimB,use_tqdm = _check_input_rho_SDP(rho, dim, use_tqdm)
-
-    coeffB_list,multiplicity_list = numqi.group.symext.get_symmetric_extension_irrep_coeff(dimB, kext)
-    if use_boson:
-        assert numqi.dicke.get_dicke_number(kext, dimB)==coeffB_list[0].shape[0]
-        coeffB_list = coeffB_list[:1]
-        multiplicity_list = multiplicity_list[:1]
-    dim_coeffB_list = [x.shape[0] for x in coeffB_list]
-
-    cvxP_list = [cvxpy.Variable((x*dimA,x*dimA), hermitian=True) for x in dim_coeffB_list]
-    index0213_list = [get_cvxpy_transpose0213_indexing(dimA,x) for x in dim_coeffB_list]
-    index0213_ab = get_cvxpy_transpose0213_indexing(dimA,dimB)
-    # TODO replace indexing-matmul with indexing-sum
-    cvx_rdm_list = []
-    #TODO trace(cvx_rdm) is not correct
-    for ind0 in range(len(coeffB_list)):
-        tmp0 = cvxP_list[ind0]
-        tmp1 = index0213_list[ind0]
-        tmp2 = dim_coeffB_list[ind0]**2
-        tmp3 = cvxpy.reshape(cvxpy.reshape(tmp0, tmp0.size, order='F')[tmp1], (dimA*dimA,tmp2), order='F')
-        cvx_rdm_list.append(tmp3 @ np.asfortranarray(coeffB_list[ind0].reshape(tmp2, dimB*dimB)))
-    tmp0 = sum(cvx_rdm_list) #(dimA*dimA,dimB*dimB)
-    cvx_rdm = cvxpy.reshape(cvxpy.reshape(tmp0, tmp0.size, order='F')[index0213_ab], (dimA*dimB,dimA*dimB), order='F')
-    constraints = [x>>0 for x in cvxP_list]
-    if use_ppt:
-        constraints = +[cvxpy.partial_transpose(x, [dimA,x.shape[0]//dimA], [1])>>0 for x in cvxP_list]
-    constraints += [sum(cvxpy.trace(x)*y for x,y in zip(cvxP_list,multiplicity_list))==1]
-    cvxP, tmp0 = cvx_matrix_mlogx(cvx_rdm, sqrt_order=sqrt_order, pade_order=pade_order)
-    constraints += tmp0
-    # cvxP['X'] is cvxX
-    cvx_rho = cvxpy.Parameter((dimA*dimB,dimA*dimB), hermitian=True)
-    obj = cvxpy.Minimize(cvxpy.real(cvxpy.trace(cvx_rho @ cvxP['mlogX'])))
-    prob = cvxpy.Problem(obj, constraints)
-    ret = _sdp_ree_solve(rho, use_tqdm, cvx_rho, cvxP, prob, obj, return_info, is_single_item)
+    prob,cvx_rho,cvxP,obj = _get_ABk_symmetric_extension_ree_cvxP(dimA, dimB, int(kext), bool(use_ppt), bool(use_boson),
+                int(sqrt_order), int(pade_order))
+    ret = _sdp_ree_solve(rho, use_tqdm, cvx_rho, cvxP, prob, obj, return_info, is_single_item, num_worker)
     return ret
 
 
@@ -152,7 +177,9 @@ def _ABk_symmetric_extension_setup(dimA, dimB, kext, use_boson, use_ppt, cvx_rho
     cvx_rdm = sum(cvx_rdm_list) #(dimA,dimA,dimB,dimB)
     constraints = [x>>0 for x in cvxP_list]
     if use_ppt:
-        constraints += [cvxpy.partial_transpose(x, [dimA,x.shape[0]//dimA], axis=1)>>0 for x in cvxP_list]
+        for x in cvxP_list:
+            tmp0 = get_cvxpy_partial_transpose_indexing(dimA, x.shape[0]//dimA)
+            constraints.append(cvxpy.reshape(cvxpy.reshape(x, x.size, order='F')[tmp0], x.shape, order='F')>>0)
     constraints += [sum(cvxpy.trace(x)*y for x,y in zip(cvxP_list,multiplicity_list))==1]
     if cvx_rho is None:
         ret = cvxP_list, constraints, cvx_rdm
@@ -208,13 +235,35 @@ def is_ABk_symmetric_ext(rho, dim, kext, use_ppt=False, use_boson=False, use_tqd
 
 
 
-def get_ABk_extension_numerical_range(op_list, direction, dim, kext, use_ppt=False, use_boson=False, use_tqdm=True, return_info=False):
+@_cvxpy_problem_cache(maxsize=2)
+def _get_ABk_extension_numerical_range_cvxP(op_list_key, dimA, dimB, kext, use_ppt, use_boson):
+    op_list = _key_to_array(op_list_key)
+    num_op = op_list.shape[0]
+    N0 = dimA*dimB
+    cvx_vec = cvxpy.Parameter(num_op)
+    cvx_beta = cvxpy.Variable()
+    cvxP_list,constraints,cvx_rho = _ABk_symmetric_extension_setup(dimA, dimB, kext, use_boson, use_ppt)
+    # cvx_rho is of shape (dimA*dimA,dimB*dimB)
+    tmp0 = op_list.reshape(-1,dimA,dimB,dimA,dimB).transpose(0,4,2,3,1).reshape(-1,dimA*dimB*dimA*dimB, order='C')
+    cvx_op = cvxpy.real(tmp0 @ cvxpy.reshape(cvx_rho, N0*N0, order='F'))
+    constraints.append(cvx_beta*cvx_vec==cvx_op)
+    cvx_obj = cvxpy.Maximize(cvx_beta)
+    prob = cvxpy.Problem(cvx_obj, constraints)
+    ret = prob,cvx_vec,cvx_obj,cvx_op,constraints[-1]
+    return ret
+
+
+def get_ABk_extension_numerical_range(op_list, direction, dim, kext, use_ppt=False, use_boson=False, use_tqdm=True, return_info=False,
+            num_worker=1):
     r'''get the symmetric extension numerical range of a list of operators
 
     $$ \max\;\beta $$
 
     $$ s.t.\;\begin{cases} \rho_{AB^{k}}\succeq0\\ \mathrm{Tr}[\rho_{AB^{k}}]=1\\ P_{B_{i}B_{j}}\rho_{AB^{k}}P_{B_{i}B_{j}}=\rho_{AB^{k}}\\ \mathrm{Tr}\left[\mathrm{Tr}_{B^{k-1}}\left[\rho\right]A_{i}\right]=\beta\hat{n}_{i} \end{cases} $$
 
+    The compiled SDP is cached for the same `(op_list,dim,kext,use_ppt,use_boson)`, so repeated calls skip the
+    cvxpy canonicalization. Only the last 2 problems are kept, call `numqi.entangle.clear_sdp_cache()` to release them.
+
     Parameters:
         op_list (list): a list of operators, each operator is a 2d numpy array
         direction (np.ndarrray): the boundary along the direction will be calculated, if 2d, then each row is a direction
@@ -224,6 +273,7 @@ def get_ABk_extension_numerical_range(op_list, direction, dim, kext, use_ppt=Fal
         use_boson (bool): if `True`, then use bosonic symmetrical extension
         return_info (bool): if `True`, then return the boundary and the boundary's normal vector
         use_tqdm (bool): if `True`, then use tqdm to show the progress
+        num_worker (int): number of worker processes, the directions are split among the workers
 
     Returns:
         beta (np.ndarray): the distance from the origin to the boundary along the direction.
@@ -242,38 +292,9 @@ def get_ABk_extension_numerical_range(op_list, direction, dim, kext, use_ppt=Fal
     if direction.shape[0]==1:
         use_tqdm = False
     dimA,dimB = dim
-    N0 = dimA*dimB
-    cvx_vec = cvxpy.Parameter(num_op)
-    cvx_beta = cvxpy.Variable()
-    cvxP_list,constraints,cvx_rho = _ABk_symmetric_extension_setup(dimA, dimB, kext, use_boson, use_ppt)
-    # cvx_rho is of shape (dimA*dimA,dimB*dimB)
-    tmp0 = op_list.reshape(-1,dimA,dimB,dimA,dimB).transpose(0,4,2,3,1).reshape(-1,dimA*dimB*dimA*dimB, order='C')
-    cvx_op = cvxpy.real(tmp0 @ cvxpy.reshape(cvx_rho, N0*N0, order='F'))
-    constraints.append(cvx_beta*cvx_vec==cvx_op)
-    cvx_obj = cvxpy.Maximize(cvx_beta)
-    prob = cvxpy.Problem(cvx_obj, constraints)
-    obj_list = []
-    boundary_list = []
-    norm_vec_list = []
-    ret = []
-    for vec_i in (tqdm(direction) if use_tqdm else direction):
-        cvx_vec.value = vec_i
-        prob.solve()
-        obj_list.append(cvx_obj.value)
-        if return_info:
-            boundary_list.append(cvx_op.value.copy())
-            norm_vec_list.append(constraints[-1].dual_value.copy())
-    if is_single:
-        if return_info:
-            ret = (obj_list[0], boundary_list[0], norm_vec_list[0])
-        else:
-            ret = obj_list[0]
-    else:
-        obj_list = np.array(obj_list)
-        if return_info:
-            ret = obj_list, np.stack(boundary_list, axis=0), np.stack(norm_vec_list, axis=0)
-        else:
-            ret = obj_list
+    cvxP = _get_ABk_extension_numerical_range_cvxP(_array_to_key(op_list), int(dimA), int(dimB), int(kext),
+                bool(use_ppt), bool(use_boson))
+    ret = _sdp_direction_sweep(cvxP, direction, is_single, return_info, use_tqdm, num_worker)
     return ret
 
 
@@ -329,38 +350,55 @@ def get_ABk_symmetric_extension_boundary(rho, dim, kext, use_ppt=False, use_boso
 
 
 class SymmetricExtABkIrrepModel(torch.nn.Module):
-    def __init__(self, dimA:int, dimB:int, kext:int):
+    def __init__(self, dimA:int, dimB:int, kext:int, batch_size:int|None=None):
         super().__init__()
         assert dimA>=2
         self.dimA = int(dimA)
         self.dimB = int(dimB)
         self.kext = int(kext)
+        self.batch_size = batch_size
         coeffB_list,multiplicity_list = numqi.group.symext.get_symmetric_extension_irrep_coeff(dimB, kext)
         multiplicity_list = np.array(multiplicity_list, dtype=np.float64)
         self.coeffB_list = [torch.tensor(x.reshape(-1,self.dimB**2), dtype=torch.complex128) for x in coeffB_list] #TODO complex128?
-        self.manifold_psd = torch.nn.ModuleList([numqi.manifold.Trace1PSD(self.dimA*x.shape[0], method='cholesky', dtype=torch.complex128) for x in coeffB_list])
-        self.manifold_prob = numqi.manifold.DiscreteProbability(len(self.coeffB_list), method='softmax', weight=multiplicity_list, dtype=torch.float64)
+        self.manifold_psd = torch.nn.ModuleList([numqi.manifold.Trace1PSD(self.dimA*x.shape[0], batch_size=batch_size,
+                            method='cholesky', dtype=torch.complex128) for x in coeffB_list])
+        self.manifold_prob = numqi.manifold.DiscreteProbability(len(self.coeffB_list), batch_size=batch_size,
+                            method='softmax', weight=multiplicity_list, dtype=torch.float64)
 
         self.dm_target_transpose = None
         self.rhoAB_transpose = None
+        self.batch_mask = None
+        self.loss_batch = None
 
     def set_dm_target(self, rhoAB, zero_eps=1e-7):
-        assert (rhoAB.ndim==2) and (rhoAB.shape[0]==rhoAB.shape[1]) and (rhoAB.shape[0]==self.dimA*self.dimB)
-        assert (abs(np.trace(rhoAB)-1)<zero_eps) and (np.abs(rhoAB-rhoAB.T.conj()).max()<zero_eps)
-        assert (np.linalg.eigvalsh(rhoAB)[0] + zero_eps) > 0
-        tmp0 = rhoAB.reshape(self.dimA, self.dimB, self.dimA, -1).transpose(0,2,1,3).reshape(self.dimA**2,-1)
+        # rhoAB: (dimA*dimB,dimA*dimB), or (batch_size,dimA*dimB,dimA*dimB) if batch_size is not None
+        N0 = self.dimA*self.dimB
+        assert rhoAB.shape==((N0,N0) if (self.batch_size is None) else (self.batch_size,N0,N0))
+        assert (np.abs(np.trace(rhoAB, axis1=-2, axis2=-1)-1).max()<zero_eps)
+        assert np.abs(rhoAB-rhoAB.swapaxes(-1,-2).conj()).max()<zero_eps
+        assert (np.linalg.eigvalsh(rhoAB).min() + zero_eps) > 0
+        tmp0 = rhoAB.reshape(-1, self.dimA, self.dimB, self.dimA, self.dimB).transpose(0,1,3,2,4).reshape(-1, self.dimA**2, self.dimB**2)
+        if self.batch_size is None:
+            tmp0 = tmp0[0]
         self.dm_target_transpose = torch.tensor(tmp0, dtype=torch.complex128)
 
     def forward(self):
         assert self.dm_target_transpose is not None
+        dimA = self.dimA
         rhoAB_list = []
         for ind0 in range(len(self.coeffB_list)):
             tmp0 = self.manifold_psd[ind0]()
-            tmp1 = tmp0.reshape(self.dimA, tmp0.shape[0]//self.dimA, self.dimA, -1)
-            rhoAB_list.append(tmp1.transpose(1,2).reshape(self.dimA**2,-1) @ self.coeffB_list[ind0])
-        tmp1 = self.manifold_prob()
-        rhoAB_transpose = sum([rhoAB_list[x]*tmp1[x] for x in range(len(rhoAB_list))])
+            tmp1 = tmp0.reshape(-1, dimA, tmp0.shape[-1]//dimA, dimA, tmp0.shape[-1]//dimA)
+            rhoAB_list.append(tmp1.transpose(2,3).reshape(-1, dimA**2, tmp1.shape[2]**2) @ self.coeffB_list[ind0])
+        tmp1 = self.manifold_prob().reshape(-1, len(rhoAB_list), 1, 1)
+        rhoAB_transpose = sum([rhoAB_list[x]*tmp1[:,x] for x in range(len(rhoAB_list))])
+        if self.batch_size is None:
+            rhoAB_transpose = rhoAB_transpose[0]
         self.rhoAB_transpose = rhoAB_transpose
-        tmp0 = (rhoAB_transpose-self.dm_target_transpose).reshape(-1)
-        loss = torch.dot(tmp0.conj(), tmp0).real
+        tmp0 = (rhoAB_transpose-self.dm_target_transpose).reshape(-1, self.dimA**2 * self.dimB**2)
+        loss = (tmp0.real**2 + tmp0.imag**2).sum(dim=1)
+        if self.batch_size is None:
+            loss = loss[0]
+        else:
+            loss = _reduce_batch_loss(self, loss)
         return loss
@@ -2,9 +2,13 @@ import math
 import numpy as np
 import scipy.linalg
 import torch
+from tqdm.auto import tqdm
 
 import numqi.gellmann
 import numqi.manifold
+import numqi.random
+
+from ._misc import _batch_partial_transpose
 
 
 hf_is_prime = lambda n: (n>=2) and ((n==2) or ((n%2==1) and all(n%x>0 for x in range(3, int(math.sqrt(n))+1, 2))))
@@ -266,72 +270,197 @@ class LocalUnitaryEquivalentModel(torch.nn.Module):
         return loss
 
 
+def _bes_num_eigen_init_rho_vec(np_rng, dim_total:int, batch_size:int|None):
+    tmp0 = np_rng.uniform(-1, 1, size=(dim_total**2-1 if (batch_size is None) else (batch_size, dim_total**2-1)))
+    ret = tmp0 / np.linalg.norm(tmp0, axis=-1, keepdims=True)
+    return ret
+
+
+def _bes_num_eigen_boundary_dm(rho_vec:torch.Tensor):
+    # rho_vec (batch,d**2-1) -> density matrices at the two boundaries along the direction, (batch,d,d)
+    rho_vec_norm = rho_vec / torch.linalg.norm(rho_vec, dim=1, keepdim=True)
+    rho_norm = numqi.gellmann.gellmann_basis_to_dm(rho_vec_norm)
+    tmp0 = torch.linalg.eigvalsh(rho_norm)
+    beta0 = 1/(1-rho_norm.shape[-1]*tmp0[:,0])
+    beta1 = 1/(1-rho_norm.shape[-1]*tmp0[:,-1])
+    dm0 = numqi.gellmann.gellmann_basis_to_dm(beta0[:,None]*rho_vec_norm)
+    dm1 = numqi.gellmann.gellmann_basis_to_dm(beta1[:,None]*rho_vec_norm)
+    return dm0,dm1
+
+
 class BESNumEigenModel(torch.nn.Module):
-    def __init__(self, dimA, dimB, rank0, rank1=None, with_ppt=True, with_ppt1=True):
+    def __init__(self, dimA, dimB, rank0, rank1=None, with_ppt=True, with_ppt1=True, batch_size=None):
         # TODO what is the loss for the genshfits UPB/BES
         super().__init__()
         np_rng = np.random.default_rng()
-        tmp0 = np_rng.uniform(-1, 1, size=(dimA*dimB)**2-1)
-        self.rho_vec = torch.nn.Parameter(torch.tensor(tmp0 / np.linalg.norm(tmp0), dtype=torch.float64))
+        tmp0 = _bes_num_eigen_init_rho_vec(np_rng, dimA*dimB, batch_size)
+        self.rho_vec = torch.nn.Parameter(torch.tensor(tmp0, dtype=torch.float64))
         self.dimA = dimA
         self.dimB = dimB
         self.rank0 = rank0
         self.rank1 = (dimA*dimB-rank0) if (rank1 is None) else rank1
         self.with_ppt = with_ppt
         self.with_ppt1 = with_ppt1
+        self.batch_size = batch_size
 
-    def forward(self):
-        rho_vec_norm = self.rho_vec / torch.linalg.norm(self.rho_vec)
-        rho_norm = numqi.gellmann.gellmann_basis_to_dm(rho_vec_norm)
-        tmp0 = torch.linalg.eigvalsh(rho_norm)
-        beta0 = 1/(1-rho_norm.shape[0]*tmp0[0])
-        beta1 = 1/(1-rho_norm.shape[0]*tmp0[-1])
-        dm0 = numqi.gellmann.gellmann_basis_to_dm(beta0*rho_vec_norm)
-        dm1 = numqi.gellmann.gellmann_basis_to_dm(beta1*rho_vec_norm)
-        loss0 = torch.linalg.eigvalsh(dm0)[:(dm0.shape[0]-self.rank0)].sum()
-        loss1 = torch.linalg.eigvalsh(dm1)[:(dm0.shape[0]-self.rank1)].sum()
+    def get_loss_batch(self):
+        # loss of each candidate, shape (batch_size,), or (1,) if batch_size is None
+        dm0,dm1 = _bes_num_eigen_boundary_dm(self.rho_vec.reshape(-1, self.rho_vec.shape[-1]))
+        N0 = dm0.shape[-1]
+        loss0 = torch.linalg.eigvalsh(dm0)[:,:(N0-self.rank0)].sum(dim=1)
+        loss1 = torch.linalg.eigvalsh(dm1)[:,:(N0-self.rank1)].sum(dim=1)
         loss = (loss0 + loss1)**2
         if self.with_ppt:
-            tmp1 = dm0.reshape(self.dimA,self.dimB,self.dimA,self.dimB).transpose(1,3).reshape(self.dimA*self.dimB,-1)
-            loss2 = torch.linalg.eigvalsh(tmp1)[0]**2
+            loss2 = torch.linalg.eigvalsh(_batch_partial_transpose(dm0, (self.dimA,self.dimB), 1))[:,0]**2
             loss = loss + loss2
             # without this constraint, it will not converge to BES
-            tmp1 = dm1.reshape(self.dimA,self.dimB,self.dimA,self.dimB).transpose(1,3).reshape(self.dimA*self.dimB,-1)
-            loss3 = torch.linalg.eigvalsh(tmp1)[0]**2
+            loss3 = torch.linalg.eigvalsh(_batch_partial_transpose(dm1, (self.dimA,self.dimB), 1))[:,0]**2
             loss = loss + loss3
         return loss
 
+    def forward(self):
+        loss = self.get_loss_batch().sum()
+        return loss
+
 
 class BESNumEigen3qubitModel(torch.nn.Module):
-    def __init__(self, rank0, rank1=None, with_ppt=True):
+    def __init__(self, rank0, rank1=None, with_ppt=True, batch_size=None):
         # TODO what is the loss for the genshfits UPB/BES
         super().__init__()
         np_rng = np.random.default_rng()
         dimA,dimB,dimC = 2,2,2
-        tmp0 = np_rng.uniform(-1, 1, size=(dimA*dimB*dimC)**2-1)
-        self.rho_vec = torch.nn.Parameter(torch.tensor(tmp0 / np.linalg.norm(tmp0), dtype=torch.float64))
+        tmp0 = _bes_num_eigen_init_rho_vec(np_rng, dimA*dimB*dimC, batch_size)
+        self.rho_vec = torch.nn.Parameter(torch.tensor(tmp0, dtype=torch.float64))
         self.dimA = dimA
         self.dimB = dimB
         self.dimC = dimC
         self.rank0 = rank0
         self.rank1 = (dimA*dimB*dimC-rank0) if (rank1 is None) else rank1
         self.with_ppt = with_ppt
+        self.batch_size = batch_size
 
-    def forward(self):
-        rho_vec_norm = self.rho_vec / torch.linalg.norm(self.rho_vec)
-        rho_norm = numqi.gellmann.gellmann_basis_to_dm(rho_vec_norm)
-        tmp0 = torch.linalg.eigvalsh(rho_norm)
-        beta0 = 1/(1-rho_norm.shape[0]*tmp0[0])
-        beta1 = 1/(1-rho_norm.shape[0]*tmp0[-1])
-        dm0 = numqi.gellmann.gellmann_basis_to_dm(beta0*rho_vec_norm)
-        dm1 = numqi.gellmann.gellmann_basis_to_dm(beta1*rho_vec_norm)
-        loss0 = torch.linalg.eigvalsh(dm0)[:(dm0.shape[0]-self.rank0)].sum()
-        loss1 = torch.linalg.eigvalsh(dm1)[:(dm0.shape[0]-self.rank1)].sum()
+    def get_loss_batch(self):
+        # loss of each candidate, shape (batch_size,), or (1,) if batch_size is None
+        dm0,dm1 = _bes_num_eigen_boundary_dm(self.rho_vec.reshape(-1, self.rho_vec.shape[-1]))
+        N0 = dm0.shape[-1]
+        loss0 = torch.linalg.eigvalsh(dm0)[:,:(N0-self.rank0)].sum(dim=1)
+        loss1 = torch.linalg.eigvalsh(dm1)[:,:(N0-self.rank1)].sum(dim=1)
         loss = (loss0 + loss1)**2
         if self.with_ppt:
             for dm_i in [dm0,dm1]:
-                tmp1 = dm_i.reshape(self.dimA,self.dimB*self.dimC,self.dimA,-1).transpose(1,3).reshape(self.dimA*self.dimB*self.dimC,-1)
-                loss = loss + torch.linalg.eigvalsh(tmp1)[0]**2
-                tmp1 = dm_i.reshape(-1,self.dimC,self.dimA*self.dimB,self.dimC).transpose(1,3).reshape(self.dimA*self.dimB*self.dimC,-1)
-                loss = loss + torch.linalg.eigvalsh(tmp1)[0]**2
+                tmp0 = _batch_partial_transpose(dm_i, (self.dimA,self.dimB*self.dimC), 1)
+                loss = loss + torch.linalg.eigvalsh(tmp0)[:,0]**2
+                tmp0 = _batch_partial_transpose(dm_i, (self.dimA*self.dimB,self.dimC), 1)
+                loss = loss + torch.linalg.eigvalsh(tmp0)[:,0]**2
+        return loss
+
+    def forward(self):
+        loss = self.get_loss_batch().sum()
         return loss
+
+
+def _get_local_unitary_invariant(rho_vec:np.ndarray, dim:tuple[int]):
+    # spectra of the state, its single-party marginals and partial transposes, (batch,num_invariant)
+    rho = numqi.gellmann.gellmann_basis_to_dm(rho_vec)
+    ret = [np.linalg.eigvalsh(rho)]
+    for ind0 in range(len(dim)):
+        tmp0 = int(np.prod(dim[:ind0]))
+        tmp1 = int(np.prod(dim[(ind0+1):]))
+        tmp2 = rho.reshape(-1, tmp0, dim[ind0], tmp1, tmp0, dim[ind0], tmp1)
+        ret.append(np.linalg.eigvalsh(np.einsum(tmp2, [0,1,2,3,1,4,3], [0,2,4])))
+        ret.append(np.linalg.eigvalsh(_batch_partial_transpose(rho, dim, ind0)))
+    ret = np.concatenate(ret, axis=1)
+    return ret
+
+
+def search_bes_batch(model:BESNumEigenModel|BESNumEigen3qubitModel, num_step:int=30000, lr:float=0.001,
+            num_keep:int=10, threshold:float=1e-12, num_check:int=300, converge_tol:float=1e-3,
+            invariant_eps:float=1e-6, seed:int|None=None, use_tqdm:bool=True):
+    r'''search bound entangled states (BES) with a batch of random restarts
+
+    All candidates in `model.rho_vec` are optimized together with Adam (one step counter per candidate). Every
+    `num_check` steps, the candidates whose loss is below `threshold` or decreases less than `converge_tol` (relatively)
+    are harvested and restarted from a new random direction: successful ones (loss below `threshold`) enter the result
+    pool, converged failures are dropped.
+    The pool is deduplicated by local unitary invariants (spectra of the state, its single-party marginals and
+    partial transposes) and the best `num_keep` candidates are returned
+
+    Parameters:
+        model (BESNumEigenModel,BESNumEigen3qubitModel): model with `batch_size` set
+        num_step (int): number of Adam steps
+        lr (float): initial learning rate, decayed by 0.97 every `num_check` steps
+        num_keep (int): maximum number of candidates to return
+        threshold (float): loss threshold for a successful candidate
+        num_check (int): number of steps between two harvests
+        converge_tol (float): relative decrease of the loss below which a candidate is considered converged
+        invariant_eps (float): candidates whose invariants differ less than this value are considered equivalent
+        seed (int,None): random seed for the restarts
+        use_tqdm (bool): show progress bar
+
+    Returns:
+        loss (np.ndarray): loss of the candidates, sorted in ascending order, `shape=(num_keep,)` at most
+        rho_vec (np.ndarray): normalized Gell-Mann vector of the candidates, `shape=(num_keep,d**2-1)` at most,
+            the BES are `numqi.entangle.hf_interpolate_dm(numqi.gellmann.gellmann_basis_to_dm(rho_vec[i]), beta=...)` on the
+            density matrix boundary
+    '''
+    assert model.batch_size is not None, 'model.batch_size must be set'
+    np_rng = numqi.random.get_numpy_rng(seed)
+    dim = tuple(getattr(model, x) for x in ['dimA','dimB','dimC'] if hasattr(model, x))
+    # Adam (torch.optim.Adam defaults) with a step counter per candidate, so that a restarted candidate
+    # gets the bias correction of a fresh start instead of the global step
+    beta1,beta2,eps = 0.9,0.999,1e-8
+    exp_avg = torch.zeros_like(model.rho_vec)
+    exp_avg_sq = torch.zeros_like(model.rho_vec)
+    adam_step = torch.zeros(model.batch_size, 1, dtype=model.rho_vec.dtype)
+    best_loss = np.full(model.batch_size, np.inf)
+    best_rho_vec = model.rho_vec.detach().numpy().copy()
+    last_check_loss = np.full(model.batch_size, np.inf)
+    pool_loss = []
+    pool_rho_vec = []
+    for ind_step in (tqdm(range(num_step)) if use_tqdm else range(num_step)):
+        loss_batch = model.get_loss_batch()
+        tmp0 = loss_batch.detach().numpy()
+        ind0 = tmp0 < best_loss
+        best_loss[ind0] = tmp0[ind0]
+        best_rho_vec[ind0] = model.rho_vec.detach().numpy()[ind0]
+        grad = torch.autograd.grad(loss_batch.sum(), model.rho_vec)[0]
+        with torch.no_grad():
+            adam_step += 1
+            exp_avg.mul_(beta1).add_(grad, alpha=1-beta1)
+            exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1-beta2)
+            tmp0 = (exp_avg_sq / (1-beta2**adam_step)).sqrt() + eps
+            model.rho_vec.sub_(lr * exp_avg / ((1-beta1**adam_step) * tmp0))
+        if (ind_step+1)%num_check==0:
+            lr = lr*0.97
+            # successful ones keep decreasing geometrically, harvest them without waiting for convergence
+            ind0 = np.nonzero(((last_check_loss-best_loss) < converge_tol*best_loss) | (best_loss<threshold))[0]
+            last_check_loss[:] = best_loss
+            if len(ind0):
+                tmp1 = ind0[best_loss[ind0]<threshold]
+                pool_loss.append(best_loss[tmp1])
+                pool_rho_vec.append(best_rho_vec[tmp1])
+                tmp2 = _bes_num_eigen_init_rho_vec(np_rng, int(np.prod(dim)), len(ind0))
+                with torch.no_grad():
+                    model.rho_vec[ind0] = torch.tensor(tmp2, dtype=torch.float64)
+                exp_avg[ind0] = 0
+                exp_avg_sq[ind0] = 0
+                adam_step[ind0] = 0
+                best_loss[ind0] = np.inf
+                last_check_loss[ind0] = np.inf
+                best_rho_vec[ind0] = tmp2
+    ind0 = np.isfinite(best_loss)
+    pool_loss = np.concatenate(pool_loss+[best_loss[ind0]])
+    pool_rho_vec = np.concatenate(pool_rho_vec+[best_rho_vec[ind0]], axis=0)
+    pool_rho_vec = pool_rho_vec / np.linalg.norm(pool_rho_vec, axis=1, keepdims=True)
+    tmp0 = np.argsort(pool_loss, kind='stable')
+    pool_loss = pool_loss[tmp0]
+    pool_rho_vec = pool_rho_vec[tmp0]
+    invariant = _get_local_unitary_invariant(pool_rho_vec, dim)
+    ind_keep = []
+    for ind0 in range(len(pool_loss)):
+        if len(ind_keep)>=num_keep:
+            break
+        if (len(ind_keep)==0) or (np.abs(invariant[ind_keep]-invariant[ind0]).max(axis=1).min() > invariant_eps):
+            ind_keep.append(ind0)
+    ret = pool_loss[ind_keep], pool_rho_vec[ind_keep]
+    return ret
@@ -245,19 +245,23 @@ def get_density_matrix_distance2(rho:np.ndarray, sigma:np.ndarray):
     Equivalent to the Frobenius distance over 2.
 
     Parameters:
-        rho (np.ndarray): density matrix, 2d array
-        sigma (np.ndarray): density matrix, 2d array
+        rho (np.ndarray): density matrix, 2d array (support batch)
+        sigma (np.ndarray): density matrix, 2d array (support batch)
 
     Returns:
-        ret (float): distance
+        ret (float,np.ndarray): distance, for batch input, `shape=rho.shape[:-2]`
     '''
-    # not support batch
-    tmp0 = (rho - sigma).reshape(-1)
-    if isinstance(rho, torch.Tensor):
-        ret = torch.vdot(tmp0, tmp0).real / 2
-        # factor 1/2 is due to the normalization of Gell-Mann basis
+    shape = rho.shape
+    if len(shape)==2:
+        tmp0 = (rho - sigma).reshape(-1)
+        if isinstance(rho, torch.Tensor):
+            ret = torch.vdot(tmp0, tmp0).real / 2
+            # factor 1/2 is due to the normalization of Gell-Mann basis
+        else:
+            ret = np.vdot(tmp0, tmp0).real / 2
     else:
-        ret = np.vdot(tmp0, tmp0).real / 2
+        tmp0 = (rho - sigma).reshape(*shape[:-2], -1)
+        ret = (tmp0.real**2 + tmp0.imag**2).sum(-1) / 2
     ## equivalent to below
     # tmp0 = dm_to_gellmann_basis(rho)
     # tmp1 = dm_to_gellmann_basis(sigma)
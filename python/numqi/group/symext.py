@@ -4,6 +4,7 @@ import functools
 import numpy as np
 
 import numqi.dicke
+import numqi.utils
 from ._symmetric import get_all_young_tableaux, get_young_diagram_mask, young_tableau_to_young_symmetrizer, get_sym_group_young_diagram
 
 
@@ -164,8 +165,17 @@ def get_sud_symmetric_irrep_basis(dim:int, kext:int, zero_eps:float=1e-7):
 
     Returns:
         basis_list (list[list[np.ndarray]]): list of list of basis, the first list indexing is for Young diagram,
-                the second list indexing is for Young tableaux. np.ndarray are of shape (#basis,dim)
+                the second list indexing is for Young tableaux. np.ndarray are of shape (#basis,dim).
+                The arrays are copies of the cached ones and can be modified freely
     '''
+    ret = [[y.copy() for y in x] for x in _get_sud_symmetric_irrep_basis(dim, kext, zero_eps)]
+    return ret
+
+
+@functools.lru_cache
+@numqi.utils.disk_cache()
+def _get_sud_symmetric_irrep_basis(dim:int, kext:int, zero_eps:float):
+    # cached, the arrays are read-only, see get_sud_symmetric_irrep_basis
     assert dim >= 2
     Ydiagram_list = [tuple(y for y in x if y>0) for x in get_sym_group_young_diagram(kext).tolist()]
     # TODO sparse
@@ -202,6 +212,9 @@ def get_sud_symmetric_irrep_basis(dim:int, kext:int, zero_eps:float=1e-7):
                 basis_i.append(tmp1/tmp2)
             basis_list.append(basis_i)
     basis_list = [[y.T for y in x] for x in basis_list]
+    for x in basis_list:
+        for y in x:
+            y.flags.writeable = False
     return basis_list
 
 
@@ -212,6 +225,7 @@ def _basis_partial_trace(basis, dim):
 
 
 @functools.lru_cache
+@numqi.utils.disk_cache()
 def _get_symmetric_extension_irrep_coeff_internal(dim:int, kext:int):
     dim = int(dim)
     kext = int(kext)
@@ -222,7 +236,7 @@ def _get_symmetric_extension_irrep_coeff_internal(dim:int, kext:int):
         coeff_list = [tmp0]
         multiplicity_list = 1, #all sym-ext are bosonic-ext, so we only use Dicke state
     else:
-        basis_part = get_sud_symmetric_irrep_basis(dim, kext)
+        basis_part = _get_sud_symmetric_irrep_basis(dim, kext, 1e-7)
         multiplicity_list = tuple(len(x) for x in basis_part)
         coeff_list = [sum(_basis_partial_trace(y,dim) for y in x) for x in basis_part]
     for x in coeff_list:
@@ -13,7 +13,7 @@ from ._gradient import (DetectRankModel, DetectRankOneModel,
         DetectCanonicalPolyadicRankModel)
 from ._numerical_range import (get_matrix_numerical_range, get_matrix_numerical_range_along_direction,
     get_real_bipartite_numerical_range, detect_real_matrix_subspace_rank_one,
-    get_joint_algebraic_numerical_range, draw_line_list)
+    get_joint_algebraic_numerical_range, get_joint_algebraic_numerical_range_support, draw_line_list)
 from ._geometric_measure import (get_geometric_measure_ppt, get_generalized_geometric_measure_ppt,
                                  get_GES_Maciej2019, get_GM_Maciej2019)
 from ._hierarchy import (get_antisymmetric_basis, get_symmetric_basis, project_to_antisymmetric_basis,
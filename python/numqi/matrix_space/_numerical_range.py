@@ -4,6 +4,7 @@ import scipy.optimize
 import cvxpy
 from tqdm.auto import tqdm
 
+from numqi._cvxpy_utils import _array_to_key, _key_to_array, _sdp_direction_sweep, _cvxpy_problem_cache
 from ._misc import get_matrix_orthogonal_basis
 
 def get_matrix_numerical_range(matA, num_point=100):
@@ -179,7 +180,26 @@ def detect_real_matrix_subspace_rank_one(matrix_subspace):
     return tag_rank_one, upper_bound
 
 
-def get_joint_algebraic_numerical_range(op_list, direction, return_info=False, use_tqdm=True):
+@_cvxpy_problem_cache(maxsize=8)
+def _get_joint_algebraic_numerical_range_cvxP(op_list_key):
+    op_list = _key_to_array(op_list_key)
+    num_op,dim,_ = op_list.shape
+    cvx_rho = cvxpy.Variable((dim,dim), hermitian=True)
+    cvx_vec = cvxpy.Parameter(num_op)
+    cvx_beta = cvxpy.Variable()
+    cvx_op = cvxpy.real(op_list.transpose(0,2,1).reshape(-1, dim*dim, order='C') @ cvxpy.reshape(cvx_rho, dim*dim, order='F'))
+    constraints = [
+        cvx_rho>>0,
+        cvxpy.real(cvxpy.trace(cvx_rho))==1,
+        cvx_beta*cvx_vec==cvx_op,
+    ]
+    cvx_obj = cvxpy.Maximize(cvx_beta)
+    prob = cvxpy.Problem(cvx_obj, constraints)
+    ret = prob,cvx_vec,cvx_obj,cvx_op,constraints[-1]
+    return ret
+
+
+def get_joint_algebraic_numerical_range(op_list, direction, return_info=False, use_tqdm=True, num_worker=1):
     r'''get the joint algebraic numerical range (JANR) of a list of operators along a direction
 
     $$ L(A_{1},A_{2},\cdots,A_{r})=\left\{ a\in\mathbb{C}^{r}:\rho\in\mathbb{C}^{d\times d},\rho\succeq0,\mathrm{Tr}[\rho]=1,a_{i}=\mathrm{Tr}[A_{i}\rho]\right\} $$
@@ -188,11 +208,14 @@ def get_joint_algebraic_numerical_range(op_list, direction, return_info=False, u
 
     $$ s.t.\;\begin{cases} \rho\succeq 0\\ \mathrm{Tr}[\rho]=1\\ \mathrm{Tr}[\rho A_{i}]=\beta\hat{n}_{i} & i=1,\cdots,m \end{cases} $$
 
+    The compiled SDP is cached for the same `op_list`, so repeated calls skip the cvxpy canonicalization.
+
     Parameters:
         op_list (list): a list of operators, each operator is a 2d numpy array
         direction (np.ndarrray): the boundary along the direction will be calculated, if 2d, then each row is a direction
         return_info (bool): if `True`, then return the boundary and the boundary's normal vector
         use_tqdm (bool): if `True`, then use tqdm to show the progress
+        num_worker (int): number of worker processes, the directions are split among the workers
 
     Returns:
         beta (np.ndarray): the distance from the origin to the boundary along the direction.
@@ -210,39 +233,73 @@ def get_joint_algebraic_numerical_range(op_list, direction, return_info=False, u
     direction = direction.reshape(-1,num_op)
     if direction.shape[0]==1:
         use_tqdm = False
-    cvx_rho = cvxpy.Variable((dim,dim), hermitian=True)
-    cvx_vec = cvxpy.Parameter(num_op)
-    cvx_beta = cvxpy.Variable()
-    cvx_op = cvxpy.real(op_list.transpose(0,2,1).reshape(-1, dim*dim, order='C') @ cvxpy.reshape(cvx_rho, dim*dim, order='F'))
-    constraints = [
-        cvx_rho>>0,
-        cvxpy.real(cvxpy.trace(cvx_rho))==1,
-        cvx_beta*cvx_vec==cvx_op,
-    ]
-    cvx_obj = cvxpy.Maximize(cvx_beta)
-    prob = cvxpy.Problem(cvx_obj, constraints)
-    obj_list = []
-    boundary_list = []
-    norm_vec_list = []
-    ret = []
-    for vec_i in (tqdm(direction) if use_tqdm else direction):
-        cvx_vec.value = vec_i
-        prob.solve()
-        obj_list.append(cvx_obj.value)
-        if return_info:
-            boundary_list.append(cvx_op.value.copy())
-            norm_vec_list.append(constraints[-1].dual_value.copy())
+    cvxP = _get_joint_algebraic_numerical_range_cvxP(_array_to_key(op_list))
+    ret = _sdp_direction_sweep(cvxP, direction, is_single, return_info, use_tqdm, num_worker)
+    return ret
+
+
+def get_joint_algebraic_numerical_range_support(op_list, direction, return_info=False, method='auto', batch_size=None):
+    r'''get the support function of the joint algebraic numerical range (JANR) via eigen-decomposition
+
+    $$ h(\hat{n})=\max_{a\in L(A_{1},\cdots,A_{r})}\langle\hat{n},a\rangle=\lambda_{\max}\left(\sum_{i}\hat{n}_{i}A_{i}\right) $$
+
+    the boundary point with outward normal vector $\hat{n}$ is $a_{i}=\langle v|A_{i}|v\rangle$ where $|v\rangle$ is the top eigenvector.
+    Different from `numqi.matrix_space.get_joint_algebraic_numerical_range` (the boundary along a ray from the origin),
+    here the boundary is parameterized by its normal vector, and no SDP is solved
+
+    Parameters:
+        op_list (list): a list of Hermitian operators, each operator is a 2d numpy array
+        direction (np.ndarray): the normal vector, if 2d, then each row is a normal vector
+        return_info (bool): if `True`, then return the boundary points and the (normalized) normal vectors
+        method (str): 'eigh' (batched dense eigen-decomposition), 'lanczos' (scipy.sparse.linalg.eigsh, warm started
+            from the previous direction, suitable for large dimension) or 'auto' ('lanczos' if `dim>=256`)
+        batch_size (int,None): number of directions per batched `eigh`, default to keep each batch within 64M elements
+
+    Returns:
+        support (float,np.ndarray): the support function, if `direction` is 2d, then `support` is 1d array
+        boundary (np.ndarray): the boundary points, only returned if `return_info` is `True`
+        normal_vector (np.ndarray): the normalized normal vectors, only returned if `return_info` is `True`
+    '''
+    op_list = np.stack(op_list, axis=0)
+    num_op,dim,_ = op_list.shape
+    assert np.abs(op_list-op_list.transpose(0,2,1).conj()).max() < 1e-10, 'op_list must be Hermitian'
+    direction = np.asarray(direction, dtype=np.float64)
+    assert (direction.ndim==1) or (direction.ndim==2)
+    assert direction.shape[-1]==num_op
+    is_single = (direction.ndim==1)
+    direction = direction.reshape(-1,num_op)
+    direction = direction / np.linalg.norm(direction, axis=1, keepdims=True)
+    assert method in {'auto', 'eigh', 'lanczos'}
+    if method=='auto':
+        method = 'lanczos' if (dim>=256) else 'eigh'
+    if batch_size is None:
+        batch_size = max(1, 2**26 // (dim*dim))
+    support_list = []
+    EVC_list = []
+    if method=='eigh':
+        for ind0 in range(0, direction.shape[0], batch_size):
+            tmp0 = np.einsum(direction[ind0:(ind0+batch_size)], [0,1], op_list, [1,2,3], [0,2,3], optimize=True)
+            EVL,EVC = np.linalg.eigh(tmp0)
+            support_list.append(EVL[:,-1])
+            if return_info:
+                EVC_list.append(EVC[:,:,-1])
+    else:
+        EVC = None
+        for vec_i in direction:
+            tmp0 = np.einsum(vec_i, [0], op_list, [0,1,2], [1,2], optimize=True)
+            # warm start from the eigenvector of the previous (usually neighboring) direction
+            EVL,EVC = scipy.sparse.linalg.eigsh(tmp0, k=1, which='LA', v0=EVC)
+            EVC = EVC[:,0]
+            support_list.append(EVL)
+            EVC_list.append(EVC[np.newaxis])
+    support = np.concatenate(support_list)
+    if return_info:
+        EVC = np.concatenate(EVC_list, axis=0)
+        boundary = np.einsum(EVC.conj(), [0,2], op_list, [1,2,3], EVC, [0,3], [0,1], optimize=True).real
     if is_single:
-        if return_info:
-            ret = (obj_list[0], boundary_list[0], norm_vec_list[0])
-        else:
-            ret = obj_list[0]
+        ret = (support[0], boundary[0], direction[0]) if return_info else support[0]
     else:
-        obj_list = np.array(obj_list)
-        if return_info:
-            ret = obj_list, np.stack(boundary_list, axis=0), np.stack(norm_vec_list, axis=0)
-        else:
-            ret = obj_list
+        ret = (support, boundary, direction) if return_info else support
     return ret
 
 
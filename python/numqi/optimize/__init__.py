@@ -1,3 +1,3 @@
 from ._internal import (get_model_flat_parameter, get_model_flat_grad, set_model_flat_parameter,
-        hf_model_wrapper, check_model_gradient, minimize, minimize_adam, get_model_hessian,
+        hf_model_wrapper, check_model_gradient, minimize, minimize_batch, minimize_adam, get_model_hessian,
         MinimizeCallback, finite_difference_central)
@@ -1,3 +1,5 @@
+import os
+import sys
 import time
 import contextlib
 import numpy as np
@@ -36,15 +38,55 @@ def set_model_flat_parameter(model, theta, index01=None):
         parameter_sorted[ind0].data.copy_(tmp0)
 
 
-def hf_model_wrapper(model):
+def _get_peak_memory(device=None):
+    # peak memory in bytes, allocated tensor memory for cuda, maximum resident set size of the process for cpu
+    if (device is not None) and (device.type=='cuda'):
+        ret = torch.cuda.max_memory_allocated(device)
+    else:
+        try:
+            import resource
+            ret = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            if sys.platform!='darwin':
+                ret = ret*1024 #kilobytes on linux, bytes on macOS
+        except ImportError: #windows
+            ret = 0
+    return ret
+
+
+def hf_model_wrapper(model, profile=None):
+    r'''convert a torch model into a function `theta -> (fval,grad)` used by scipy.optimize.minimize
+
+    Parameters:
+        model (torch.nn.Module): the model
+        profile (None, dict): if not None, the time (in seconds) spent in `forward`, `backward` and `convert`
+            (numpy-torch conversion), the number of function and gradient evaluations `num_fval,num_grad` and
+            the peak memory `memory` (in bytes) are accumulated into this dict
+
+    Returns:
+        hf0 (callable): `hf0(theta, tag_grad=True)`, return `(fval,grad)` if `tag_grad=True`, otherwise `fval`
+    '''
     parameter_sorted = _get_sorted_parameter(model)
     tmp0 = np.cumsum(np.array([0] + [x.numel() for x in parameter_sorted])).tolist()
     index01 = list(zip(tmp0[:-1],tmp0[1:]))
+    if profile is not None:
+        for key in ['time_forward', 'time_backward', 'time_convert', 'num_fval', 'num_grad', 'memory']:
+            profile.setdefault(key, 0)
+        device = parameter_sorted[0].device if len(parameter_sorted) else None
+        if (device is not None) and (device.type=='cuda'):
+            hf_time = lambda: (torch.cuda.synchronize(device), time.perf_counter())[1]
+        else:
+            hf_time = time.perf_counter
     def hf0(theta, tag_grad=True):
         # tag_grad=False, return fval only, not (fval,None)
+        if profile is not None:
+            t0 = hf_time()
         set_model_flat_parameter(model, theta, index01)
+        if profile is not None:
+            t1 = hf_time()
         if tag_grad:
             loss = model()
+            if profile is not None:
+                t2 = hf_time()
             for x in parameter_sorted:
                 if x.grad is not None:
                     x.grad.zero_()
@@ -52,41 +94,85 @@ def hf_model_wrapper(model):
                 model.grad_backward(loss)
             else:
                 loss.backward() #if no .grad_backward() method, it should be a normal torch.nn.Module
+            if profile is not None:
+                t3 = hf_time()
             # scipy.optimize.LBFGS does not support float32 @20221118
             grad = np.concatenate([x.grad.detach().cpu().numpy().reshape(-1).astype(theta.dtype) for x in parameter_sorted])
         else:
             with torch.no_grad():
                 loss = model()
+            if profile is not None:
+                t2 = hf_time()
+                t3 = t2
             grad = None
         ret = (loss.item(),grad) if tag_grad else loss.item()
+        if profile is not None:
+            t4 = hf_time()
+            profile['time_convert'] += (t1-t0) + (t4-t3)
+            profile['time_forward'] += t2-t1
+            profile['time_backward'] += t3-t2
+            profile['num_fval'] += 1
+            profile['num_grad'] += int(tag_grad)
+            profile['memory'] = max(profile['memory'], _get_peak_memory(device))
         return ret
     return hf0
 
 
 class MinimizeCallback:
     def __init__(self, print_freq:int=1, extra_key=None, tag_print:bool=True):
+        r'''callback for `numqi.optimize.minimize`
+
+        Parameters:
+            print_freq (int): record (and print) the loss every `print_freq` iterations, non-positive means no record
+            extra_key (None, str, list[str]): extra quantities to record
+
+                'grad_norm': the norm of the gradient, require one more gradient evaluation per iteration
+
+                'path': the parameters at each iteration
+
+                'profile': per-iteration wall time spent in `forward`, `backward`, `convert` (numpy-torch conversion)
+                    and `step` (the optimizer itself, e.g. line search), the number of function and gradient
+                    evaluations `num_fval,num_grad` made by the optimizer, the time and number of the callback's own
+                    re-evaluations `callback,num_fval_callback` and the peak memory `memory` (in bytes),
+                    see `.get_profile_summary()`
+
+            tag_print (bool): whether to print the loss
+        '''
         if extra_key is None:
             extra_key = []
         if isinstance(extra_key, str):
             extra_key = [extra_key]
-        available_key = {'grad_norm', 'path'}
+        available_key = {'grad_norm', 'path', 'profile'}
         assert all((isinstance(x,str) and (x in available_key)) for x in extra_key)
         self.extra_key = extra_key
         self.tag_print = tag_print
         self.print_freq = print_freq
         self.last_time = time.time()
         self._need_grad = 'grad_norm' in extra_key #if True, the callback function will be called with tag_grad=True
+        # accumulated by hf_model_wrapper(model, profile=callback.profile_counter)
+        self.profile_counter = {} if ('profile' in extra_key) else None
+        self._profile_last = None
         self.state = None
         self.history_state = []
         self.reset(save_history=False)
 
     def to_callable(self, hf_fval):
         def hf0(theta):
+            # the re-evaluation here is not made by the optimizer, it is recorded as time_callback/num_fval_callback
+            counter = self.profile_counter
+            if counter is not None:
+                t0 = time.perf_counter()
+                tmp0 = {k:counter.get(k,0) for k in ['time_forward','time_backward','time_convert','num_fval','num_grad']}
             if 'grad_norm' in self.extra_key:
                 fval,grad = hf_fval(theta, tag_grad=True)
             else:
                 fval = hf_fval(theta, tag_grad=False)
                 grad = None
+            if counter is not None:
+                for k,v in tmp0.items():
+                    counter[k] = v
+                counter['time_callback'] = counter.get('time_callback',0) + (time.perf_counter()-t0)
+                counter['num_fval_callback'] = counter.get('num_fval_callback',0) + 1
             self(theta, fval, grad)
         return hf0
 
@@ -94,6 +180,8 @@ class MinimizeCallback:
         step = self.state['step']
         if 'path' in self.extra_key:
             self.state['path'].append(theta.copy())
+        if 'profile' in self.extra_key:
+            self._record_profile()
         if (self.print_freq>0) and (step%self.print_freq==0):
             self.state['fval'].append(fval)
             if 'grad_norm' in self.extra_key:
@@ -106,6 +194,17 @@ class MinimizeCallback:
                 print(f'[step={step}][time={t1-t0:.3f} seconds] loss={fval}')
         self.state['step'] += 1
 
+    def _record_profile(self):
+        t1 = time.perf_counter()
+        counter = self.profile_counter
+        t0,last = self._profile_last
+        tmp1 = ['time_forward','time_backward','time_convert','time_callback','num_fval','num_grad','num_fval_callback']
+        tmp0 = {k:(counter.get(k,0)-last.get(k,0)) for k in tmp1}
+        tmp0['time_step'] = max(0, (t1-t0) - sum(tmp0[x] for x in tmp1 if x.startswith('time_')))
+        tmp0['memory'] = counter.get('memory', 0)
+        self.state['profile'].append(tmp0)
+        self._profile_last = (t1, dict(counter))
+
     def reset(self, save_history:bool=False):
         if save_history:
             self.history_state.append(self.state)
@@ -114,8 +213,79 @@ class MinimizeCallback:
             tmp0['grad_norm'] = []
         if 'path' in self.extra_key:
             tmp0['path'] = []
+        if 'profile' in self.extra_key:
+            tmp0['profile'] = []
+            self._profile_last = (time.perf_counter(), dict(self.profile_counter))
         self.state = tmp0
 
+    def get_profile_summary(self, tag_print:bool=True):
+        r'''summary of the profile over all rounds (the current state and the history state)
+
+        Parameters:
+            tag_print (bool): whether to print the summary table
+
+        Returns:
+            ret (dict): `ret[key]=(total,mean_per_iteration)` for key in `time_forward, time_backward, time_convert,
+                time_step, time_callback, num_fval, num_grad, num_fval_callback`, `ret['num_iteration']` and
+                `ret['memory']` (peak, in bytes). `num_fval,num_grad` only count the evaluations made by the optimizer,
+                the extra evaluation of the callback itself is counted in `time_callback,num_fval_callback`
+        '''
+        assert 'profile' in self.extra_key, 'MinimizeCallback(extra_key="profile") is required'
+        tmp0 = [y for x in (self.history_state+[self.state]) for y in x['profile']]
+        tmp0 = list({id(x):x for x in tmp0}.values()) #the current state may be one of the history state
+        num_iter = len(tmp0)
+        key_list = ['time_forward', 'time_backward', 'time_convert', 'time_step', 'time_callback',
+                    'num_fval', 'num_grad', 'num_fval_callback']
+        ret = {'num_iteration':num_iter, 'memory':max([x['memory'] for x in tmp0], default=0)}
+        for key in key_list:
+            tmp1 = sum(x[key] for x in tmp0)
+            ret[key] = tmp1, tmp1/max(1,num_iter)
+        if tag_print:
+            time_total = sum(ret[x][0] for x in key_list if x.startswith('time_'))
+            print(f'{"key":<14} {"total":>12} {"per-iter":>12} {"ratio":>8}')
+            for key in key_list:
+                tmp1 = f'{ret[key][0]/max(time_total,1e-12):>8.1%}' if key.startswith('time_') else ''
+                print(f'{key:<14} {ret[key][0]:>12.4g} {ret[key][1]:>12.4g} {tmp1}'.rstrip())
+            print(f'num_iteration={num_iter}, peak memory={ret["memory"]/2**20:.1f} MiB')
+        return ret
+
+
+class _Checkpoint:
+    def __init__(self, path:str, interval:float=60, max_overhead:float=0.01):
+        # save at most every max(interval, save_time/max_overhead) seconds, so that checkpointing costs
+        # at most max_overhead fraction of the wall time
+        self.path = str(path)
+        self.interval = float(interval)
+        self.max_overhead = float(max_overhead)
+        assert self.max_overhead>0
+        self.last_time = time.time()
+        self.last_cost = 0
+
+    def load(self):
+        if os.path.exists(self.path):
+            ret = torch.load(self.path, weights_only=False)
+        else:
+            ret = None
+        return ret
+
+    def is_due(self):
+        tmp0 = time.time() - self.last_time
+        ret = tmp0 >= max(self.interval, self.last_cost/self.max_overhead)
+        return ret
+
+    def save(self, state:dict):
+        t0 = time.time()
+        tmp0 = self.path + '.tmp'
+        torch.save(state, tmp0)
+        os.replace(tmp0, self.path) #atomic rename, the checkpoint file is never half-written
+        t1 = time.time()
+        self.last_cost = t1 - t0
+        self.last_time = t1
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
 
 def finite_difference_central(hf0, x0, zero_eps=1e-4):
     # https://en.wikipedia.org/wiki/Finite_difference
@@ -189,9 +359,89 @@ def _get_hf_theta(np_rng, key=None):
     return hf_theta
 
 
+def _minimize_torch_lbfgs(model, theta0, tol, maxiter=None, callback=None, profile=None, history_size=10):
+    # L-BFGS with strong-Wolfe line search entirely on torch tensors, numpy is only used for theta0 and the result.
+    # stopping criteria follow scipy L-BFGS-B with ftol=gtol=tol
+    parameter_sorted = _get_sorted_parameter(model)
+    assert all((not x.is_complex()) for x in parameter_sorted), 'torch-lbfgs only supports real parameters'
+    if maxiter is None:
+        maxiter = 15000 #scipy default
+    set_model_flat_parameter(model, theta0)
+    # max_iter=1: one iteration per .step() such that the convergence check/callback is done every iteration
+    optimizer = torch.optim.LBFGS(parameter_sorted, lr=1, max_iter=1, max_eval=26, tolerance_grad=-1,
+                tolerance_change=0, history_size=history_size, line_search_fn='strong_wolfe')
+    device = parameter_sorted[0].device
+    is_cuda = device.type=='cuda'
+    hf_time = (lambda: (torch.cuda.synchronize(device), time.perf_counter())[1]) if is_cuda else time.perf_counter
+    # (parameter, loss, grad) evaluated in the current step. LBFGS.step() always re-evaluates the closure at
+    # the start point, which is exactly one of the line search points of the previous step
+    cache = []
+    num_eval = [0]
+    def hf_lookup():
+        for ind0,x_param in enumerate(x[0] for x in cache):
+            if all(torch.equal(x,y) for x,y in zip(parameter_sorted, x_param)):
+                return ind0
+    def closure():
+        ind0 = hf_lookup()
+        if ind0 is not None:
+            for x,y in zip(parameter_sorted, cache[ind0][2]):
+                x.grad = y
+            return cache[ind0][1]
+        if profile is not None:
+            t0 = hf_time()
+        for x in parameter_sorted:
+            x.grad = None
+        loss = model()
+        if profile is not None:
+            t1 = hf_time()
+        if hasattr(model, 'grad_backward'):
+            model.grad_backward(loss)
+        else:
+            loss.backward()
+        loss = loss.detach()
+        if profile is not None:
+            t2 = hf_time()
+            for key in ['time_forward', 'time_backward', 'time_convert', 'num_fval', 'num_grad', 'memory']:
+                profile.setdefault(key, 0)
+            profile['time_forward'] += t1-t0
+            profile['time_backward'] += t2-t1
+            profile['num_fval'] += 1
+            profile['num_grad'] += 1
+            profile['memory'] = max(profile['memory'], _get_peak_memory(device))
+        num_eval[0] += 1
+        cache.append(([x.detach().clone() for x in parameter_sorted], loss, [x.grad for x in parameter_sorted]))
+        return loss
+    fval = closure().item()
+    grad_max = max(x.grad.abs().max().item() for x in parameter_sorted)
+    nit = 0
+    success = True
+    message = 'CONVERGENCE: NORM_OF_PROJECTED_GRADIENT_<=_PGTOL'
+    while grad_max > tol:
+        if nit>=maxiter:
+            success = False
+            message = 'STOP: TOTAL NO. OF ITERATIONS REACHED LIMIT'
+            break
+        optimizer.step(closure)
+        nit += 1
+        fval_prev = fval
+        fval = closure().item() #from cache
+        cache[:] = [cache[hf_lookup()]]
+        grad_max = max(x.grad.abs().max().item() for x in parameter_sorted)
+        if callback is not None:
+            tmp0 = torch.cat([x.grad.detach().reshape(-1) for x in parameter_sorted]).cpu().numpy()
+            callback(get_model_flat_parameter(model), fval, tmp0)
+        if (fval_prev - fval) <= tol*max(abs(fval_prev), abs(fval), 1):
+            message = 'CONVERGENCE: REL_REDUCTION_OF_F_<=_FACTR*EPSMCH'
+            break
+    jac = torch.cat([x.grad.detach().reshape(-1) for x in parameter_sorted]).cpu().numpy()
+    ret = scipy.optimize.OptimizeResult(x=get_model_flat_parameter(model), fun=fval, jac=jac, nit=nit,
+                nfev=num_eval[0], njev=num_eval[0], success=success, status=0 if success else 1, message=message)
+    return ret
+
+
 def minimize(model, theta0=None, num_repeat=1, tol=1e-7, print_freq=0, method='L-BFGS-B',
             print_every_round=1, maxiter=None, early_stop_threshold=None,
-            callback=None, seed=None):
+            callback=None, seed=None, checkpoint=None, checkpoint_interval=60):
     r'''gradient-based optimization
 
     Parameters:
@@ -215,12 +465,19 @@ def minimize(model, theta0=None, num_repeat=1, tol=1e-7, print_freq=0, method='L
         num_repeat (int): number of repeat
         tol (float): tolerance
         print_freq (int): print frequency, non-positive means no print, if callback is used, this parameter is ignored
-        method (str): optimization method, see scipy.optimize.minimize
+        method (str): optimization method, see scipy.optimize.minimize. `'torch-lbfgs'` runs L-BFGS with strong-Wolfe
+            line search (torch.optim.LBFGS) directly on the model parameters without numpy-torch conversion in every
+            function evaluation, the stopping criteria are the same as `'L-BFGS-B'`
         print_every_round (int): print frequency for each round, non-positive means no print
         maxiter (int): maximum number of iterations, see scipy.optimize.minimize
         early_stop_threshold (float): if the loss is less than this value, the optimization will stop
         callback (None, MinimizeCallback): callback function, if None, MinimizeCallback(print_freq=print_freq) will be used
         seed (None, int): random seed
+        checkpoint (None, str): path of the checkpoint file. If not None, the current theta, the best result so far,
+            the random state and the callback history are saved periodically, and the optimization resumes from this
+            file if it exists. The file is removed when the optimization finishes. The internal state of the scipy
+            optimizer (e.g. L-BFGS history) is not saved, the interrupted round restarts from the last saved theta
+        checkpoint_interval (float): minimum time interval (in seconds) between two checkpoints
 
     Returns:
         ret (scipy.optimize.OptimizeResult): the result of scipy.optimize.minimize
@@ -234,15 +491,59 @@ def minimize(model, theta0=None, num_repeat=1, tol=1e-7, print_freq=0, method='L
     np_rng = np.random.default_rng(seed)
     hf_theta = _get_hf_theta(np_rng, theta0)
     num_parameter = len(get_model_flat_parameter(model))
-    hf_model = hf_model_wrapper(model)
+    hf_model = hf_model_wrapper(model, profile=None if (callback is None) else callback.profile_counter)
     theta_optim_best = None
+    index_best = None
+    round_start = 0
+    theta_resume = None
     kwargs = dict(tol=tol, method=method, jac=True)
     if maxiter is not None:
         kwargs['options'] = {'maxiter':maxiter}
-    for ind0 in range(num_repeat):
-        theta0 = hf_theta(num_parameter)
-        hf_callback = callback.to_callable(hf_model) if (callback is not None) else None
-        theta_optim = scipy.optimize.minimize(hf_model, theta0, callback=hf_callback, **kwargs)
+    if checkpoint is not None:
+        ckpt = _Checkpoint(checkpoint, interval=checkpoint_interval)
+        tmp0 = ckpt.load()
+        if tmp0 is not None:
+            assert tmp0['num_parameter']==num_parameter, f'checkpoint "{checkpoint}" does not match the model'
+            round_start = tmp0['round']
+            theta_resume = tmp0['theta']
+            theta_optim_best = tmp0['theta_optim_best']
+            index_best = tmp0['index_best']
+            np_rng.bit_generator.state = tmp0['np_rng']
+            torch.set_rng_state(tmp0['torch_rng'])
+            if callback is not None:
+                callback.state = tmp0['callback_state']
+                callback.history_state = tmp0['callback_history']
+        def hf_checkpoint(round_, theta):
+            # theta is None if round_ is not started yet
+            tmp0 = dict(num_parameter=num_parameter, round=round_, theta=theta,
+                    theta_optim_best=theta_optim_best, index_best=index_best,
+                    np_rng=np_rng.bit_generator.state, torch_rng=torch.get_rng_state(),
+                    callback_state=None if (callback is None) else callback.state,
+                    callback_history=None if (callback is None) else callback.history_state)
+            ckpt.save(tmp0)
+    else:
+        ckpt = None
+    for ind0 in range(round_start, num_repeat):
+        if theta_resume is None:
+            theta0 = hf_theta(num_parameter)
+        else:
+            theta0 = theta_resume
+            theta_resume = None
+        if (callback is not None) and (method!='torch-lbfgs'):
+            hf_callback = callback.to_callable(hf_model)
+        else:
+            hf_callback = callback #torch-lbfgs: called with (theta,fval,grad), no extra model evaluation
+        if ckpt is not None:
+            def hf_callback(theta, *args, _ind0=ind0, _hf0=hf_callback):
+                if _hf0 is not None:
+                    _hf0(theta, *args)
+                if ckpt.is_due():
+                    hf_checkpoint(_ind0, theta.copy())
+        if method=='torch-lbfgs':
+            theta_optim = _minimize_torch_lbfgs(model, theta0, tol=tol, maxiter=maxiter, callback=hf_callback,
+                        profile=None if (callback is None) else callback.profile_counter)
+        else:
+            theta_optim = scipy.optimize.minimize(hf_model, theta0, callback=hf_callback, **kwargs)
         if (theta_optim_best is None) or (theta_optim.fun<theta_optim_best.fun):
             index_best = ind0
             theta_optim_best = theta_optim
@@ -252,20 +553,166 @@ def minimize(model, theta0=None, num_repeat=1, tol=1e-7, print_freq=0, method='L
             callback.reset(save_history=True)
         if (early_stop_threshold is not None) and (theta_optim_best.fun<=early_stop_threshold):
             break
+        if (ckpt is not None) and ckpt.is_due():
+            hf_checkpoint(ind0+1, None)
     hf_model(theta_optim_best.x, tag_grad=False) #set theta and model.property
     if callback is not None:
         callback.state = callback.history_state[index_best]
+    if ckpt is not None:
+        ckpt.remove()
     return theta_optim_best
 
 
+def minimize_batch(model, theta0=None, tol:float=1e-7, maxiter:int=3000, history_size:int=10, seed=None):
+    r'''minimize a batch of independent problems in one model with a batched L-BFGS
+
+    The model solves a batch of independent problems at once, e.g. `numqi.entangle.AutodiffCHAREE` with `batch_size`.
+    It must provide `model.batch_size`, `model.batch_mask` (set to `None` here) and `model.loss_batch` (per-item loss
+    of the last evaluation), its `forward()` returns the summed loss, and each parameter is stored item-major, i.e.
+    `x.reshape(batch_size,-1)[i]` belongs to the i-th item. The forward/backward passes are batched, while the
+    L-BFGS state is per item: each item has its own history, backtracking (Armijo) line search and stopping test
+    (the same `ftol=gtol=tol` criteria as scipy L-BFGS-B), so the items do not slow down each other and a converged
+    item is not moved any more.
+
+    Parameters:
+        model (torch.nn.Module): the batched model to be optimized
+        theta0 (None, str, np.ndarray, callable): the initial value of theta, see `numqi.optimize.minimize`
+        tol (float): tolerance of the per-item stopping test
+        maxiter (int): maximum number of iterations
+        history_size (int): number of the L-BFGS correction pairs per item
+        seed (None, int): random seed
+
+    Returns:
+        loss (np.ndarray): per-item loss, `shape=(batch_size,)`
+        theta (np.ndarray): the optimal parameters of the model
+    '''
+    assert hasattr(model, 'batch_mask') and hasattr(model, 'loss_batch') and (model.batch_size is not None)
+    np_rng = np.random.default_rng(seed)
+    parameter_sorted = _get_sorted_parameter(model)
+    assert all((not x.is_complex()) for x in parameter_sorted), 'minimize_batch only supports real parameters'
+    batch_size = model.batch_size
+    assert all(x.numel()%batch_size==0 for x in parameter_sorted)
+    size_list = [x.numel()//batch_size for x in parameter_sorted]
+    if theta0 is not None:
+        set_model_flat_parameter(model, _get_hf_theta(np_rng, theta0)(sum(x.numel() for x in parameter_sorted)))
+    model.batch_mask = None
+    def hf_set(theta):
+        for x,y in zip(parameter_sorted, torch.split(theta, size_list, dim=1)):
+            x.data.copy_(y.reshape(x.shape))
+    def hf_eval(theta):
+        # per-item loss and gradient, (batch_size,), (batch_size,N)
+        hf_set(theta)
+        for x in parameter_sorted:
+            x.grad = None
+        loss = model()
+        if hasattr(model, 'grad_backward'):
+            model.grad_backward(loss)
+        else:
+            loss.backward()
+        grad = torch.cat([(torch.zeros_like(x) if (x.grad is None) else x.grad).reshape(batch_size,-1)
+                    for x in parameter_sorted], dim=1)
+        return model.loss_batch.detach().clone(), grad
+    theta = torch.cat([x.detach().reshape(batch_size,-1) for x in parameter_sorted], dim=1)
+    fval,grad = hf_eval(theta)
+    hist_s = theta.new_zeros(history_size, *theta.shape)
+    hist_y = theta.new_zeros(history_size, *theta.shape)
+    hist_rho = theta.new_zeros(history_size, batch_size) #0 for empty slot
+    gamma = torch.clamp(1/grad.abs().sum(dim=1), max=1) #initial inverse Hessian scale
+    active = grad.abs().amax(dim=1) > tol
+    eps = torch.finfo(theta.dtype).eps
+    for ind_iter in range(maxiter):
+        if not active.any():
+            break
+        # two-loop recursion, newest to oldest pair
+        tmp0 = [(ind_iter-1-x)%history_size for x in range(history_size)]
+        q = grad.clone()
+        alpha_list = []
+        for ind0 in tmp0:
+            alpha = hist_rho[ind0] * (hist_s[ind0]*q).sum(dim=1)
+            q -= alpha[:,None]*hist_y[ind0]
+            alpha_list.append(alpha)
+        q *= gamma[:,None]
+        for ind0,alpha in zip(reversed(tmp0), reversed(alpha_list)):
+            beta = hist_rho[ind0] * (hist_y[ind0]*q).sum(dim=1)
+            q += hist_s[ind0]*(alpha-beta)[:,None]
+        direction = -q
+        gd = (grad*direction).sum(dim=1)
+        ind_reset = gd >= 0 #not a descent direction, restart with steepest descent
+        if ind_reset.any():
+            hist_rho[:,ind_reset] = 0
+            direction[ind_reset] = -grad[ind_reset] * gamma[ind_reset,None]
+            gd = (grad*direction).sum(dim=1)
+        direction[~active] = 0
+        # backtracking line search for all the items in one forward pass per trial
+        step = torch.ones_like(fval)
+        searching = active.clone()
+        theta_new,fval_new,grad_new = theta.clone(),fval.clone(),grad.clone()
+        for _ in range(30):
+            theta_trial = torch.where(searching[:,None], theta + step[:,None]*direction, theta_new)
+            fval_trial,grad_trial = hf_eval(theta_trial)
+            tmp1 = searching & (fval_trial <= fval + 1e-4*step*gd) & torch.isfinite(fval_trial)
+            theta_new[tmp1] = theta_trial[tmp1]
+            fval_new[tmp1] = fval_trial[tmp1]
+            grad_new[tmp1] = grad_trial[tmp1]
+            searching &= ~tmp1
+            if not searching.any():
+                break
+            step = torch.where(searching, step/2, step)
+        # items whose line search fails are at the precision limit, stop them
+        ind_update = active & (~searching)
+        s = theta_new - theta
+        y = grad_new - grad
+        sy = (s*y).sum(dim=1)
+        yy = (y*y).sum(dim=1)
+        tmp1 = ind_update & (sy > eps*yy)
+        ind_slot = ind_iter%history_size
+        hist_s[ind_slot] = s
+        hist_y[ind_slot] = y
+        hist_rho[ind_slot] = torch.where(tmp1, 1/torch.where(tmp1, sy, 1), 0)
+        gamma = torch.where(tmp1, sy/torch.where(tmp1, yy, 1), gamma)
+        tmp2 = (fval - fval_new) <= tol*torch.clamp(torch.maximum(fval.abs(), fval_new.abs()), min=1)
+        converged = tmp2 | (grad_new.abs().amax(dim=1) <= tol)
+        theta,fval,grad = theta_new,fval_new,grad_new
+        active &= ind_update & (~converged)
+    hf_set(theta)
+    with torch.no_grad():
+        model()
+    loss = model.loss_batch.detach().cpu().numpy().copy()
+    return loss,get_model_flat_parameter(model)
+
+
 def minimize_adam(model, num_step, theta0='no-init', optim_args=('adam',0.01),
-            seed=None, tqdm_update_freq=20, early_stop_threshold=None, tag_return_history=False):
+            seed=None, tqdm_update_freq=20, early_stop_threshold=None, tag_return_history=False,
+            checkpoint=None, checkpoint_interval=60):
+    r'''optimize the model with torch.optim.SGD or torch.optim.Adam
+
+    Parameters:
+        model (torch.nn.Module): the model to be optimized
+        num_step (int): number of steps
+        theta0 (str, np.ndarray, callable): the initial value of theta, 'no-init' means using the current parameters
+            of the model, see `numqi.optimize.minimize` for other options
+        optim_args (tuple): `('adam',lr)` or `('sgd',lr)`, or `('adam',lr_start,lr_end)` for exponential decay
+        seed (None, int): random seed
+        tqdm_update_freq (int): update frequency of the progress bar, non-positive means no progress bar
+        early_stop_threshold (float): if the loss is less than this value, the optimization will stop
+        tag_return_history (bool): if True, return the loss history
+        checkpoint (None, str): path of the checkpoint file. If not None, the parameters, the optimizer state,
+            the learning rate scheduler state, the random state and the best result so far are saved periodically,
+            and the optimization resumes from this file if it exists. The file is removed when the optimization finishes
+        checkpoint_interval (float): minimum time interval (in seconds) between two checkpoints
+
+    Returns:
+        loss_best (float): the best loss
+        loss_history (list[float]): the loss history, only returned if `tag_return_history=True`
+    '''
     # TODO num_repeat
     assert optim_args[0] in {'sgd', 'adam'}
     use_tqdm = tqdm_update_freq>0
     np_rng = np.random.default_rng(seed)
     num_parameter = len(get_model_flat_parameter(model))
-    if theta0!='no-init':
+    ckpt = None if (checkpoint is None) else _Checkpoint(checkpoint, interval=checkpoint_interval)
+    ckpt_state = None if (ckpt is None) else ckpt.load()
+    if (theta0!='no-init') and (ckpt_state is None):
         theta0 = _get_hf_theta(np_rng, theta0)(num_parameter)
         set_model_flat_parameter(model, theta0)
     if optim_args[0]=='sgd':
@@ -277,10 +724,22 @@ def minimize_adam(model, num_step, theta0='no-init', optim_args=('adam',0.01),
         lr_scheduler = torch.optim.lr_scheduler.ExponentialLR(optimizer, gamma=tmp0)
     else:
         lr_scheduler = None
-    tmp0 = tqdm(range(num_step)) if use_tqdm else contextlib.nullcontext(range(num_step))
+    step_start = 0
     loss_best = None
     theta_best = None
     loss_history = []
+    if ckpt_state is not None:
+        assert ckpt_state['num_parameter']==num_parameter, f'checkpoint "{checkpoint}" does not match the model'
+        set_model_flat_parameter(model, ckpt_state['theta'])
+        optimizer.load_state_dict(ckpt_state['optimizer'])
+        if lr_scheduler is not None:
+            lr_scheduler.load_state_dict(ckpt_state['lr_scheduler'])
+        torch.set_rng_state(ckpt_state['torch_rng'])
+        step_start = ckpt_state['step']
+        loss_best = ckpt_state['loss_best']
+        theta_best = ckpt_state['theta_best']
+        loss_history = ckpt_state['loss_history']
+    tmp0 = tqdm(range(step_start, num_step)) if use_tqdm else contextlib.nullcontext(range(step_start, num_step))
     with tmp0 as pbar:
         for ind0 in pbar:
             optimizer.zero_grad()
@@ -299,10 +758,18 @@ def minimize_adam(model, num_step, theta0='no-init', optim_args=('adam',0.01),
                 pbar.set_postfix(loss=f'{loss_i:.12f}')
             if (early_stop_threshold is not None) and (loss_i<=early_stop_threshold):
                 break
+            if (ckpt is not None) and ckpt.is_due():
+                tmp1 = dict(num_parameter=num_parameter, step=ind0+1, theta=get_model_flat_parameter(model),
+                        optimizer=optimizer.state_dict(), torch_rng=torch.get_rng_state(),
+                        lr_scheduler=None if (lr_scheduler is None) else lr_scheduler.state_dict(),
+                        loss_best=loss_best, theta_best=theta_best, loss_history=loss_history)
+                ckpt.save(tmp1)
     # set theta and model.property (sometimes)
     set_model_flat_parameter(model, theta_best)
     with torch.no_grad():
         model()
+    if ckpt is not None:
+        ckpt.remove()
     ret = (loss_best, loss_history) if tag_return_history else loss_best
     return ret
 
@@ -1,3 +1,9 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import inspect
 import functools
 import collections
 import numpy as np
@@ -175,7 +181,8 @@ def get_von_neumann_entropy(rho:np.ndarray|torch.Tensor, _torch_logm:str|tuple='
 
     Parameters:
         rho (np.ndarray,torch.Tensor): a density matrix, shape=(dim,dim)
-        _torch_logm (str,tuple): 'eigen' or ('pade',num_sqrtm,pade_order), 'pade' is used only when requires_grad
+        _torch_logm (str,tuple): 'eigen' or ('pade',num_sqrtm,pade_order), 'pade' is used only when requires_grad.
+            'eigen' uses one `eigh` with the Daleckii-Krein backward `numqi._torch_op.PSDMatrixLogmEigen`
 
     Returns:
         ret (float): the von Neumann entropy of the density matrix
@@ -290,10 +297,8 @@ def get_purity(rho):
 
 def _get_psd_logm(mat, method):
     if isinstance(mat, torch.Tensor):
-        eps = torch.tensor(torch.finfo(mat.dtype).eps)
         if method=='eigen':
-            EVL,EVC = torch.linalg.eigh(mat)
-            ret = (EVC * torch.log(torch.maximum(eps, EVL))) @ EVC.T.conj()
+            ret = numqi._torch_op.PSDMatrixLogmEigen.apply(mat)
         else:
             assert (len(method)==3) and (method[0]=='pade')
             logm_op = numqi._torch_op.get_PSDMatrixLogm(int(method[1]), int(method[2]))
@@ -312,14 +317,20 @@ def get_relative_entropy(rho, sigma, tr_rho_log_rho:float=None, _torch_logm=('pa
     $$ S(\rho,\sigma) = \mathrm{Tr}(\rho \log\rho - \rho \log\sigma) $$
 
     Parameters:
-        rho (np.ndarray,torch.Tensor): a density matrix, shape=(dim,dim)
-        sigma (np.ndarray,torch.Tensor): a density matrix, shape=(dim,dim)
-        tr_rho_log_rho (float,None): tr(rho log(rho)), if None, calculate it
-        _torch_logm (str,tuple): 'eigen' or ('pade',num_sqrtm,pade_order), 'pade' is used only when requires_grad
+        rho (np.ndarray,torch.Tensor): a density matrix, shape=(dim,dim) (support batch)
+        sigma (np.ndarray,torch.Tensor): a density matrix, shape=(dim,dim) (support batch)
+        tr_rho_log_rho (float,None): tr(rho log(rho)), if None, calculate it. For batch input, it can be an array of the batch shape
+        _torch_logm (str,tuple): 'eigen' or ('pade',num_sqrtm,pade_order), 'pade' is used only when requires_grad.
+            'eigen' uses one `eigh` with the Daleckii-Krein backward `numqi._torch_op.PSDMatrixLogmEigen`
 
     Returns:
-        ret (float,torch.Tensor): the relative entropy of the density matrices
+        ret (float,torch.Tensor): the relative entropy of the density matrices, for batch input, `shape=rho.shape[:-2]`
     '''
+    shape = rho.shape
+    assert (len(shape)>=2) and (shape[-1]==shape[-2]) and (sigma.shape==shape)
+    dim = shape[-1]
+    rho = rho.reshape(-1, dim, dim)
+    sigma = sigma.reshape(-1, dim, dim)
     is_torch = isinstance(rho, torch.Tensor)
     if is_torch:
         eps = torch.tensor(torch.finfo(rho.dtype).eps)
@@ -328,24 +339,22 @@ def get_relative_entropy(rho, sigma, tr_rho_log_rho:float=None, _torch_logm=('pa
             tmp0 = numqi._torch_op.get_PSDMatrixLogm(int(_torch_logm[1]), int(_torch_logm[2]))
             log_sigma = tmp0(sigma)
         else:
-            EVL,EVC = torch.linalg.eigh(sigma)
-            log_sigma = (EVC * torch.log(torch.maximum(eps, EVL))) @ EVC.T.conj()
-        ret = - torch.vdot(rho.reshape(-1), log_sigma.reshape(-1)).real
+            log_sigma = numqi._torch_op.PSDMatrixLogmEigen.apply(sigma)
+        ret = - torch.einsum(rho.reshape(-1,dim*dim).conj(), [0,1], log_sigma.reshape(-1,dim*dim), [0,1], [0]).real
         if tr_rho_log_rho is None:
             EVL = torch.maximum(eps, torch.linalg.eigvalsh(rho))
-            ret = ret + torch.dot(EVL, torch.log(EVL))
-        else:
-            ret = tr_rho_log_rho + ret
+            ret = ret + torch.einsum(EVL, [0,1], torch.log(EVL), [0,1], [0])
     else: #numpy
         eps = np.finfo(rho.dtype).eps
         EVL,EVC = np.linalg.eigh(sigma)
-        log_sigma = (EVC * np.log(np.maximum(eps, EVL))) @ EVC.T.conj()
-        ret = - np.vdot(rho.reshape(-1), log_sigma.reshape(-1)).real
+        log_sigma = (EVC * np.log(np.maximum(eps, EVL))[:,np.newaxis]) @ EVC.transpose(0,2,1).conj()
+        ret = - np.einsum(rho.reshape(-1,dim*dim).conj(), [0,1], log_sigma.reshape(-1,dim*dim), [0,1], [0], optimize=True).real
         if tr_rho_log_rho is None:
             EVL = np.maximum(eps, np.linalg.eigvalsh(rho))
-            ret = ret + np.dot(EVL, np.log(EVL))
-        else:
-            ret = tr_rho_log_rho + ret
+            ret = ret + np.einsum(EVL, [0,1], np.log(EVL), [0,1], [0], optimize=True)
+    ret = ret[0] if (len(shape)==2) else ret.reshape(shape[:-2])
+    if tr_rho_log_rho is not None:
+        ret = tr_rho_log_rho + ret
     return ret
 
 def get_tetrahedron_POVM(num_qubit:int=1):
@@ -398,3 +407,170 @@ def is_positive_semi_definite(np0:np.ndarray, shift:float=0.0, hermitian_eps:flo
     except np.linalg.LinAlgError:
         ret = False
     return ret
+
+
+def get_disk_cache_dir():
+    r'''get the directory of the on-disk cache used by `numqi.utils.disk_cache`
+
+    The on-disk cache is opt-in: it is enabled only if the environment variable `$NUMQI_CACHE_DIR` is set to a
+    non-empty directory, e.g. `NUMQI_CACHE_DIR=~/.cache/numqi`.
+
+    Returns:
+        ret (str|None): the cache directory, `None` if disabled
+    '''
+    ret = os.environ.get('NUMQI_CACHE_DIR', '')
+    ret = os.path.expanduser(ret) if ret else None
+    return ret
+
+
+def _disk_cache_key_normalize(x):
+    # numpy scalars and python scalars of the same value share the same key
+    if isinstance(x, np.generic):
+        ret = x.item()
+    elif isinstance(x, (list,tuple)):
+        ret = type(x)(_disk_cache_key_normalize(y) for y in x)
+    else:
+        ret = x
+    return ret
+
+
+def _disk_cache_set_readonly(x):
+    if isinstance(x, np.ndarray):
+        x.setflags(write=False)
+    elif isinstance(x, (list,tuple)):
+        for y in x:
+            _disk_cache_set_readonly(y)
+
+
+def _disk_cache_flatten(x, array_list:list):
+    if isinstance(x, np.ndarray):
+        assert x.dtype!=object
+        array_list.append(x)
+        ret = {'a': len(array_list)-1}
+    elif isinstance(x, (list,tuple)):
+        ret = {('l' if isinstance(x,list) else 't'): [_disk_cache_flatten(y, array_list) for y in x]}
+    elif isinstance(x, np.generic):
+        ret = {'v': x.item()}
+    else:
+        assert (x is None) or isinstance(x, (bool,int,float,str))
+        ret = {'v': x}
+    return ret
+
+
+def _disk_cache_unflatten(x:dict, array_list:list):
+    if 'a' in x:
+        ret = array_list[x['a']]
+    elif 'l' in x:
+        ret = [_disk_cache_unflatten(y, array_list) for y in x['l']]
+    elif 't' in x:
+        ret = tuple(_disk_cache_unflatten(y, array_list) for y in x['t'])
+    else:
+        ret = x['v']
+    return ret
+
+
+def _disk_cache_load(path:str):
+    # return None if miss, otherwise a tuple of length 1 (the cached value can be None)
+    tmp0 = os.path.join(path, 'tree.json')
+    if not os.path.exists(tmp0):
+        return None
+    try:
+        with open(tmp0, 'r') as fid:
+            tmp1 = json.load(fid)
+        array_list = []
+        for ind0 in range(tmp1['num_array']):
+            tmp2 = os.path.join(path, f'{ind0}.npy')
+            try:
+                # pages are shared between processes through the OS page cache
+                array_list.append(np.load(tmp2, mmap_mode='r'))
+            except ValueError: #empty array can not be mmap-ed
+                array_list.append(np.load(tmp2))
+        ret = (_disk_cache_unflatten(tmp1['tree'], array_list),)
+        os.utime(path) #mtime is used for LRU eviction
+    except (OSError, ValueError, KeyError):
+        ret = None
+    return ret
+
+
+def _disk_cache_save(path:str, value, maxsize:float):
+    array_list = []
+    tree = _disk_cache_flatten(value, array_list)
+    tmp0 = f'{path}.tmp{os.getpid()}'
+    try:
+        os.makedirs(tmp0, exist_ok=True)
+        for ind0,x in enumerate(array_list):
+            np.save(os.path.join(tmp0, f'{ind0}.npy'), np.ascontiguousarray(x))
+        with open(os.path.join(tmp0, 'tree.json'), 'w') as fid:
+            json.dump({'num_array':len(array_list), 'tree':tree}, fid)
+        os.rename(tmp0, path) #atomic, fail if another process has written the same entry
+    except OSError:
+        pass
+    shutil.rmtree(tmp0, ignore_errors=True)
+    _disk_cache_evict(os.path.dirname(os.path.dirname(path)), maxsize)
+
+
+def _disk_cache_evict(cache_dir:str, maxsize:float):
+    entry_list = []
+    for x in os.scandir(cache_dir):
+        if x.is_dir():
+            for y in os.scandir(x.path):
+                if y.is_dir() and ('.tmp' not in y.name):
+                    try:
+                        tmp0 = sum(z.stat().st_size for z in os.scandir(y.path))
+                        entry_list.append((y.stat().st_mtime, tmp0, y.path))
+                    except OSError: #removed by another process
+                        pass
+    total = sum(x[1] for x in entry_list)
+    for _,size,path in sorted(entry_list):
+        if total<=maxsize:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def disk_cache(version:int=0, min_time:float=1.0):
+    r'''decorator, cache the return value of a function of hashable arguments on disk, shared across processes
+    (e.g. spawn workers) and sessions. Combine it with `functools.lru_cache` (outer) to avoid disk access in-process.
+
+    Each entry is a directory of `.npy` files (instead of a single `.npz`) so that arrays are loaded with `mmap_mode='r'`,
+    the returned arrays are read-only, whether they are computed or loaded. The total size is bounded by
+    `$NUMQI_CACHE_MAXSIZE` (in MB, default 1024), least recently used entries are evicted first. The cache is disabled
+    unless `$NUMQI_CACHE_DIR` is set, see `numqi.utils.get_disk_cache_dir`
+
+    Parameters:
+        version (int): bump it when the implementation of the function changes to invalidate old entries,
+            the entries are also keyed by `numqi.__version__`
+        min_time (float): only cache the results which take at least `min_time` seconds to compute
+
+    Returns:
+        ret (callable): decorator. The return value of the decorated function must be a nested list/tuple of
+            `np.ndarray` and python scalars
+    '''
+    def hf_decorator(func):
+        signature = inspect.signature(func)
+        name = f'{func.__module__}.{func.__qualname__}'
+        @functools.wraps(func)
+        def hf0(*args, **kwargs):
+            cache_dir = get_disk_cache_dir()
+            if cache_dir is None:
+                ret = func(*args, **kwargs)
+                _disk_cache_set_readonly(ret)
+                return ret
+            tmp0 = signature.bind(*args, **kwargs)
+            tmp0.apply_defaults()
+            tmp1 = sorted((k,_disk_cache_key_normalize(v)) for k,v in tmp0.arguments.items())
+            tmp2 = repr((numqi.__version__, version, tmp1))
+            path = os.path.join(cache_dir, name, hashlib.sha1(tmp2.encode()).hexdigest())
+            ret = _disk_cache_load(path)
+            if ret is not None:
+                _disk_cache_set_readonly(ret[0]) #empty arrays are not mmap-ed
+                return ret[0]
+            t0 = time.perf_counter()
+            ret = func(*args, **kwargs)
+            _disk_cache_set_readonly(ret)
+            if (time.perf_counter()-t0) >= min_time:
+                maxsize = float(os.environ.get('NUMQI_CACHE_MAXSIZE', 1024))*2**20
+                _disk_cache_save(path, ret, maxsize)
+            return ret
+        return hf0
+    return hf_decorator
@@ -25,12 +25,37 @@ def test_qudit_partial_trace_AC_to_AB():
                 assert np.all(np.linalg.eigvalsh(ret0)+1e-7>0) #almost PSD (ignoring rounding error)
 
 
+def test_partial_trace_ABk_to_AB_kernel():
+    hf_randc = lambda *x: np.random.randn(*x) + 1j*np.random.randn(*x)
+    for dimA,dimB,k in [(2,2,3), (3,2,5), (2,3,4), (3,4,3)]:
+        Bij = numqi.dicke.get_partial_trace_ABk_to_AB_index(k, dimB)
+        kernel = numqi.dicke.get_partial_trace_ABk_to_AB_kernel(k, dimB)
+        num_klist = numqi.dicke.get_dicke_number(k, dimB)
+        np0 = hf_randc(5, dimA, num_klist)
+        ret_ = numqi.dicke.partial_trace_ABk_to_AB(np0, Bij)
+        ret0 = numqi.dicke.partial_trace_ABk_to_AB(np0, kernel)
+        assert np.abs(ret_-ret0).max() < 1e-10
+        ret1 = numqi.dicke.partial_trace_ABk_to_AB(np0[0], kernel)
+        assert np.abs(ret_[0]-ret1).max() < 1e-10
+
+        torch0 = torch.tensor(np0, dtype=torch.complex128, requires_grad=True)
+        Bij_torch = [[torch.tensor(y) for y in x] for x in Bij]
+        tmp0 = [torch.complex128,torch.int64,torch.complex128]
+        kernel_torch = tuple(torch.tensor(x,dtype=y) for x,y in zip(kernel,tmp0))
+        tmp1 = torch.tensor(hf_randc(dimA*dimB, dimA*dimB), dtype=torch.complex128)
+        hf0 = lambda x: (numqi.dicke.partial_trace_ABk_to_AB(torch0, x) * tmp1).real.sum()
+        grad_ = torch.autograd.grad(hf0(Bij_torch), torch0)[0]
+        grad0 = torch.autograd.grad(hf0(kernel_torch), torch0)[0]
+        assert torch.abs(grad_-grad0).max().item() < 1e-10
+
+
 def test_get_dicke_klist():
     para_list = [(2,2), (2,3), (2,4), (2,5), (3,2), (3,3), (3,4), (3,5)]
     for n,d in para_list:
         tmp0 = np.array(numqi.dicke.get_dicke_klist(n, d))
         assert tmp0.shape==(scipy.special.binom(n+d-1, d-1), d)
         assert np.all(tmp0.sum(axis=1)==n)
+        assert np.array_equal(numqi.dicke._get_dicke_klist_rank(tmp0, n), np.arange(tmp0.shape[0]))
 
 
 def test_get_dicke_basis():
@@ -56,6 +81,15 @@ def test_get_partial_trace_ABk_to_AB_index():
         ret_ = np.einsum(tmp0, [0,1,2], tmp0, [3,4,2], [1,4,0,3], optimize=True)
         assert np.abs(Brsab - ret_).max() < 1e-10
 
+    # the return value is a copy, modifying it does not affect the cache
+    Brsab = numqi.dicke.get_partial_trace_ABk_to_AB_index(3, 3, return_tensor=True)
+    Brsab[:] = 0
+    Bij = numqi.dicke.get_partial_trace_ABk_to_AB_index(3, 3)
+    Bij[0][2][:] = 0
+    Brsab = numqi.dicke.get_partial_trace_ABk_to_AB_index(3, 3, return_tensor=True)
+    assert np.abs(Brsab).max() > 0
+    assert np.abs(numqi.dicke.get_partial_trace_ABk_to_AB_index(3, 3)[0][2]).max() > 0
+
 
 def test_get_qubit_dicke_partial_trace():
     for num_qubit in [2,3,4,5,6]:
@@ -40,3 +40,56 @@ def test_pyramid_sixparam_equivalent():
     # model = numqi.entangle.LocalUnitaryEquivalentModel(3, 3, num_term=4)
     # model.set_density_matrix(dm_tiles, dm_pyramid)
     # theta_optim = numqi.optimize.minimize(model, num_repeat=10, print_every_round=1, tol=1e-8)
+
+
+def test_BESNumEigenModel_batch():
+    batch_size = 5
+    for kind in ['3x3', '3qubit']:
+        if kind=='3x3':
+            model = numqi.entangle.BESNumEigenModel(3, 3, rank0=4, batch_size=batch_size)
+            model_single = numqi.entangle.BESNumEigenModel(3, 3, rank0=4)
+        else:
+            model = numqi.entangle.BESNumEigen3qubitModel(rank0=4, batch_size=batch_size)
+            model_single = numqi.entangle.BESNumEigen3qubitModel(rank0=4)
+        loss_batch = model.get_loss_batch().detach().numpy()
+        assert loss_batch.shape==(batch_size,)
+        for ind0 in range(batch_size):
+            model_single.rho_vec.data[:] = model.rho_vec.data[ind0]
+            assert abs(model_single().item()-loss_batch[ind0]) < 1e-12
+
+    model = numqi.entangle.BESNumEigenModel(3, 3, rank0=4, batch_size=8)
+    loss,rho_vec = numqi.entangle.search_bes_batch(model, num_step=400, lr=0.01, num_keep=3, num_check=100, use_tqdm=False)
+    assert (len(loss)<=3) and (rho_vec.shape==(len(loss),80)) and np.all(np.diff(loss)>=0)
+    assert np.abs(np.linalg.norm(rho_vec, axis=1)-1).max() < 1e-10
+
+
+def test_search_bes_batch():
+    # 3x3 rank-4 BES, see example/ws_entangle/draft_find_BES.py
+    batch_size = 4
+    threshold = 1e-10
+    np_rng = np.random.default_rng(2)
+    model = numqi.entangle.BESNumEigenModel(3, 3, rank0=4, batch_size=batch_size)
+    model.rho_vec.data[:] = torch.tensor(numqi.entangle.upb._bes_num_eigen_init_rho_vec(np_rng, 9, batch_size))
+    loss,rho_vec = numqi.entangle.search_bes_batch(model, num_step=1500, lr=0.01, num_keep=20, num_check=100,
+                threshold=threshold, seed=2, use_tqdm=False)
+    assert len(loss)>batch_size #harvested candidates are restarted
+    assert np.sum(loss<threshold)>=2
+    invariant = numqi.entangle.upb._get_local_unitary_invariant(rho_vec, (3,3))
+    tmp0 = np.abs(invariant[:,None]-invariant).max(axis=2)
+    assert tmp0[np.triu_indices(len(loss), 1)].min() > 1e-6
+    dm0,_ = numqi.entangle.upb._bes_num_eigen_boundary_dm(torch.tensor(rho_vec[loss<threshold]))
+    dm0 = dm0.numpy()
+    assert np.linalg.eigvalsh(dm0)[:,:5].max() < 1e-4 #rank 4
+    tmp0 = dm0.reshape(-1,3,3,3,3).transpose(0,1,4,3,2).reshape(-1,9,9)
+    assert np.linalg.eigvalsh(tmp0)[:,0].min() > -1e-4 #PPT
+
+
+def test_bes_local_unitary_invariant():
+    dm_tiles = numqi.entangle.load_upb('tiles', return_bes=True)[1]
+    dm_pyramid = numqi.entangle.load_upb('pyramid', return_bes=True)[1]
+    tmp0 = np.kron(numqi.random.rand_haar_unitary(3), numqi.random.rand_haar_unitary(3))
+    dm_tiles_lu = tmp0 @ dm_tiles @ tmp0.T.conj()
+    tmp1 = numqi.gellmann.dm_to_gellmann_basis(np.stack([dm_tiles, dm_tiles_lu, dm_pyramid]))
+    z0 = numqi.entangle.upb._get_local_unitary_invariant(tmp1, (3,3))
+    assert np.abs(z0[0]-z0[1]).max() < 1e-10
+    assert np.abs(z0[0]-z0[2]).max() > 1e-6
@@ -40,6 +40,17 @@ def test_AutodiffCHAREE_boundary():
     assert abs(beta-0.22792) < 5e-4
 
 
+def test_AutodiffCHAREE_werner_batch():
+    dim = 3
+    alpha_list = np.linspace(0, 1, 8, endpoint=False)
+    ree_analytical = np.array([numqi.state.get_Werner_ree(dim, x) for x in alpha_list])
+    model = numqi.entangle.AutodiffCHAREE((dim, dim), distance_kind='ree', batch_size=len(alpha_list))
+    model.set_dm_target(np.stack([numqi.state.Werner(dim, x) for x in alpha_list]))
+    ree_cha,_ = numqi.optimize.minimize_batch(model, tol=1e-12)
+    assert ree_cha.shape==alpha_list.shape
+    assert np.abs(ree_cha-ree_analytical).max() < 1e-8
+
+
 def test_convex_hull_approximation_iterative():
     dm0 = numqi.entangle.load_upb('tiles', return_bes=True)[1]
     beta,history_info = numqi.entangle.CHABoundaryBagging((3,3)).solve(dm0, maxiter=150, return_info=True, use_tqdm=False)
@@ -51,3 +62,12 @@ def test_convex_hull_approximation_iterative():
     ret_ = numqi.entangle.hf_interpolate_dm(dm0, beta=beta)
     ret0 = np.einsum(lambda_,[0],ketA,[0,1],ketA.conj(),[0,3],ketB,[0,2],ketB.conj(),[0,4],[1,2,3,4],optimize=True).reshape(dm0.shape)
     assert np.abs(ret_-ret0).max() < 1e-6
+
+
+def test_convex_hull_approximation_column_generation():
+    # PPT is equivalent to separable for 2-qubit
+    for _ in range(3):
+        dm0 = numqi.random.rand_density_matrix(4)
+        beta_ppt = numqi.entangle.get_ppt_boundary(dm0, (2,2))[1]
+        beta = numqi.entangle.CHABoundaryBagging((2,2)).solve(dm0, maxiter=100, num_column=4)
+        assert abs(beta-beta_ppt) < 1e-5
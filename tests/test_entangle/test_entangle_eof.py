@@ -15,6 +15,28 @@ def test_eof_A_B():
     assert abs(ret0-ret1) < 1e-10
 
 
+def test_2qubit_measure_batch():
+    rho = np.stack([numqi.random.rand_density_matrix(4, k=x, seed=np_rng) for x in [1,2,3,4]*10])
+    rho[:8] = np.stack([numqi.state.Werner(2, x) for x in np.linspace(-1, 1, 8)])
+    hf_list = [numqi.entangle.get_concurrence_2qubit, numqi.entangle.get_eof_2qubit, numqi.entangle.get_gme_2qubit]
+    for hf0 in hf_list:
+        ret_ = np.array([hf0(x) for x in rho])
+        assert np.array_equal(hf0(rho), ret_)
+        assert np.array_equal(hf0(rho, chunk_size=7, num_thread=3), ret_)
+    tmp0 = numqi.state.get_Werner_eof(2, np.linspace(-1, 1, 8))
+    assert np.abs(numqi.entangle.get_eof_2qubit(rho[:8])-tmp0).max() < 1e-10
+
+    for dimA,dimB in [(2,3),(3,2),(3,3),(1,3)]:
+        psi = np.stack([numqi.random.rand_haar_state(dimA*dimB, seed=np_rng).reshape(dimA, dimB) for _ in range(10)])
+        for hf0 in [numqi.entangle.get_concurrence_pure, numqi.entangle.get_eof_pure]:
+            ret_ = np.array([hf0(x) for x in psi])
+            assert np.array_equal(hf0(psi), ret_)
+            assert np.array_equal(hf0(psi, chunk_size=3, num_thread=2), ret_)
+        tmp0 = np.linalg.svd(psi, compute_uv=False)**2
+        tmp1 = -np.sum(tmp0*np.log(np.maximum(tmp0, 1e-300)), axis=1)
+        assert np.abs(numqi.entangle.get_eof_pure(psi)-tmp1).max() < 1e-10
+
+
 def test_EntanglementFormationModel_separable():
     num_sample = 5
     for dimA,dimB in [(2,2),(3,4),(4,3)]:
@@ -61,6 +83,44 @@ def test_EntanglementFormationModel_werner():
         assert np.abs(ret_-ret0).max() < 1e-7
 
 
+def test_EntanglementFormationModel_batch():
+    alpha_list = np.linspace(-1, 1, 16)
+    rho = np.stack([numqi.state.Werner(2, x) for x in alpha_list])
+    model = numqi.entangle.EntanglementFormationModel(2, 2, 8, batch_size=len(alpha_list))
+    model.set_density_matrix(rho)
+    loss = model()
+    loss.backward()
+    ret_ = model.loss_batch.numpy().copy()
+    grad_ = model.manifold.theta.grad.numpy().copy()
+    model_single = numqi.entangle.EntanglementFormationModel(2, 2, 8)
+    for ind0 in [0,7,15]:
+        model_single.set_density_matrix(rho[ind0])
+        model_single.manifold.theta.data[:] = model.manifold.theta.data[ind0]
+        model_single.manifold.theta.grad = None
+        loss = model_single()
+        loss.backward()
+        assert abs(loss.item()-ret_[ind0]) < 1e-10
+        assert np.abs(model_single.manifold.theta.grad.numpy()-grad_[ind0]).max() < 1e-10
+    ret0,_ = numqi.optimize.minimize_batch(model, theta0='uniform', tol=1e-10)
+    assert np.abs(ret0-numqi.state.get_Werner_eof(2, alpha_list)).max() < 1e-7
+
+    dim = 3
+    alpha_list = np.linspace(-1, 1, 10)
+    rho = np.stack([numqi.state.Werner(dim, x) for x in alpha_list])
+    model = numqi.entangle.EntanglementFormationModel(dim, dim, 2*dim*dim, batch_size=len(alpha_list))
+    model.set_density_matrix(rho)
+    ret0,_ = numqi.optimize.minimize_batch(model, theta0='uniform', tol=1e-10)
+    assert np.abs(ret0-numqi.state.get_Werner_eof(dim, alpha_list)).max() < 1e-7
+
+    # separable states (zero concurrence) are hard to converge, see test_2qubits_Concurrence_EntanglementFormation
+    alpha_list = np.linspace(0.6, 1, 8)
+    rho = np.stack([numqi.state.Werner(2, x) for x in alpha_list])
+    model = numqi.entangle.ConcurrenceModel(2, 2, 12, batch_size=len(alpha_list))
+    model.set_density_matrix(rho)
+    ret0,_ = numqi.optimize.minimize_batch(model, theta0='uniform', tol=1e-10)
+    assert np.abs(ret0-numqi.entangle.get_concurrence_2qubit(rho)).max() < 1e-7
+
+
 def test_2qubits_Concurrence_EntanglementFormation():
     dimA = 2
     dimB = 2
@@ -1,4 +1,5 @@
 import numpy as np
+import torch
 
 import numqi
 
@@ -23,6 +24,29 @@ def test_entangle_check_swap_witness():
         assert numqi.entangle.check_swap_witness(tmp0)
 
 
+def test_batch_entanglement_criteria():
+    np_rng = np.random.default_rng()
+    for dim in [(2,2), (2,3), (3,3), (2,2,2)]:
+        N0 = int(np.prod(dim))
+        rho = np.stack([numqi.random.rand_density_matrix(N0, k=int(np_rng.integers(1, N0+1)), seed=np_rng) for _ in range(40)])
+        ret_ppt = numqi.entangle.is_ppt(rho, dim, chunk_size=16)
+        ret_reduction = numqi.entangle.check_reduction_witness(rho, dim, chunk_size=16)
+        assert ret_ppt.shape==(40,) and ret_ppt.dtype==np.bool_
+        assert np.all(ret_ppt <= ret_reduction) #reduction is weaker than PPT
+        assert np.array_equal(ret_ppt, [numqi.entangle.is_ppt(x, dim) for x in rho])
+        assert np.array_equal(ret_reduction, [numqi.entangle.check_reduction_witness(x, dim) for x in rho])
+        assert np.array_equal(ret_ppt, numqi.entangle.is_ppt(torch.tensor(rho), dim).numpy())
+        if len(dim)==2:
+            ret_neg = numqi.entangle.get_negativity(rho, dim)
+            tmp0 = rho.reshape(-1, *dim, *dim).transpose(0,1,4,3,2).reshape(rho.shape)
+            assert np.abs(ret_neg - (np.abs(np.linalg.eigvalsh(tmp0)).sum(axis=1)-1)/2).max() < 1e-10
+            assert np.all(ret_neg[ret_ppt] < 1e-6)
+            assert abs(numqi.entangle.get_negativity(rho[0], dim) - ret_neg[0]) < 1e-10
+            if dim[0]==dim[1]:
+                tmp0 = numqi.entangle.check_swap_witness(rho)
+                assert np.array_equal(tmp0, [numqi.entangle.check_swap_witness(x) for x in rho])
+
+
 def test_isotropic_state():
     np_rng = np.random.default_rng()
     for d in range(2,10):
@@ -62,3 +86,72 @@ def test_werner_state():
             assert not tmp0 #only d==2 is correct
         else:
             assert tmp0
+
+
+def test_ree_bisection_solve():
+    # zero inside the convex set, quadratic outside
+    threshold = 1e-7
+    xtol = 1e-4
+    for x_boundary,coeff in [(0.3,1),(0.05,20),(0.9,0.1)]:
+        hf0 = lambda x: coeff*max(0, x-x_boundary)**2
+        ret_ = x_boundary + np.sqrt(threshold/coeff)
+        ret0,history_info = numqi.entangle._misc._ree_bisection_solve(hf0, 0, 1, xtol, threshold, use_tqdm=False)
+        assert abs(ret0-ret_) < xtol
+        assert len(history_info) < np.ceil(np.log2(1/xtol))
+
+
+def test_get_adaptive_boundary():
+    # square rotated by 0.3, the corners are not on the initial grid
+    hf0 = lambda x: 1/np.maximum(np.abs(np.cos(x+0.3)), np.abs(np.sin(x+0.3)))
+    theta_list,beta_list = numqi.entangle.get_adaptive_boundary(hf0, num_point_init=16, num_point_max=64, tol=1e-3)
+    assert np.all(np.diff(theta_list)>0) and (theta_list[0]==0) and (theta_list[-1]<2*np.pi)
+    assert np.abs(beta_list-hf0(theta_list)).max() < 1e-12
+    tmp0 = np.abs(np.angle(np.exp(1j*(theta_list[:,np.newaxis] + 0.3 - np.pi/4 - np.pi/2*np.arange(4))))).min(axis=0)
+    assert tmp0.max() < 2*np.pi/64 #corners are resolved
+    # flat edges are not refined
+    assert len(theta_list) < 64
+
+    # uniform curvature is refined uniformly, multiple curves share the same angles
+    hf1 = lambda x: np.stack([np.ones_like(x), hf0(x)], axis=1)
+    theta_list,beta_list = numqi.entangle.get_adaptive_boundary(hf1, num_point_init=8, num_point_max=100,
+                                            tol=1e-3, theta_range=(0,np.pi/2))
+    assert beta_list.shape==(len(theta_list),2)
+    assert (theta_list[0]==0) and (theta_list[-1]==np.pi/2) and (len(theta_list)<=100)
+
+
+def test_group_dm_cross_section_moment():
+    np_rng = np.random.default_rng()
+    order = 1
+    template = np_rng.normal(size=(20, order+1)) + 1j*np_rng.normal(size=(20, order+1))
+    template[:,0] = template[:,0].real
+    moment = []
+    for ind0 in np_rng.integers(0, len(template), size=200):
+        tmp0 = template[ind0] if (np_rng.uniform()<0.5) else template[ind0].conj() #reflection
+        tmp0 = tmp0 * np.exp(1j*np.arange(order+1)*np_rng.uniform(0, 2*np.pi)) #rotation
+        moment.append(np.concatenate([tmp0.real, tmp0[1:].imag]))
+    moment = np.stack(moment)
+    group_list = numqi.entangle.group_dm_cross_section_moment(moment, zero_eps=1e-4)
+    ret_ = []
+    for ind0,moment_i in enumerate(moment):
+        for group in ret_:
+            if numqi.entangle.is_dm_cross_section_similar(moment[group[0]], moment_i, zero_eps=1e-4):
+                group.append(ind0)
+                break
+        else:
+            ret_.append([ind0])
+    assert group_list==ret_
+    assert len(group_list)<=len(template)
+
+
+def test_get_dm_cross_section_moment_trapezoid():
+    np_rng = np.random.default_rng()
+    for kind,dim,atol in [('dm',None,1e-10), ('ppt',(2,2),1e-6)]:
+        N0 = 4
+        op0 = np.stack([numqi.random.rand_density_matrix(N0, seed=np_rng)-np.eye(N0)/N0 for _ in range(3)])
+        op1 = np.stack([numqi.random.rand_density_matrix(N0, seed=np_rng)-np.eye(N0)/N0 for _ in range(3)])
+        ret_ = numqi.entangle.get_dm_cross_section_moment(op0, op1, order=2, dim=dim, kind=kind)
+        assert ret_.shape==(3,5)
+        ret0 = numqi.entangle.get_dm_cross_section_moment(op0, op1, order=2, dim=dim, kind=kind, num_node=2048)
+        assert np.abs(ret_-ret0).max() < atol
+        ret1 = numqi.entangle.get_dm_cross_section_moment(op0[0], op1[0], order=2, dim=dim, kind=kind, num_node=2048)
+        assert np.abs(ret1-ret0[0]).max() < 1e-12
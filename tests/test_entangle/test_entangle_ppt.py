@@ -127,6 +127,13 @@ def test_cvx_relative_entropy_entanglement_werner01():
     ret0 = numqi.entangle.get_ppt_ree(dm_list, dim, dim, sqrt_order=3, pade_order=3, use_tqdm=False)
     assert np.abs(ret_-ret0).max() < 1e-4 #1e-5 fail for solver=SCS
 
+    # cached problem and parallel solve
+    ret1 = numqi.entangle.get_ppt_ree(dm_list[-3:], dim, dim, sqrt_order=3, pade_order=3, use_tqdm=False, num_worker=2)
+    assert np.abs(ret_[-3:]-ret1).max() < 1e-4
+    assert numqi.entangle.ppt._get_ppt_ree_cvxP.cache_info().hits>=1
+    numqi.entangle.clear_sdp_cache()
+    assert numqi.entangle.ppt._get_ppt_ree_cvxP.cache_info().currsize==0
+
 # TODO rename all rho to dm
 
 def test_get_ppt_boundary():
@@ -186,6 +193,13 @@ def test_get_ppt_numerical_range():
     ret_ = np.array([s12, 1/2, s12, 1/2])
     assert np.abs(ret_-z0).max() < (1e-6 if USE_MOSEK else 1e-4)
 
+    # cached problem and parallel sweep
+    z1,boundary,normal = numqi.entangle.get_ppt_numerical_range([op0,op1], direction, dim=(2,2),
+                            use_tqdm=False, return_info=True, num_worker=2)
+    assert np.abs(ret_-z1).max() < (1e-6 if USE_MOSEK else 1e-4)
+    assert boundary.shape==(4,2) and normal.shape==(4,2)
+    assert np.abs(boundary - z1[:,np.newaxis]*direction).max() < 1e-4
+
 
 def test_get_generalized_ppt_boundary():
     rho = numqi.entangle.load_upb('tiles', return_bes=True)[1]
@@ -194,3 +208,20 @@ def test_get_generalized_ppt_boundary():
     assert abs(beta_gppt-ret_) < 3e-4
     # rho_norm = numqi.gellmann.dm_to_gellmann_norm(rho)
     # beta=0.8649*rho_norm=0.2279211623566359 https://arxiv.org/abs/1705.01523
+
+
+def test_is_generalized_ppt_batch():
+    np_rng = np.random.default_rng()
+    dim = (2,2,2)
+    rho = np.stack([numqi.random.rand_density_matrix(8, k=2, seed=np_rng) for _ in range(3)]
+                + [numqi.random.rand_density_matrix(8, seed=np_rng)*0.2+0.8*np.eye(8)/8 for _ in range(3)])
+    tag,info = numqi.entangle.is_generalized_ppt(rho, dim, return_info=True)
+    assert tag.shape==(6,)
+    assert np.array_equal(tag, numqi.entangle.is_generalized_ppt(rho, dim))
+    for ind0 in range(len(rho)):
+        tag_i,info_i = numqi.entangle.is_generalized_ppt(rho[ind0], dim, return_info=True)
+        assert tag_i==tag[ind0]
+        for x,y in zip(info, info_i):
+            assert (x[:2]==y[:2]) and abs(x[2][ind0]-y[2])<1e-10
+            tmp1 = rho[ind0].reshape(dim+dim).transpose(*y[0], *y[1]).reshape(int(np.prod([1]+[(dim+dim)[z] for z in y[0]])), -1)
+            assert abs(np.linalg.norm(tmp1, ord='nuc')-y[2]) < 1e-10
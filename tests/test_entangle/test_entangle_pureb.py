@@ -47,6 +47,48 @@ def test_pureb_werner2_ree():
             assert abs(ret0-ret_) < 1e-8
 
 
+def test_pureb_werner2_ree_batch():
+    dim = 2
+    kext = 5
+    alpha_kext_boundary = (kext+dim**2-dim)/(kext*dim+dim-1)
+    alpha_list = np.linspace(0, 1, 8, endpoint=False)
+    dm_target = np.stack([numqi.state.Werner(dim, x) for x in alpha_list])
+    tmp0 = numqi.state.Werner(dim, alpha_kext_boundary)
+    ret_ = numqi.utils.get_relative_entropy(dm_target, np.broadcast_to(tmp0, dm_target.shape))
+    ret_[alpha_list<=alpha_kext_boundary] = 0
+    model = numqi.entangle.PureBosonicExt(dim, dim, kext=kext, distance_kind='ree', batch_size=len(alpha_list))
+    model.set_dm_target(dm_target)
+    ret0,_ = numqi.optimize.minimize_batch(model, tol=1e-12)
+    assert np.abs(ret0-ret_).max() < 1e-8
+
+
+def test_quantum_pureb_batch():
+    for dimA,dimB,kext in [(2,2,8),(2,3,4),(3,2,6)]:
+        model = numqi.entangle.QuantumPureBosonicExt(dimA, dimB, kext, num_layer=3, batch_size=4)
+        op = numqi.random.rand_hermitian_matrix(dimA*dimB, seed=np_rng)
+        model.set_expectation_op(op)
+        loss = model()
+        loss.backward()
+        dm_batch = model.dm_torch.numpy()
+        assert np.abs(np.trace(dm_batch, axis1=1, axis2=2)-1).max() < 1e-10
+        assert np.abs(dm_batch - dm_batch.transpose(0,2,1).conj()).max() < 1e-10
+        assert np.linalg.eigvalsh(dm_batch)[:,0].min() > -1e-10
+        ret_ = model.loss_batch.numpy()
+        grad_ = model.theta.grad.numpy().copy()
+        model_single = numqi.entangle.QuantumPureBosonicExt(dimA, dimB, kext, num_layer=3)
+        model_single.set_expectation_op(op)
+        model_single.mps_basis_alpha = model.mps_basis_alpha
+        model_single.matB = model.matB
+        for ind0 in range(4):
+            model_single.theta.data[:] = model.theta.data[ind0]
+            model_single.theta.grad = None
+            loss = model_single()
+            loss.backward()
+            assert abs(loss.item()-ret_[ind0]) < 1e-10
+            assert np.abs(model_single.dm_torch.numpy()-dm_batch[ind0]).max() < 1e-10
+            assert np.abs(model_single.theta.grad.numpy()-grad_[ind0]).max() < 1e-10
+
+
 def test_pureb_boundary_werner2():
     # about 10 seconds
     dim = 2
@@ -142,3 +184,18 @@ def test_pureb_boundary_tiles_upb_bes_k16():
 # def test_pureb_boundary_tiles_upb_bes_k32():
 #     # obtained from previous running
 #     _pureb_boundary_tiles_upb_bes_hf0(kext=32, ret_=0.231290449794623)
+
+
+def test_pureb_numerical_range_num_worker():
+    op0 = numqi.random.rand_hermitian_matrix(4, seed=233)
+    op1 = numqi.random.rand_hermitian_matrix(4, seed=234)
+    model = numqi.entangle.PureBosonicExt(2, 2, kext=8)
+    num_theta = 12
+    theta_list = np.linspace(0, 2*np.pi, num_theta)
+    kwargs = dict(num_theta=num_theta, num_repeat=3, converge_tol=1e-10, use_tqdm=False, seed=233)
+    ret0 = model.get_numerical_range(op0, op1, **kwargs)
+    ret1 = model.get_numerical_range(op0, op1, warm_start=True, num_worker=2, **kwargs)
+    assert ret1.shape==(num_theta,2)
+    # support function of the convex set
+    hf0 = lambda x: np.cos(theta_list)*x[:,0] + np.sin(theta_list)*x[:,1]
+    assert np.abs(hf0(ret0)-hf0(ret1)).max() < 1e-6
@@ -1,5 +1,6 @@
 import itertools
 import numpy as np
+import pytest
 
 import numqi
 
@@ -29,22 +30,28 @@ def test_get_symmetric_extension_index_list():
 # TODO test sep in 2ext
 # TODO test dB=2 sym-ext is always bosonic-ext
 def test_is_ABk_symmetric_ext_naive():
-    dimA = 2
-    dimB = 3
-    kext = 3
-
-    np0 = numqi.random.rand_ABk_density_matrix(dimA, dimB, kext)
-    np1 = np.trace(np0.reshape(dimA*dimB,dimB**(kext-1),dimA*dimB,dimB**(kext-1)), axis1=1, axis2=3)
-    has_kext,np2 = numqi.entangle.symext.is_ABk_symmetric_ext_naive(np1, (dimA,dimB), kext)
+    for dimA,dimB,kext in [(2,3,3),(2,2,4)]:
+        np0 = numqi.random.rand_ABk_density_matrix(dimA, dimB, kext)
+        np1 = np.trace(np0.reshape(dimA*dimB,dimB**(kext-1),dimA*dimB,dimB**(kext-1)), axis1=1, axis2=3)
+        has_kext,np2 = numqi.entangle.symext.is_ABk_symmetric_ext_naive(np1, (dimA,dimB), kext)
+        assert has_kext
+        assert np.abs(np2-np2.T.conj()).max() < 1e-7
+        assert np.linalg.eigvalsh(np2)[0] > -1e-7
+        tmp0 = np.trace(np2.reshape(dimA*dimB,dimB**(kext-1), dimA*dimB,dimB**(kext-1)), axis1=1, axis2=3)
+        assert np.abs(tmp0-np1).max() < 1e-7
+        tmp0 = np2.reshape([dimA]+[dimB]*kext+[dimA]+[dimB]*kext)
+        for indI,indJ in itertools.combinations(list(range(kext)), 2):
+            tmp1 = np.arange(2*kext+2, dtype=np.int64)
+            tmp1[[indI+1,indJ+1]] = tmp1[[indJ+1,indI+1]]
+            tmp1[[indI+2+kext,indJ+2+kext]] = tmp1[[indJ+2+kext,indI+2+kext]]
+            assert np.abs(tmp0-np.transpose(tmp0,tmp1)).max() < 1e-7
+
+    # the old positional index_kind is accepted and ignored, use_ppt is keyword-only
+    with pytest.warns(DeprecationWarning):
+        has_kext,_ = numqi.entangle.symext.is_ABk_symmetric_ext_naive(np1, (dimA,dimB), kext, '2d')
     assert has_kext
-    tmp0 = np.trace(np2.reshape(dimA*dimB,dimB**(kext-1), dimA*dimB,dimB**(kext-1)), axis1=1, axis2=3)
-    assert np.abs(tmp0-np1).max() < 1e-7
-    tmp0 = np2.reshape([dimA]+[dimB]*kext+[dimA]+[dimB]*kext)
-    for indI,indJ in itertools.combinations(list(range(kext)), 2):
-        tmp1 = np.arange(2*kext+2, dtype=np.int64)
-        tmp1[[indI+1,indJ+1]] = tmp1[[indJ+1,indI+1]]
-        tmp1[[indI+2+kext,indJ+2+kext]] = tmp1[[indJ+2+kext,indI+2+kext]]
-        assert np.abs(tmp0-np.transpose(tmp0,tmp1)).max() < 1e-7
+    with pytest.raises(TypeError):
+        numqi.entangle.symext.is_ABk_symmetric_ext_naive(np1, (dimA,dimB), kext, '2d', True)
 
 
 def test_get_cvxpy_transpose0213_indexing():
@@ -56,6 +63,15 @@ def test_get_cvxpy_transpose0213_indexing():
     assert np.abs(ret_-ret0).max() < 1e-10
 
 
+def test_get_cvxpy_partial_transpose_indexing():
+    N0,N1 = 2,3
+    np0 = np_rng.normal(size=(N0*N1,N0*N1))
+    ret_ = np0.reshape(N0,N1,N0,N1).transpose(0,3,2,1).reshape(N0*N1,N0*N1)
+    ind0 = numqi.entangle.symext.get_cvxpy_partial_transpose_indexing(N0, N1)
+    ret0 = np.reshape(np.reshape(np0, -1, order='F')[ind0], (N0*N1,N0*N1), order='F')
+    assert np.abs(ret_-ret0).max() < 1e-10
+
+
 def test_werner_state_kext():
     dim = 3
     kext = 3
@@ -162,6 +178,28 @@ def test_SymmetricExtABkIrrepModel():
     assert (np.linalg.eigvalsh(rhoAB)[0] + 1e-10) > 0
 
 
+def test_SymmetricExtABkIrrepModel_batch():
+    dim = 3
+    kext = 3 #boundary alpha=9/11
+    num_repeat = 3
+    alpha_list = np.array([0.3, 0.6, 0.9, 1])
+    dm_list = np.stack([numqi.state.Werner(dim, x) for x in alpha_list])
+    model = numqi.entangle.symext.SymmetricExtABkIrrepModel(dim, dim, kext)
+    ret_ = []
+    for dm in dm_list:
+        model.set_dm_target(dm)
+        ret_.append(numqi.optimize.minimize(model, num_repeat=num_repeat, tol=1e-12, print_every_round=0, seed=0).fun)
+    ret_ = np.array(ret_)
+
+    # each state is repeated in the batch as different initializations, the parametrization has local minima
+    model = numqi.entangle.symext.SymmetricExtABkIrrepModel(dim, dim, kext, batch_size=num_repeat*len(alpha_list))
+    model.set_dm_target(np.concatenate([dm_list]*num_repeat, axis=0))
+    ret0,_ = numqi.optimize.minimize_batch(model, tol=1e-12, seed=0)
+    assert ret0.shape==(num_repeat*len(alpha_list),)
+    ret0 = ret0.reshape(num_repeat, -1).min(axis=0)
+    assert np.abs(ret_-ret0).max() < 1e-7
+
+
 def test_get_ABk_symmetric_extension_ree_werner():
     # time: mosek, num_point=4
     num_point = 4
@@ -197,6 +235,16 @@ def test_get_ABk_symmetric_extension_ree_werner():
             assert np.abs(ret0-ret_).max() < (1e-5 if USE_MOSEK else 1e-4)
 
 
+def test_get_ABk_symmetric_extension_ree_ppt():
+    # two-qubit: PPT is equivalent to separable
+    dm_list = [numqi.state.Werner(2, x) for x in [0.5, 0.8]]
+    ret0 = numqi.entangle.get_ABk_symmetric_extension_ree(dm_list, (2,2), kext=2, use_ppt=True)
+    ret1 = numqi.entangle.get_ABk_symmetric_extension_ree(dm_list, (2,2), kext=2, use_ppt=False)
+    ret_ = numqi.entangle.get_ppt_ree(np.stack(dm_list), 2, 2, use_tqdm=False)
+    assert np.abs(ret0-ret_).max() < 1e-4
+    assert np.all(ret0 > ret1-1e-4)
+
+
 def test_witness():
     dimA = 3
     dimB = 3
@@ -88,6 +88,50 @@ def test_gme_4qubit():
     assert np.abs(ret_-ret_model).max() < 1e-7
 
 
+def _dense_to_mps(factor, dim_list):
+    ret = []
+    tmp0 = factor
+    bond = 1
+    for dim in dim_list[:-1]:
+        U,S,V = np.linalg.svd(tmp0.reshape(bond*dim, -1), full_matrices=False)
+        tmp1 = (S>1e-12).sum()
+        ret.append(U[:,:tmp1].reshape(bond, dim, tmp1))
+        tmp0 = S[:tmp1,np.newaxis] * V[:tmp1]
+        bond = tmp1
+    ret.append(tmp0.reshape(bond, dim_list[-1], -1))
+    return ret
+
+
+def test_DensityMatrixGMEModel_factor():
+    num_qubit = 5
+    dim_list = [2]*num_qubit
+    factor = np.stack([np.sqrt(0.6)*numqi.state.GHZ(num_qubit), np.sqrt(0.4)*numqi.state.W(num_qubit)], axis=1)
+    factor_mps = _dense_to_mps(factor, dim_list)
+    for CPrank in [1,2]:
+        kwargs = dict(num_ensemble=6, rank=2, CPrank=CPrank)
+        model = numqi.entangle.DensityMatrixGMEModel(dim_list, **kwargs)
+        state_dict = model.state_dict()
+        ret_ = None
+        for chunk_size,factor_i in [(None,factor),(4,factor),(None,factor_mps),(4,factor_mps)]:
+            model = numqi.entangle.DensityMatrixGMEModel(dim_list, chunk_size=chunk_size, **kwargs)
+            model.load_state_dict(state_dict)
+            model.set_density_matrix_factor(factor_i)
+            loss = model()
+            loss.backward()
+            grad = np.concatenate([x.grad.numpy().reshape(-1) for x in model.parameters()])
+            if ret_ is None:
+                ret_ = loss.item(), grad
+            assert abs(loss.item()-ret_[0]) < 1e-12
+            assert np.abs(grad-ret_[1]).max() < 1e-12
+
+    # https://doi.org/10.1103/PhysRevA.68.042307
+    num_qubit = 8
+    model = numqi.entangle.DensityMatrixGMEModel([2]*num_qubit, num_ensemble=2, rank=1, chunk_size=1)
+    model.set_density_matrix_factor(_dense_to_mps(numqi.state.W(num_qubit).reshape(-1,1), [2]*num_qubit))
+    ret0 = numqi.optimize.minimize(model, num_repeat=3, tol=1e-12, print_every_round=0).fun
+    assert abs(ret0-(1-((num_qubit-1)/num_qubit)**(num_qubit-1))) < 1e-8
+
+
 def test_flip_op():
     dimA = 3
     dimB = 4
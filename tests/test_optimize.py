@@ -17,6 +17,133 @@ class Rosenbrock(torch.nn.Module):
         ret = 100*torch.dot(tmp0, tmp0) + torch.dot(tmp1,tmp1)
         return ret
 
+class BatchRosenbrock(torch.nn.Module):
+    def __init__(self, scale:np.ndarray, num_parameter=3) -> None:
+        super().__init__()
+        self.scale = torch.tensor(scale, dtype=torch.float64)
+        self.batch_size = len(scale)
+        self.theta = torch.nn.Parameter(torch.zeros(self.batch_size, num_parameter, dtype=torch.float64))
+        self.batch_mask = None
+        self.loss_batch = None
+        # solution [1,1,...,1] 0
+
+    def forward(self):
+        tmp0 = self.theta[:,1:] - self.theta[:,:-1]
+        tmp1 = 1-self.theta
+        loss = self.scale*(tmp0*tmp0).sum(dim=1) + (tmp1*tmp1).sum(dim=1)
+        self.loss_batch = loss.detach()
+        ret = loss.sum()
+        return ret
+
 def test_gradient_correct():
     model = Rosenbrock(num_parameter=5)
     numqi.optimize.check_model_gradient(model, zero_eps=1e-4)
+
+
+class _InterruptedModel(torch.nn.Module):
+    def __init__(self, model, num_call):
+        super().__init__()
+        self.model = model
+        self.num_call = num_call
+
+    def forward(self):
+        self.num_call -= 1
+        if self.num_call<0:
+            raise KeyboardInterrupt
+        return self.model()
+
+
+def test_minimize_checkpoint(tmp_path):
+    checkpoint = str(tmp_path / 'checkpoint.pt')
+    model = _InterruptedModel(Rosenbrock(num_parameter=5), num_call=30)
+    callback = numqi.optimize.MinimizeCallback(print_freq=1, tag_print=False)
+    kwargs = dict(theta0='uniform', num_repeat=3, tol=1e-12, print_every_round=0, seed=233,
+                  checkpoint=checkpoint, checkpoint_interval=0)
+    try:
+        numqi.optimize.minimize(model, callback=callback, **kwargs)
+        assert False, 'should be interrupted'
+    except KeyboardInterrupt:
+        pass
+    assert (tmp_path / 'checkpoint.pt').exists()
+    model.num_call = np.inf
+    callback = numqi.optimize.MinimizeCallback(print_freq=1, tag_print=False)
+    theta_optim = numqi.optimize.minimize(model, callback=callback, **kwargs)
+    assert abs(theta_optim.fun) < 1e-7
+    assert len(callback.history_state)==3
+    assert not (tmp_path / 'checkpoint.pt').exists()
+
+
+def test_minimize_adam_checkpoint(tmp_path):
+    checkpoint = str(tmp_path / 'checkpoint.pt')
+    model = Rosenbrock(num_parameter=5)
+    kwargs = dict(num_step=100, theta0='uniform', optim_args=('adam',0.01,0.001), seed=233,
+                  tqdm_update_freq=0, tag_return_history=True)
+    loss_best, loss_history = numqi.optimize.minimize_adam(model, **kwargs)
+
+    model = _InterruptedModel(model, num_call=50)
+    try:
+        numqi.optimize.minimize_adam(model, checkpoint=checkpoint, checkpoint_interval=0, **kwargs)
+        assert False, 'should be interrupted'
+    except KeyboardInterrupt:
+        pass
+    model.num_call = np.inf
+    ret0, ret1 = numqi.optimize.minimize_adam(model, checkpoint=checkpoint, checkpoint_interval=0, **kwargs)
+    assert abs(ret0-loss_best) < 1e-10
+    assert np.abs(np.array(ret1)-np.array(loss_history)).max() < 1e-10
+    assert not (tmp_path / 'checkpoint.pt').exists()
+
+
+def test_minimize_callback_profile():
+    model = Rosenbrock(num_parameter=5)
+    callback = numqi.optimize.MinimizeCallback(print_freq=0, extra_key='profile', tag_print=False)
+    theta_optim = numqi.optimize.minimize(model, num_repeat=2, tol=1e-10, print_every_round=0, callback=callback, seed=233)
+    assert theta_optim.fun < 1e-7
+    num_iter = sum(len(x['profile']) for x in callback.history_state)
+    num_fval = callback.profile_counter['num_fval']
+    ret = callback.get_profile_summary(tag_print=False)
+    assert ret['num_iteration']==num_iter
+    # the last evaluation hf_model(theta_optim_best.x) in minimize() is after the last callback
+    assert ret['num_fval'][0] <= num_fval
+    assert ret['num_grad'][0] >= num_iter
+    assert all(ret[x][0]>=0 for x in ['time_forward','time_backward','time_convert','time_step','time_callback'])
+
+    # only the evaluations made by the optimizer are counted in num_fval, the same for scipy and torch-lbfgs
+    for method in ['L-BFGS-B','torch-lbfgs']:
+        callback = numqi.optimize.MinimizeCallback(print_freq=0, extra_key='profile', tag_print=False)
+        theta_optim = numqi.optimize.minimize(model, num_repeat=1, tol=1e-10, print_every_round=0, callback=callback,
+                                              method=method, seed=233)
+        ret = callback.get_profile_summary(tag_print=False)
+        assert ret['num_fval'][0]==theta_optim.nfev
+        assert ret['num_iteration']==theta_optim.nit
+        assert ret['num_fval_callback'][0]==(theta_optim.nit if (method=='L-BFGS-B') else 0)
+
+
+def test_minimize_torch_lbfgs():
+    model = Rosenbrock(num_parameter=10)
+    callback = numqi.optimize.MinimizeCallback(print_freq=1, extra_key='profile', tag_print=False)
+    theta_optim = numqi.optimize.minimize(model, theta0='uniform', num_repeat=3, tol=1e-12, method='torch-lbfgs',
+                                          print_every_round=0, callback=callback, seed=233)
+    assert theta_optim.fun < 1e-10
+    assert np.abs(theta_optim.x - 1).max() < 1e-4
+    assert np.abs(model.theta.detach().numpy() - theta_optim.x).max() < 1e-12
+    assert callback.get_profile_summary(tag_print=False)['time_convert'][0]==0
+
+    theta_optim = numqi.optimize.minimize(model, theta0='uniform', tol=1e-12, method='torch-lbfgs', maxiter=3,
+                                          print_every_round=0, seed=233)
+    assert (theta_optim.nit==3) and (not theta_optim.success)
+
+
+def test_minimize_batch():
+    # items of very different condition number are solved as independent problems
+    scale = np.array([1, 100, 1e4, 1e6])
+    np_rng = np.random.default_rng(233)
+    theta0 = np_rng.uniform(-1, 1, size=(len(scale),5))
+    model = BatchRosenbrock(scale, num_parameter=5)
+    loss,theta = numqi.optimize.minimize_batch(model, theta0.reshape(-1), tol=1e-14)
+    assert loss.shape==(len(scale),)
+    assert np.abs(theta.reshape(len(scale),-1) - 1).max() < 1e-6
+    for ind0 in range(len(scale)):
+        model_i = BatchRosenbrock(scale[ind0:(ind0+1)], num_parameter=5)
+        loss_i,theta_i = numqi.optimize.minimize_batch(model_i, theta0[ind0], tol=1e-14)
+        assert abs(loss_i[0]-loss[ind0]) < 1e-12
+        assert np.abs(theta_i-theta.reshape(len(scale),-1)[ind0]).max() < 1e-10
@@ -1,5 +1,6 @@
 import numpy as np
 import scipy.linalg
+import scipy.stats
 import torch
 
 import numqi
@@ -46,3 +47,22 @@ def test_PSDMatrixLogm():
     hf0 = lambda x: (scipy.linalg.logm(x @ x.T.conj())*np1).real.sum()
     ret_ = numqi.optimize.finite_difference_central(hf0, np0, zero_eps=1e-4)
     assert np.abs(ret_-ret0).max() < 1e-6
+
+
+def test_PSDMatrixLogmEigen():
+    N0 = 4
+    batch_size = 3
+    np0 = np_rng.normal(size=(batch_size,N0,N0)) + 1j*np_rng.normal(size=(batch_size,N0,N0))
+    # near-degenerate eigenvalues for the last one
+    tmp0 = scipy.stats.unitary_group.rvs(N0, random_state=np_rng)
+    np0[-1] = tmp0 * np.sqrt(np.array([1, 1+1e-9, 0.3, 0.3]))
+    np1 = np_rng.normal(size=(batch_size,N0,N0)) + 1j*np_rng.normal(size=(batch_size,N0,N0))
+    torch0 = torch.tensor(np0, dtype=torch.complex128, requires_grad=True)
+    torch1 = numqi._torch_op.PSDMatrixLogmEigen.apply(torch0 @ torch0.transpose(1,2).conj())
+    loss = (torch1*torch.tensor(np1, dtype=torch.complex128)).real.sum()
+    loss.backward()
+    ret0 = torch0.grad.numpy()
+
+    hf0 = lambda x: sum((scipy.linalg.logm(y @ y.T.conj())*z).real.sum() for y,z in zip(x,np1))
+    ret_ = numqi.optimize.finite_difference_central(hf0, np0, zero_eps=1e-5)
+    assert np.abs(ret_-ret0).max() < 1e-6
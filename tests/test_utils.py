@@ -45,3 +45,42 @@ def test_trace_distance_contraction():
     tmp1 = numqi.channel.apply_kraus_op(kop, rho1)
     ret1 = numqi.utils.get_trace_distance(tmp0, tmp1)
     assert ret1 < (ret0+1e-10) #epsilon is added to avoid rounding error
+
+
+def test_disk_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('NUMQI_CACHE_DIR', str(tmp_path))
+    num_call = [0]
+    def hf0(n:int, scale:float=1.0):
+        num_call[0] += 1
+        ret = [np.arange(n)*scale, (np.eye(n), n, None), np.zeros(0)]
+        return ret
+    hf1 = numqi.utils.disk_cache(min_time=0)(hf0)
+    ret_ = hf0(3, scale=2.0)
+    ret0 = hf1(3, 2.0)
+    ret1 = hf1(n=3, scale=2.0) #loaded from disk
+    assert num_call[0]==2
+    for x in [ret0,ret1]:
+        assert isinstance(x, list) and isinstance(x[1], tuple)
+        assert np.abs(x[0]-ret_[0]).max() < 1e-12
+        assert np.abs(x[1][0]-ret_[1][0]).max() < 1e-12
+        assert (x[1][1]==3) and (x[1][2] is None) and (x[2].shape==(0,))
+    assert not any(x.flags.writeable for y in [ret0,ret1] for x in [y[0],y[1][0],y[2]])
+    hf1(np.int64(3), scale=np.float64(2)) #numpy scalar shares the key
+    assert num_call[0]==2
+    hf1(4)
+    assert num_call[0]==3
+    tmp0 = [x for x in tmp_path.iterdir()]
+    assert len(tmp0)==1 and (len(list(tmp0[0].iterdir()))==2)
+
+    # LRU eviction
+    monkeypatch.setenv('NUMQI_CACHE_MAXSIZE', '0')
+    hf1(5)
+    assert len(list(tmp0[0].iterdir()))==0
+
+    monkeypatch.setenv('NUMQI_CACHE_DIR', '')
+    assert numqi.utils.get_disk_cache_dir() is None
+    monkeypatch.delenv('NUMQI_CACHE_DIR') #opt-in
+    assert numqi.utils.get_disk_cache_dir() is None
+    ret2 = hf1(3, 2.0)
+    assert num_call[0]==5
+    assert not ret2[0].flags.writeable
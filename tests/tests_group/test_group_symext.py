@@ -56,6 +56,14 @@ def test_get_sud_symmetric_irrep_basis():
         tmp1 = [y for x in tmp0 for y in x]
         assert np.abs(scipy.linalg.block_diag(*tmp1) - dm1).max() < 1e-10
 
+    # the return value is a copy, modifying it does not affect the cache
+    basis_B_list = numqi.group.symext.get_sud_symmetric_irrep_basis(3, 3)
+    basis_B_list[0][0][:] = 0
+    basis_B_list.pop()
+    basis_B_list = numqi.group.symext.get_sud_symmetric_irrep_basis(3, 3)
+    assert len(basis_B_list)==3
+    assert np.abs(basis_B_list[0][0]).max() > 0
+
 
 def test_get_B3_irrep_basis():
     dimA = 2
@@ -59,3 +59,21 @@ def test_get_real_bipartite_numerical_range01():
     w1i_bound_list = np.array(w1i_bound_list)
     assert w1i_bound_list[c_list<1/4].max() < 0
     assert w1i_bound_list[c_list>1/4].min() > 0
+
+
+def test_get_joint_algebraic_numerical_range_support():
+    dim = 5
+    op_list = [numqi.random.rand_hermitian_matrix(dim, seed=np_rng) for _ in range(3)]
+    direction = np_rng.normal(size=(23,3))
+    support,boundary,normal = numqi.matrix_space.get_joint_algebraic_numerical_range_support(op_list, direction, return_info=True, batch_size=4)
+    assert np.abs(np.linalg.norm(normal, axis=1)-1).max() < 1e-10
+    assert np.abs((boundary*normal).sum(axis=1) - support).max() < 1e-10
+    support1,boundary1,_ = numqi.matrix_space.get_joint_algebraic_numerical_range_support(op_list, direction, return_info=True, method='lanczos')
+    assert np.abs(support-support1).max() < 1e-8
+    assert np.abs(boundary-boundary1).max() < 1e-6
+
+    # the SDP boundary point is the support point along its own normal vector
+    _,boundary_sdp,normal_sdp = numqi.matrix_space.get_joint_algebraic_numerical_range(op_list, direction[:3], return_info=True, use_tqdm=False)
+    tmp0 = numqi.matrix_space.get_joint_algebraic_numerical_range_support(op_list, normal_sdp)
+    tmp1 = (boundary_sdp*normal_sdp).sum(axis=1) / np.linalg.norm(normal_sdp, axis=1)
+    assert np.abs(tmp0-tmp1).max() < 1e-5